@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+__all__ = ['MockBridge', 'StreamReceiver']
+
+from .mock_bridge import MockBridge
+from .stream_receiver import StreamReceiver
@@ -0,0 +1,515 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import random
+import re
+import ssl
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue, Empty
+from hue import Clipv1, Clipv2, RateLimiter
+from hue.eventstream import merge_state
+
+
+class MockBridge:
+    """
+    Local stand-in for a Hue bridge serving the parts of the Clipv2 API used by this project: lights, rooms, zones,
+    grouped lights, devices, the bridge resource, an entertainment configuration, PUTs to lights and grouped lights,
+    starting and stopping streaming and the event stream. The same lights and groups are served through the v1 API
+    for Clipv1. Responses can be slowed down with latency and jitter, and a share of them can be failed on purpose.
+    """
+    APPLICATION_KEY = 'mock-application-key'
+    LIGHTS_PER_ROOM = 10
+    # Event stream clients that haven't read this many events are dropped
+    MAX_STREAM_BACKLOG = 1000
+
+    def __init__(self, lights=10, latency=0.0, jitter=0.0, error_rate=0.0, host='127.0.0.1', port=0, certfile=None,
+                 keyfile=None, seed=None):
+        """
+        :param lights: number of lights to simulate
+        :param latency: seconds added to every response
+        :param jitter: maximum random deviation from latency in seconds
+        :param error_rate: share of requests answered with a 503 error, between 0 and 1
+        :param host:
+        :param port: 0 picks a free port
+        :param certfile: serve HTTPS with this certificate, plain HTTP is used without one
+        :param keyfile:
+        :param seed: seed for the generated ids, latency and errors
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.streams = []
+        self.stats = {'requests': 0, 'errors': 0, 'events': 0}
+        self.resources = self._generate(lights)
+
+        self.server = ThreadingHTTPServer((host, port), MockBridgeHandler)
+        self.server.daemon_threads = True
+        self.server.bridge = self
+        self.protocol = 'http://'
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+            self.protocol = 'https://'
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return host+':'+str(port)
+
+    def start(self):
+        """
+        Serves requests from a background thread
+        :return:
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving and disconnects all event stream clients
+        :return:
+        """
+        with self.lock:
+            for stream in self.streams:
+                stream.put(None)
+            self.streams = []
+        self.server.shutdown()
+        self.server.server_close()
+
+    def client(self, rate_limited=False, api='v2', **kwargs):
+        """
+        Creates a client for this bridge
+        :param rate_limited: apply the default bridge rate limits, otherwise the client sends as fast as it can
+        :param api: 'v2' for Clipv2 or 'v1' for Clipv1
+        :param kwargs: passed on to the client
+        :return:
+        """
+        if not rate_limited and 'rate_limiter' not in kwargs:
+            kwargs['rate_limiter'] = RateLimiter({name: (1000000, 1000000) for name in RateLimiter.DEFAULT_LIMITS})
+        client_class = Clipv1 if api == 'v1' else Clipv2
+        return client_class(bridge=self.address, application_key=self.APPLICATION_KEY, protocol=self.protocol,
+                            **kwargs)
+
+    def _id(self):
+        return str(uuid.UUID(int=self.random.getrandbits(128), version=4))
+
+    def _generate(self, light_count):
+        """
+        Generates lights with their devices, rooms of LIGHTS_PER_ROOM lights with a grouped light each, a zone with
+        the first light of every room and the bridge itself
+        :param light_count:
+        :return: dict of resource type => dict of id => resource
+        """
+        resources = {name: {} for name in ('light', 'device', 'room', 'zone', 'grouped_light', 'bridge',
+                                           'entertainment_configuration')}
+        bridge_id = self._id()
+        resources['bridge'][bridge_id] = {'id': bridge_id, 'type': 'bridge', 'bridge_id': '001788fffe'+bridge_id[:6]}
+
+        def add_group(group_type, name, children, lights):
+            group_id = self._id()
+            grouped_light_id = self._id()
+            resources['grouped_light'][grouped_light_id] = {
+                'id': grouped_light_id, 'type': 'grouped_light', 'owner': {'rid': group_id, 'rtype': group_type},
+                'on': {'on': False}, 'dimming': {'brightness': 0.0}, 'lights': lights,
+            }
+            resources[group_type][group_id] = {
+                'id': group_id, 'type': group_type, 'metadata': {'name': name}, 'children': children,
+                'services': [{'rid': grouped_light_id, 'rtype': 'grouped_light'}],
+            }
+
+        room_children, room_lights, zone_children, zone_lights = [], [], [], []
+        for index in range(light_count):
+            light_id, device_id = self._id(), self._id()
+            resources['device'][device_id] = {
+                'id': device_id, 'type': 'device', 'metadata': {'name': 'Light '+str(index + 1)},
+                'services': [{'rid': light_id, 'rtype': 'light'}],
+            }
+            resources['light'][light_id] = {
+                'id': light_id, 'type': 'light', 'owner': {'rid': device_id, 'rtype': 'device'},
+                'metadata': {'name': 'Light '+str(index + 1)},
+                'on': {'on': self.random.random() < 0.5},
+                'dimming': {'brightness': round(self.random.uniform(1, 100), 2), 'min_dim_level': 0.2},
+                'color_temperature': {'mirek': self.random.randint(153, 454), 'mirek_valid': True,
+                                      'mirek_schema': {'mirek_minimum': 153, 'mirek_maximum': 454}},
+            }
+            room_children.append({'rid': device_id, 'rtype': 'device'})
+            room_lights.append(light_id)
+            if len(room_children) == self.LIGHTS_PER_ROOM or index == light_count - 1:
+                add_group('room', 'Room '+str(len(resources['room']) + 1), room_children, room_lights)
+                zone_children.append({'rid': light_id, 'rtype': 'light'})
+                zone_lights.append(light_id)
+                room_children, room_lights = [], []
+        if zone_children:
+            add_group('zone', 'Zone 1', zone_children, zone_lights)
+        if resources['light']:
+            config_id = self._id()
+            resources['entertainment_configuration'][config_id] = {
+                'id': config_id, 'type': 'entertainment_configuration', 'metadata': {'name': 'Entertainment area 1'},
+                'configuration_type': 'screen', 'status': 'inactive',
+                'channels': [{'channel_id': index, 'members': [{'service': {'rid': light_id, 'rtype': 'light'}}]}
+                             for index, light_id in enumerate(list(resources['light'])[:20])],
+            }
+        return resources
+
+    def delay(self):
+        """
+        Waits for the configured latency and jitter, returns True if this request should fail
+        :return:
+        """
+        with self.lock:
+            self.stats['requests'] += 1
+            delay = self.latency + self.random.uniform(-self.jitter, self.jitter) if self.jitter else self.latency
+            failed = self.error_rate and self.random.random() < self.error_rate
+            if failed:
+                self.stats['errors'] += 1
+        if delay > 0:
+            time.sleep(delay)
+        return failed
+
+    def get(self, resource_type, resource_id=None):
+        """
+        Returns the resources of a type, or a single resource, in a Clipv2 response body
+        :param resource_type:
+        :param resource_id:
+        :return: status code and body
+        """
+        with self.lock:
+            resources = self.resources.get(resource_type)
+            if resources is None:
+                return 404, error_body('Resource type '+resource_type+' not found')
+            if resource_id is None:
+                return 200, {'errors': [], 'data': [public(resource) for resource in resources.values()]}
+            if resource_id not in resources:
+                return 404, error_body('Resource '+resource_id+' not found')
+            return 200, {'errors': [], 'data': [public(resources[resource_id])]}
+
+    def put(self, resource_type, resource_id, body):
+        """
+        Applies a write to a light or grouped light and publishes the changes on the event stream
+        :param resource_type:
+        :param resource_id:
+        :param body:
+        :return: status code and body
+        """
+        if resource_type == 'entertainment_configuration':
+            return self._put_entertainment(resource_id, body)
+        if resource_type not in ('light', 'grouped_light'):
+            return 405, error_body('Method not allowed for '+resource_type)
+        with self.lock:
+            resource = self.resources[resource_type].get(resource_id)
+            if resource is None:
+                return 404, error_body('Resource '+resource_id+' not found')
+            if resource_type == 'light':
+                changed = [resource_id]
+            else:
+                changed = resource['lights']
+            events = []
+            for light_id in changed:
+                light = self.resources['light'][light_id]
+                merge_state(light, body)
+                event = {'id': light_id, 'type': 'light', 'owner': light['owner']}
+                event.update(body)
+                events.append(event)
+            merge_state(resource, body)
+            self._publish(events)
+            return 200, {'errors': [], 'data': [{'rid': resource_id, 'rtype': resource_type}]}
+
+    def get_v1(self, collection, resource_id=None):
+        """
+        Returns lights, groups or the bridge config in v1 format. Rooms and zones are listed under the ids of their
+        grouped lights, which is what group actions are sent to.
+        :param collection:
+        :param resource_id:
+        :return: status code and body
+        """
+        with self.lock:
+            if collection == 'config':
+                bridge = next(iter(self.resources['bridge'].values()))
+                return 200, {'name': 'Mock bridge', 'bridgeid': bridge['bridge_id'].upper(), 'apiversion': '1.50.0'}
+            if collection == 'lights':
+                items = {light_id: v1_light(light) for light_id, light in self.resources['light'].items()}
+            elif collection == 'groups':
+                items = {}
+                for group_type in ('room', 'zone'):
+                    for group in self.resources[group_type].values():
+                        grouped_light_id = group['services'][0]['rid']
+                        items[grouped_light_id] = {
+                            'name': group['metadata']['name'], 'type': group_type.capitalize(),
+                            'lights': list(self.resources['grouped_light'][grouped_light_id]['lights']),
+                        }
+            else:
+                return 404, [v1_error(3, '/'+collection, 'resource, /'+collection+', not available')]
+        if resource_id is None:
+            return 200, items
+        if resource_id not in items:
+            return 404, [v1_error(3, '/'+collection+'/'+resource_id, 'resource not available')]
+        return 200, items[resource_id]
+
+    def put_v1(self, collection, resource_id, body):
+        """
+        Applies a v1 light state or group action, group 0 being every light, and answers with v1 success entries
+        :param collection:
+        :param resource_id:
+        :param body:
+        :return: status code and body
+        """
+        state = {}
+        if 'on' in body:
+            state['on'] = {'on': body['on']}
+        if 'bri' in body:
+            state['dimming'] = {'brightness': round(body['bri'] * 100 / 254, 2)}
+        if 'ct' in body:
+            state['color_temperature'] = {'mirek': body['ct']}
+        if collection == 'lights':
+            status, result = self.put('light', resource_id, state)
+            address = '/lights/'+resource_id+'/state/'
+        elif resource_id == '0':
+            for light_id in list(self.resources['light']):
+                status, result = self.put('light', light_id, state)
+            address = '/groups/0/action/'
+        else:
+            status, result = self.put('grouped_light', resource_id, state)
+            address = '/groups/'+resource_id+'/action/'
+        if status != 200:
+            return status, [v1_error(3, address, error['description']) for error in result['errors']]
+        return 200, [{'success': {address+key: value}} for key, value in body.items()]
+
+    def _put_entertainment(self, config_id, body):
+        """
+        Starts or stops streaming for an entertainment configuration, frames themselves go to a StreamReceiver
+        :param config_id:
+        :param body:
+        :return: status code and body
+        """
+        if body.get('action') not in ('start', 'stop'):
+            return 400, error_body('action must be start or stop')
+        with self.lock:
+            config = self.resources['entertainment_configuration'].get(config_id)
+            if config is None:
+                return 404, error_body('Resource '+config_id+' not found')
+            config['status'] = 'active' if body['action'] == 'start' else 'inactive'
+            return 200, {'errors': [], 'data': [{'rid': config_id, 'rtype': 'entertainment_configuration'}]}
+
+    def _publish(self, data):
+        """
+        Queues an update event for every event stream client, must be called with the lock held
+        :param data:
+        :return:
+        """
+        message = [{'id': str(uuid.uuid4()), 'type': 'update', 'creationtime': time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    'data': data}]
+        self.stats['events'] += 1
+        for stream in list(self.streams):
+            if stream.qsize() > self.MAX_STREAM_BACKLOG:
+                self.streams.remove(stream)
+                stream.put(None)
+            else:
+                stream.put(message)
+
+    def subscribe(self):
+        queue = Queue()
+        with self.lock:
+            self.streams.append(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        with self.lock:
+            if queue in self.streams:
+                self.streams.remove(queue)
+
+
+class MockBridgeHandler(BaseHTTPRequestHandler):
+    """
+    Request handler for MockBridge
+    """
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, with Nagle's algorithm every response would wait for a delayed ACK
+    disable_nagle_algorithm = True
+    RESOURCE_PATH = re.compile(r'^/clip/v2/resource/(\w+)(?:/([\w-]+))?/?$')
+    V1_PATH = re.compile(r'^/api/([\w-]+)/(\w+)(?:/([\w-]+))?(?:/(state|action))?/?$')
+    KEEPALIVE_INTERVAL = 1.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _authorized(self):
+        if self.headers.get('hue-application-key') == self.server.bridge.APPLICATION_KEY:
+            return True
+        self._send(403, error_body('unauthorized user'))
+        return False
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _v1(self, method, body=None):
+        """
+        Serves a v1 request, v1 has the key in the path and reports errors as a list of error entries
+        :param method:
+        :param body:
+        :return:
+        """
+        match = self.V1_PATH.match(self.path)
+        if not match:
+            return self._send(404, [v1_error(3, self.path, 'resource not available')])
+        key, collection, resource_id, action = match.groups()
+        if key != self.server.bridge.APPLICATION_KEY:
+            return self._send(200, [v1_error(1, '/', 'unauthorized user')])
+        if self.server.bridge.delay():
+            return self._send(503, [v1_error(901, '/', 'service unavailable')])
+        if method == 'GET':
+            return self._send(*self.server.bridge.get_v1(collection, resource_id))
+        if not resource_id or (collection, action) not in (('lights', 'state'), ('groups', 'action')):
+            return self._send(404, [v1_error(3, self.path, 'resource not available')])
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return self._send(400, [v1_error(2, self.path, 'body contains invalid JSON')])
+        self._send(*self.server.bridge.put_v1(collection, resource_id, body))
+
+    def do_GET(self):
+        if self.path.startswith('/api/'):
+            return self._v1('GET')
+        if not self._authorized():
+            return
+        if self.path == '/eventstream/clip/v2':
+            return self._stream()
+        match = self.RESOURCE_PATH.match(self.path)
+        if not match:
+            return self._send(404, error_body('Not found'))
+        if self.server.bridge.delay():
+            return self._send(503, error_body('service unavailable'))
+        self._send(*self.server.bridge.get(match.group(1), match.group(2)))
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.startswith('/api/'):
+            return self._v1('PUT', body)
+        if not self._authorized():
+            return
+        match = self.RESOURCE_PATH.match(self.path)
+        if not match or not match.group(2):
+            return self._send(404, error_body('Not found'))
+        if self.server.bridge.delay():
+            return self._send(503, error_body('service unavailable'))
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return self._send(400, error_body('body contains invalid JSON'))
+        self._send(*self.server.bridge.put(match.group(1), match.group(2), body))
+
+    def _stream(self):
+        """
+        Serves server-sent events as a chunked response until the client disconnects or the bridge stops
+        :return:
+        """
+        bridge = self.server.bridge
+        queue = bridge.subscribe()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            self._send_chunk(': hi\n\n')
+            while True:
+                try:
+                    message = queue.get(timeout=self.KEEPALIVE_INTERVAL)
+                except Empty:
+                    self._send_chunk(': keepalive\n\n')
+                    continue
+                if message is None:
+                    self._send_chunk('')
+                    break
+                self._send_chunk('id: '+str(int(time.time()))+':0\ndata: '+json.dumps(message)+'\n\n')
+        except OSError:
+            pass
+        finally:
+            bridge.unsubscribe(queue)
+
+    def _send_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(('%x\r\n' % len(data)).encode('ascii')+data+b'\r\n')
+        self.wfile.flush()
+
+
+def public(resource):
+    """
+    Strips the fields the mock only keeps for its own bookkeeping
+    :param resource:
+    :return:
+    """
+    if resource['type'] == 'grouped_light':
+        return {k: v for k, v in resource.items() if k != 'lights'}
+    return resource
+
+
+def error_body(description):
+    return {'errors': [{'description': description}], 'data': []}
+
+
+def v1_error(error_type, address, description):
+    return {'error': {'type': error_type, 'address': address, 'description': description}}
+
+
+def v1_light(light):
+    """
+    Renders a light in v1 format
+    :param light:
+    :return:
+    """
+    schema = light['color_temperature']['mirek_schema']
+    return {
+        'name': light['metadata']['name'], 'type': 'Color temperature light',
+        'state': {'on': light['on']['on'], 'bri': max(1, int(round(light['dimming']['brightness'] * 254 / 100))),
+                  'ct': light['color_temperature']['mirek'], 'colormode': 'ct', 'reachable': True},
+        'capabilities': {'control': {'ct': {'min': schema['mirek_minimum'], 'max': schema['mirek_maximum']}}},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a mock Hue bridge')
+    parser.add_argument('--lights', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum deviation from latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests failed with a 503')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cert', help='certificate file, serves HTTPS when given')
+    parser.add_argument('--key', help='private key file for --cert')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    bridge = MockBridge(args.lights, args.latency, args.jitter, args.error_rate, args.host, args.port, args.cert,
+                        args.key, args.seed)
+    print('Mock bridge serving '+str(args.lights)+' lights on '+bridge.protocol+bridge.address+', application key '
+          + bridge.APPLICATION_KEY)
+    try:
+        bridge.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bridge.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
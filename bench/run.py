@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+from queue import Empty
+from concurrent.futures import ThreadPoolExecutor
+from hue import Clipv2, Topology, Snapshot
+from hue.entertainment import EntertainmentStream, UdpTransport
+from worker import WorkerPool, Request
+from .mock_bridge import MockBridge
+from .stream_receiver import StreamReceiver
+
+# Bumped whenever the layout of the results changes
+FORMAT_VERSION = 1
+
+
+def summarize(durations):
+    """
+    Summarizes a list of durations in seconds as milliseconds
+    :param durations:
+    :return:
+    """
+    if not durations:
+        return {'count': 0}
+    ordered = sorted(durations)
+
+    def percentile(share):
+        return round(ordered[min(len(ordered) - 1, int(share * len(ordered)))] * 1000, 3)
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'min_ms': round(ordered[0] * 1000, 3),
+        'p50_ms': percentile(0.5),
+        'p90_ms': percentile(0.9),
+        'p99_ms': percentile(0.99),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def light_payload(index):
+    return {'dimming': {'brightness': float(index % 100 + 1)}}
+
+
+def bench_clipv2_get(bridge, options):
+    """
+    Latency of fetching and decoding every light
+    :param bridge:
+    :param options:
+    :return:
+    """
+    durations = []
+    errors = 0
+    with bridge.client(api=options.api) as hue:
+        for _ in range(options.iterations):
+            start = time.perf_counter()
+            lights = hue.list_light_states()
+            durations.append(time.perf_counter() - start)
+            errors += not lights
+    return {'latency': summarize(durations), 'errors': errors}
+
+
+def bench_clipv2_put(bridge, options):
+    """
+    Latency and throughput of light state writes sent from several threads sharing one client
+    :param bridge:
+    :param options:
+    :return:
+    """
+    light_ids = list(bridge.resources['light'])
+    count = options.iterations * options.concurrency
+    with bridge.client(pool_size=options.concurrency, api=options.api) as hue:
+        def put(index):
+            light_id = light_ids[index % len(light_ids)]
+            start = time.perf_counter()
+            result = hue.set_light_state(light_id, light_payload(index))
+            return time.perf_counter() - start, bool(Clipv2.result_errors(result, light_id))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options.concurrency) as executor:
+            results = list(executor.map(put, range(count)))
+        elapsed = time.perf_counter() - start
+    return {
+        'latency': summarize([duration for duration, failed in results]),
+        'requests': count,
+        'errors': sum(failed for duration, failed in results),
+        'concurrency': options.concurrency,
+        'elapsed_s': round(elapsed, 4),
+        'throughput_rps': round(count / elapsed, 2),
+    }
+
+
+def bench_worker(bridge, options):
+    """
+    Throughput of light state commands through the worker pool, from queueing until every write is confirmed
+    :param bridge:
+    :param options:
+    :return:
+    """
+    light_ids = list(bridge.resources['light'])
+    count = options.iterations * options.concurrency
+    with bridge.client(pool_size=options.workers, api=options.api) as hue:
+        pool = WorkerPool(hue, options.workers)
+        pool.response_queue.notify = None
+        pool.start()
+        received = [0]
+
+        def drain(deadline):
+            while received[0] < count - pool.dropped and time.perf_counter() < deadline:
+                try:
+                    pool.response_queue.get(timeout=0.1)
+                except Empty:
+                    continue
+                received[0] += 1
+
+        start = time.perf_counter()
+        for index in range(count):
+            light_id = light_ids[index % len(light_ids)]
+            pool.request_queue.put(Request('set_light_state', light_payload(index), light_id=light_id))
+        queued = time.perf_counter() - start
+        drain(start + options.timeout)
+        elapsed = time.perf_counter() - start
+        pool.shutdown(cancel=True, timeout=1)
+    return {
+        'commands': count,
+        'coalesced': pool.dropped,
+        'responses': received[0],
+        'workers': options.workers,
+        'queue_s': round(queued, 4),
+        'elapsed_s': round(elapsed, 4),
+        'throughput_cps': round(count / elapsed, 2),
+        'timed_out': received[0] < count - pool.dropped,
+    }
+
+
+def bench_refresh(bridge, options):
+    """
+    Cost of a full refresh without a UI: fetching the light states, updating the topology and finding the lights
+    whose panels would have to be rendered, with a tenth of the lights changed between refreshes
+    :param bridge:
+    :param options:
+    :return:
+    """
+    light_ids = list(bridge.resources['light'])
+    topology = Topology()
+    fetch_durations, apply_durations, changed = [], [], []
+    with bridge.client(api=options.api) as hue:
+        topology.update_lights(hue.list_light_states() or {})
+        for iteration in range(options.iterations):
+            for index in range(iteration % 10, len(light_ids), 10):
+                bridge.put('light', light_ids[index], light_payload(index + iteration))
+
+            start = time.perf_counter()
+            lights = hue.list_light_states()
+            fetch_durations.append(time.perf_counter() - start)
+            if not lights:
+                continue
+
+            start = time.perf_counter()
+            previous = topology.lights
+            changed.append(sum(1 for light_id, light in lights.items() if previous.get(light_id) != light))
+            topology.update_lights(lights)
+            apply_durations.append(time.perf_counter() - start)
+    return {
+        'fetch': summarize(fetch_durations),
+        'apply': summarize(apply_durations),
+        'changed_mean': round(sum(changed) / len(changed), 1) if changed else 0,
+    }
+
+
+def bench_startup(bridge, options):
+    """
+    Time until the topology is known, cold from the bridge and warm from a snapshot
+    :param bridge:
+    :param options:
+    :return:
+    """
+    cold, warm, save = [], [], []
+    with tempfile.TemporaryDirectory() as directory:
+        for _ in range(options.iterations):
+            start = time.perf_counter()
+            with bridge.client(api=options.api) as hue:
+                data = Topology.fetch(hue)
+            topology = Topology()
+            if data:
+                topology.update_rooms(data['rooms'])
+                topology.update_zones(data['zones'])
+                topology.update_lights(data['lights'])
+            cold.append(time.perf_counter() - start)
+            if not data:
+                continue
+
+            snapshot = Snapshot(bridge.address, directory)
+            start = time.perf_counter()
+            snapshot.save(topology.rooms, topology.zones, topology.lights, data['bridge_id'])
+            save.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            cached = snapshot.load()
+            topology = Topology()
+            topology.update_rooms(cached['rooms'])
+            topology.update_zones(cached['zones'])
+            topology.update_lights(cached['lights'])
+            warm.append(time.perf_counter() - start)
+    return {'cold': summarize(cold), 'warm': summarize(warm), 'snapshot_save': summarize(save)}
+
+
+def bench_entertainment(bridge, options):
+    """
+    Frame pacing of an entertainment stream sent over plain UDP to a local receiver while colours keep changing
+    :param bridge:
+    :param options:
+    :return:
+    """
+    if options.api == 'v1':
+        return {'error': 'entertainment streaming needs the Clip v2 API'}
+    with bridge.client() as hue, StreamReceiver() as receiver:
+        configs = hue.list_entertainment_configurations()
+        if not configs:
+            return {'error': 'no entertainment configuration'}
+        config = next(iter(configs.values()))
+        channel_ids = [channel['channel_id'] for channel in config['channels']]
+        stream = EntertainmentStream.open(hue, config['id'], options.stream_rate,
+                                          transport=UdpTransport('127.0.0.1', receiver.port))
+        deadline = time.perf_counter() + options.stream_duration
+        step = 0
+        while time.perf_counter() < deadline:
+            step += 1
+            stream.set_channels({channel_id: ((step + channel_id) % 100 / 100.0, 0.5, 1.0)
+                                 for channel_id in channel_ids})
+            time.sleep(0.005)
+        stream.stop()
+        time.sleep(0.05)
+        stats = stream.stats()
+        with receiver.lock:
+            received = dict(receiver.stats)
+            intervals = list(receiver.intervals)
+    return {
+        'rate': stats['rate'],
+        'channels': len(channel_ids),
+        'sent': stats['frames'],
+        'dropped': stats['dropped'],
+        'errors': stats['errors'],
+        'fps': round(stats['fps'], 2),
+        'send_lateness': {'mean_ms': round(stats['jitter_mean'] * 1000, 3),
+                          'p99_ms': round(stats['jitter_p99'] * 1000, 3),
+                          'max_ms': round(stats['jitter_max'] * 1000, 3)},
+        'received': received,
+        'arrival_interval': summarize(intervals),
+    }
+
+
+BENCHMARKS = {
+    'clipv2_get': bench_clipv2_get,
+    'clipv2_put': bench_clipv2_put,
+    'worker': bench_worker,
+    'refresh': bench_refresh,
+    'startup': bench_startup,
+    'entertainment': bench_entertainment,
+}
+
+
+def run(options):
+    """
+    Runs the selected benchmarks against a fresh mock bridge for every light count
+    :param options:
+    :return: results as a JSON serializable dict
+    """
+    results = []
+    for light_count in options.lights:
+        bridge = MockBridge(light_count, options.latency, options.jitter, options.error_rate, certfile=options.cert,
+                            keyfile=options.key, seed=options.seed)
+        with bridge:
+            for name in options.benchmarks:
+                start = time.perf_counter()
+                metrics = BENCHMARKS[name](bridge, options)
+                results.append({
+                    'benchmark': name,
+                    'lights': light_count,
+                    'duration_s': round(time.perf_counter() - start, 4),
+                    'metrics': metrics,
+                })
+                print(name+' with '+str(light_count)+' lights done', file=sys.stderr)
+            bridge_stats = dict(bridge.stats)
+        results.append({'benchmark': 'bridge', 'lights': light_count, 'metrics': bridge_stats})
+
+    return {
+        'version': FORMAT_VERSION,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'lights': options.lights,
+            'latency': options.latency,
+            'jitter': options.jitter,
+            'error_rate': options.error_rate,
+            'iterations': options.iterations,
+            'concurrency': options.concurrency,
+            'workers': options.workers,
+            'api': options.api,
+            'stream_rate': options.stream_rate,
+            'stream_duration': options.stream_duration,
+            'https': bool(options.cert),
+        },
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark pyhue against a mock bridge, results are written as JSON')
+    parser.add_argument('--lights', default='10,100,500,2000',
+                        type=lambda value: [int(count) for count in value.split(',')],
+                        help='comma separated light counts, a mock bridge is started for each')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum deviation from latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests failed with a 503')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4, help='threads sending writes in clipv2_put')
+    parser.add_argument('--workers', type=int, default=4, help='worker pool size in the worker benchmark')
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds to wait for worker confirmations')
+    parser.add_argument('--stream-rate', type=int, default=50, help='frames per second in the entertainment benchmark')
+    parser.add_argument('--stream-duration', type=float, default=2.0,
+                        help='seconds to stream in the entertainment benchmark')
+    parser.add_argument('--benchmarks', default=','.join(BENCHMARKS),
+                        type=lambda value: [name for name in value.split(',') if name],
+                        help='comma separated subset of '+', '.join(BENCHMARKS))
+    parser.add_argument('--api', choices=('v1', 'v2'), default='v2', help='API generation the clients use')
+    parser.add_argument('--cert', help='certificate file, the mock bridge serves HTTPS when given')
+    parser.add_argument('--key', help='private key file for --cert')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='file to write the results to, defaults to stdout')
+    options = parser.parse_args(argv)
+    unknown = set(options.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmarks: '+', '.join(sorted(unknown)))
+
+    output = json.dumps(run(options), indent=2)
+    if options.output:
+        with open(options.output, 'w') as file:
+            file.write(output+'\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import socket
+import threading
+import time
+from hue.entertainment import decode_frame
+
+
+class StreamReceiver:
+    """
+    Local stand-in for the bridge's entertainment streaming port. Receives plain UDP HueStream frames, keeps the
+    latest colour of every channel and records sequence gaps and the spacing between frames.
+    """
+    BUFFER_SIZE = 2048
+
+    def __init__(self, host='127.0.0.1', port=0):
+        """
+        :param host:
+        :param port: 0 picks a free port
+        """
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.socket.settimeout(0.2)
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.stats = {'frames': 0, 'invalid': 0, 'lost': 0}
+        self.intervals = []
+        self._last_sequence = None
+        self._last_arrival = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def port(self):
+        return self.socket.getsockname()[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._receive, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self.socket.close()
+
+    def _receive(self):
+        while not self._stopped.is_set():
+            try:
+                data = self.socket.recv(self.BUFFER_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            arrival = time.perf_counter()
+            try:
+                frame = decode_frame(data)
+            except ValueError:
+                with self.lock:
+                    self.stats['invalid'] += 1
+                continue
+            with self.lock:
+                self.stats['frames'] += 1
+                if self._last_sequence is not None:
+                    self.stats['lost'] += (frame['sequence'] - self._last_sequence - 1) & 0xff
+                    self.intervals.append(arrival - self._last_arrival)
+                self._last_sequence = frame['sequence']
+                self._last_arrival = arrival
+                self.channels.update(frame['channels'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Receive entertainment frames over plain UDP and report them')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2100)
+    args = parser.parse_args()
+
+    receiver = StreamReceiver(args.host, args.port).start()
+    print('Receiving frames on '+args.host+':'+str(receiver.port))
+    try:
+        while True:
+            time.sleep(1)
+            with receiver.lock:
+                print(json.dumps(receiver.stats))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3.10
+# -*- coding: utf-8 -*-
+import argparse
+import copy
+import json
+import sys
+import threading
+from queue import Queue, Empty
+from time import monotonic
+from hue import Clipv1, Clipv2, ErrorResult, Topology, create_client
+from hue.eventstream import merge_state
+from hue.metrics import default_metrics, MetricsServer
+from worker import WorkerPool, EventListener, batch_changes
+
+
+class Controller:
+    """
+    Headless counterpart of the GUI: keeps the topology of one bridge and sends changes through the worker pool
+    """
+    WORKERS = 4
+    TIMEOUT = 30
+
+    def __init__(self, hue, workers=None):
+        self.hue = hue
+        self.topology = Topology()
+        self.bridge_id = None
+        self.pool = WorkerPool(hue, workers or self.WORKERS)
+        self.pool.start()
+        self.listener = None
+
+    def close(self):
+        if self.listener:
+            self.listener.stop()
+        self.pool.shutdown(cancel=True, timeout=1)
+        self.hue.close()
+
+    def load(self):
+        """
+        Fetches rooms, zones and lights from the bridge
+        :return: True, or False or an ErrorResult if the bridge didn't answer
+        """
+        data = Topology.fetch(self.hue)
+        if not data:
+            return data
+        if data['failed']:
+            print("Couldn't reach bridges "+", ".join(data['failed']), file=sys.stderr)
+        self.bridge_id = data['bridge_id']
+        self.topology.update_rooms(data['rooms'])
+        self.topology.update_zones(data['zones'])
+        self.topology.update_lights(data['lights'])
+        return True
+
+    def listen(self):
+        """
+        Keeps the light states current from the event stream, responses are applied whenever drain() runs
+        :return:
+        """
+        self.listener = EventListener(self.hue, self.pool.response_queue)
+        self.listener.start()
+
+    def dump(self):
+        """
+        Returns the known rooms, zones and light states as JSON serializable data
+        :return:
+        """
+        return {
+            'bridge_id': self.bridge_id,
+            'rooms': {room_id: room.to_dict() for room_id, room in self.topology.rooms.items()},
+            'zones': {zone_id: zone.to_dict() for zone_id, zone in self.topology.zones.items()},
+            'lights': {light_id: light.to_dict() for light_id, light in self.topology.lights.items()},
+        }
+
+    def resolve(self, targets):
+        """
+        Looks up the lights meant by a list of light, room or zone ids or names, 'all' means every light
+        :param targets:
+        :return: list of light ids
+        :raises KeyError: if a target matches nothing
+        """
+        light_ids = []
+        for target in targets:
+            if target == 'all':
+                light_ids.extend(self.topology.lights)
+                continue
+            if target in self.topology.lights:
+                light_ids.append(target)
+                continue
+            groups = list(self.topology.rooms.values()) + list(self.topology.zones.values())
+            group = next((group for group in groups if target in (group.id, group.name)), None) or \
+                next((group for group in groups if group.name.lower() == target.lower()), None)
+            if group:
+                light_ids.extend(self.topology.lights_for_group(group.id))
+                continue
+            matches = [light.id for light in self.topology.lights.values() if light.name.lower() == target.lower()]
+            if not matches:
+                raise KeyError(target)
+            light_ids.extend(matches)
+        return list(dict.fromkeys(light_ids))
+
+    def apply(self, changes, timeout=None):
+        """
+        Sends changes through the worker pool, using grouped lights where a whole room or zone gets the same state,
+        and waits until every light's change has been confirmed
+        :param changes: dict of light_id => Clipv2 state
+        :param timeout:
+        :return: dict of light_id => errors for every light that couldn't be changed
+        """
+        pending = set(changes)
+        for request in batch_changes(changes, self.topology.grouped_lights()):
+            self.pool.request_queue.put(request)
+
+        errors = {}
+        deadline = monotonic() + (timeout or self.TIMEOUT)
+        while pending:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            try:
+                response = self.pool.response_queue.get(timeout=remaining)
+            except Empty:
+                break
+            self.handle_response(response)
+            if response.light_id in pending:
+                pending.discard(response.light_id)
+                if response.error:
+                    errors[response.light_id] = response.error
+        for light_id in pending:
+            errors[light_id] = ['Timed out waiting for confirmation']
+        return errors
+
+    def drain(self):
+        """
+        Applies all queued responses, e.g. changes from the event stream, to the topology
+        :return:
+        """
+        for response in self.pool.response_queue.drain():
+            self.handle_response(response)
+
+    def handle_response(self, response):
+        if response.light_id:
+            light = self.topology.lights.get(response.light_id)
+            if response.error:
+                if response.payload:
+                    self.topology.update_light(response.payload)
+            elif light:
+                light.apply_clip(response.payload)
+        elif response.request_type == 'load_topology':
+            if response.payload:
+                self.topology.update_rooms(response.payload['rooms'])
+                self.topology.update_zones(response.payload['zones'])
+                self.topology.update_lights(response.payload['lights'])
+        elif response.partial:
+            for light_id, changes in response.payload.items():
+                light = self.topology.lights.get(light_id)
+                if light:
+                    light.apply_clip(changes)
+        elif response.payload:
+            self.topology.update_lights(response.payload)
+
+    def scene_changes(self, scene):
+        """
+        Expands a scene into per light changes. A scene maps light, room or zone ids or names to Clipv2 states,
+        either directly or under 'lights' and 'groups'. The states of a light that is listed more than once are merged,
+        with lights overriding groups
+        :param scene:
+        :return: dict of light_id => Clipv2 state
+        :raises ValueError: if the scene isn't shaped like that
+        """
+        if not isinstance(scene, dict):
+            raise ValueError("a scene has to be an object")
+        if 'lights' in scene or 'groups' in scene:
+            if not all(isinstance(scene.get(key, {}), dict) for key in ('groups', 'lights')):
+                raise ValueError("a scene's lights and groups have to be objects")
+            entries = list(scene.get('groups', {}).items()) + list(scene.get('lights', {}).items())
+        else:
+            entries = list(scene.items())
+        changes = {}
+        for target, state in entries:
+            if not isinstance(state, dict):
+                raise ValueError("the state of "+target+" has to be an object")
+            for light_id in self.resolve([target]):
+                merge_state(changes.setdefault(light_id, {}), copy.deepcopy(state))
+        return changes
+
+
+def build_state(options):
+    """
+    Puts together a Clipv2 state from the set command's options
+    :param options:
+    :return:
+    :raises ValueError: if --json isn't a JSON object
+    """
+    state = json.loads(options.json) if options.json else {}
+    if not isinstance(state, dict):
+        raise ValueError("--json has to be an object")
+    if options.on is not None:
+        state['on'] = {'on': options.on}
+    if options.brightness is not None:
+        state['dimming'] = {'brightness': options.brightness}
+    if options.mirek is not None:
+        state['color_temperature'] = {'mirek': options.mirek}
+    return state
+
+
+def report(errors, changes):
+    """
+    Prints failed lights to stderr
+    :param errors:
+    :param changes:
+    :return: exit code
+    """
+    for light_id, light_errors in errors.items():
+        print("Updating light "+light_id+" failed: "+", ".join(light_errors), file=sys.stderr)
+    print(str(len(changes) - len(errors))+" of "+str(len(changes))+" lights updated", file=sys.stderr)
+    return 1 if errors else 0
+
+
+def command_dump(controller, options):
+    data = controller.dump()
+    if options.format == 'json':
+        print(json.dumps(data, indent=2, sort_keys=True))
+        return 0
+    for light in sorted(controller.topology.lights.values(), key=lambda light: light.name):
+        print('%-36s  %-30s  %-3s  %6.2f  %s' % (light.id, light.name, 'on' if light.on else 'off', light.brightness,
+                                                 light.mirek if light.mirek is not None else '-'))
+    return 0
+
+
+def command_set(controller, options):
+    try:
+        state = build_state(options)
+    except ValueError as e:
+        print("Invalid --json: "+str(e), file=sys.stderr)
+        return 2
+    if not state:
+        print("Nothing to set, use --on/--off, --brightness, --mirek or --json", file=sys.stderr)
+        return 2
+    try:
+        light_ids = controller.resolve(options.targets)
+    except KeyError as e:
+        print("No light, room or zone named "+str(e), file=sys.stderr)
+        return 2
+    changes = {light_id: dict(state) for light_id in light_ids}
+    return report(controller.apply(changes, options.timeout), changes)
+
+
+def command_scene(controller, options):
+    try:
+        with open(options.file, 'r') as file:
+            changes = controller.scene_changes(json.load(file))
+    except (OSError, ValueError) as e:
+        print("Can't read scene "+options.file+": "+str(e), file=sys.stderr)
+        return 2
+    except KeyError as e:
+        print("No light, room or zone named "+str(e), file=sys.stderr)
+        return 2
+    return report(controller.apply(changes, options.timeout), changes)
+
+
+def command_daemon(controller, options):
+    """
+    Keeps the connection and topology alive and executes JSON commands read from stdin, one per line:
+    {"command": "dump"}, {"command": "set", "targets": [...], "state": {...}} or {"command": "scene", "scene": {...}}.
+    A JSON reply is written to stdout for each command.
+    :param controller:
+    :param options:
+    :return:
+    """
+    controller.listen()
+    commands = Queue()
+
+    def read_commands():
+        for line in sys.stdin:
+            if line.strip():
+                commands.put(line)
+        commands.put(None)
+
+    threading.Thread(target=read_commands, daemon=True).start()
+    while True:
+        try:
+            line = commands.get(timeout=options.drain_interval)
+        except Empty:
+            controller.drain()
+            continue
+        if line is None:
+            return 0
+        controller.drain()
+        print(json.dumps(handle_daemon_command(controller, line, options)), flush=True)
+
+
+def handle_daemon_command(controller, line, options):
+    """
+    Executes a single daemon command
+    :param controller:
+    :param line:
+    :param options:
+    :return: reply
+    """
+    try:
+        command = json.loads(line)
+        if not isinstance(command, dict):
+            raise ValueError("a command has to be an object")
+        if not isinstance(command.get('timeout', 0), (int, float)):
+            raise ValueError("timeout has to be a number")
+        if command.get('command') == 'dump':
+            return {'ok': True, 'data': controller.dump()}
+        elif command.get('command') == 'set':
+            if not isinstance(command.get('targets'), list) or not all(isinstance(target, str)
+                                                                        for target in command['targets']):
+                raise ValueError("targets has to be a list of light, room or zone ids or names")
+            if not isinstance(command.get('state'), dict):
+                raise ValueError("state has to be an object")
+            changes = {light_id: dict(command['state']) for light_id in controller.resolve(command['targets'])}
+        elif command.get('command') == 'scene':
+            changes = controller.scene_changes(command['scene'])
+        else:
+            return {'ok': False, 'error': 'Unknown command '+repr(command.get('command'))}
+    except ValueError as e:
+        return {'ok': False, 'error': 'Invalid command: '+str(e)}
+    except KeyError as e:
+        return {'ok': False, 'error': 'Not found: '+str(e)}
+    errors = controller.apply(changes, command.get('timeout', options.timeout))
+    return {'ok': not errors, 'updated': len(changes) - len(errors), 'errors': errors}
+
+
+def client_from_options(options):
+    """
+    Creates a client for the bridges in the config file, or for the bridge and key given on the command line
+    :param options:
+    :return:
+    """
+    if options.bridge and options.key:
+        client_class = Clipv1 if options.api == 'v1' else Clipv2
+        return client_class(pool_size=options.workers + 2, bridge=options.bridge, application_key=options.key,
+                            protocol=options.protocol or ('http://' if options.api == 'v1' else 'https://'))
+    if options.protocol:
+        return create_client(options.config, pool_size=options.workers + 2, protocol=options.protocol)
+    return create_client(options.config, pool_size=options.workers + 2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Control Hue lights without the GUI')
+    parser.add_argument('--config', default=Clipv2.CONFIG_FILE, help='config file with bridge and username')
+    parser.add_argument('--bridge', help='bridge address, used instead of the config file together with --key')
+    parser.add_argument('--key', help='application key for --bridge')
+    parser.add_argument('--api', choices=('v1', 'v2'), default='v2', help='API generation of --bridge')
+    parser.add_argument('--protocol', help='defaults to https:// for Clip v2 and http:// for v1 bridges')
+    parser.add_argument('--workers', type=int, default=Controller.WORKERS)
+    parser.add_argument('--timeout', type=float, default=Controller.TIMEOUT,
+                        help='seconds to wait for changes to be confirmed')
+    parser.add_argument('--metrics-port', type=int, help='serve metrics for Prometheus on this localhost port')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    dump = commands.add_parser('dump', help='print all rooms, zones and light states')
+    dump.add_argument('--format', choices=('json', 'text'), default='json')
+    dump.set_defaults(handler=command_dump)
+
+    set_parser = commands.add_parser('set', help='change lights, rooms or zones')
+    set_parser.add_argument('targets', nargs='+', help="light, room or zone ids or names, or 'all'")
+    power = set_parser.add_mutually_exclusive_group()
+    power.add_argument('--on', dest='on', action='store_const', const=True)
+    power.add_argument('--off', dest='on', action='store_const', const=False)
+    set_parser.add_argument('--brightness', type=float, help='0-100')
+    set_parser.add_argument('--mirek', type=int, help='color temperature')
+    set_parser.add_argument('--json', help='raw Clipv2 state to send')
+    set_parser.set_defaults(handler=command_set)
+
+    scene = commands.add_parser('scene', help='apply a scene file')
+    scene.add_argument('file', help='JSON file mapping light, room or zone ids or names to Clipv2 states')
+    scene.set_defaults(handler=command_scene)
+
+    daemon = commands.add_parser('daemon', help='stay connected and execute JSON commands read from stdin')
+    daemon.add_argument('--drain-interval', type=float, default=1.0,
+                        help='seconds between applying event stream changes while idle')
+    daemon.set_defaults(handler=command_daemon)
+
+    options = parser.parse_args(argv)
+    metrics_server = None
+    if options.metrics_port:
+        default_metrics.enabled = True
+        metrics_server = MetricsServer(port=options.metrics_port).start()
+
+    controller = Controller(client_from_options(options), options.workers)
+    try:
+        loaded = controller.load()
+        if not loaded:
+            reason = ": "+loaded.description if isinstance(loaded, ErrorResult) else ""
+            print("Couldn't load lights and rooms from bridge "+controller.hue.bridge+reason, file=sys.stderr)
+            return 1
+        return options.handler(controller, options)
+    finally:
+        controller.close()
+        if metrics_server:
+            metrics_server.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
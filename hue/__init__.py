@@ -1,6 +1,41 @@
-__all__ = ['Hue', 'Light', 'Clipv2', 'Room']
+__all__ = ['Hue', 'Light', 'Clipv2', 'AsyncClipv2', 'SyncAsyncClipv2', 'Room', 'RateLimiter', 'TokenBucket',
+           'Topology', 'Snapshot', 'LightState', 'RoomState', 'PollPolicy', 'Metrics', 'MetricsServer', 'DebugFrame',
+           'BridgePool', 'create_client', 'EntertainmentStream', 'ErrorResult', 'RetryPolicy', 'CircuitBreaker',
+           'Backend', 'Clipv1', 'Transport']
 
+import importlib
 from .hue import Hue
-from .light import Light
+from .backend import Backend
+from .transport import Transport
 from .clipv2 import Clipv2
-from .room import Room
+from .clipv1 import Clipv1
+from .ratelimit import RateLimiter, TokenBucket
+from .resilience import ErrorResult, RetryPolicy, CircuitBreaker
+from .topology import Topology
+from .snapshot import Snapshot
+from .model import LightState, RoomState
+from .polling import PollPolicy
+from .metrics import Metrics, MetricsServer
+from .bridge_pool import BridgePool, create_client
+from .entertainment import EntertainmentStream
+
+# Imported on first use so that headless callers never load wx or aiohttp
+_LAZY = {
+    'Light': '.light',
+    'Room': '.room',
+    'DebugFrame': '.debug',
+    'AsyncClipv2': '.async_clipv2',
+    'SyncAsyncClipv2': '.async_clipv2',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module "+repr(__name__)+" has no attribute "+repr(name))
+    value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+from time import perf_counter
+from .codec import default_codec
+from .config import load_bridges
+from .metrics import endpoint_label
+from .resilience import ErrorResult
+from .transport import Transport
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncClipv2:
+    """
+    Asyncio adapter for the Philips Hue Clipv2 API that can run many requests concurrently over one connection pool.
+    Requests go out over aiohttp, everything else is the Transport's: rate limits, deadlines, retries, the circuit
+    breaker and metrics.
+    """
+    CONFIG_FILE = "config.json"
+    POOL_SIZE = 8
+    MAX_CONCURRENCY = 8
+    TIMEOUT = 10
+
+    def __init__(self, pool_size=None, timeout=None, max_concurrency=None, bridge=None, application_key=None,
+                 protocol='https://', rate_limiter=None, codec=None, metrics=None, deadline=None, retry_policy=None,
+                 circuit_breaker=None, transport=None):
+        """
+        :param transport: Transport whose rate limits, deadline, retries and circuit breaker to share, created from the
+                          other arguments if not given
+        """
+        if aiohttp is None:
+            raise RuntimeError("AsyncClipv2 requires the aiohttp package")
+        self.application_key = application_key or ''
+        self.bridge = bridge or ''
+        if not self.bridge and transport is None:
+            self._load_config()
+        self.owns_transport = transport is None
+        self.transport = transport or Transport(self.bridge, protocol, None, None, None, deadline, rate_limiter,
+                                                retry_policy, circuit_breaker, metrics)
+        self.bridge = self.transport.bridge
+        self.protocol = self.transport.protocol
+        self.pool_size = pool_size or self.POOL_SIZE
+        self.timeout = timeout or self.TIMEOUT
+        self.max_concurrency = max_concurrency or self.MAX_CONCURRENCY
+        self.codec = codec or default_codec
+        self.rate_limiter = self.transport.rate_limiter
+        self.metrics = self.transport.metrics
+        self.deadline = self.transport.deadline
+        self.retry_policy = self.transport.retry_policy
+        self.circuit_breaker = self.transport.circuit_breaker
+        self.session = None
+        self._semaphore = None
+
+    @staticmethod
+    def available():
+        """
+        Whether the optional aiohttp dependency is installed
+        :return:
+        """
+        return aiohttp is not None
+
+    @classmethod
+    def from_client(cls, client, **kwargs):
+        """
+        Creates an async client on the transport of a Clipv2 instance, sharing its rate limits, deadline, retry policy
+        and circuit breaker
+        :param client:
+        :param kwargs:
+        :return:
+        """
+        return cls(application_key=client.application_key, codec=client.codec, transport=client.transport, **kwargs)
+
+    def _load_config(self):
+        """
+        Loads configuration from self.CONFIG_FILE, the first bridge is used if several are configured
+        :return:
+        """
+        entry = load_bridges(self.CONFIG_FILE)[0]
+        self.application_key = entry['username']
+        self.bridge = entry['bridge']
+
+    def _get_session(self):
+        """
+        Lazily creates the shared session, this has to happen inside the running event loop
+        :return:
+        """
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ssl=self.transport.VERIFY_SSL)
+            self.session = aiohttp.ClientSession(connector=connector,
+                                                 headers={"hue-application-key": self.application_key},
+                                                 timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.session
+
+    async def close(self):
+        """
+        Closes the shared session and all pooled connections, and the transport if it was created for this client
+        :return:
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        if self.owns_transport:
+            self.transport.close()
+
+    def _get_endpoint_url(self, endpoint):
+        """
+        Puts together a URL for specified endpoint
+        :param endpoint:
+        :return:
+        """
+        return self.transport.url('clip/v2/'+endpoint)
+
+    async def _throttle(self, method, endpoint):
+        """
+        Waits until the rate limiter allows the request to be sent
+        :param method:
+        :param endpoint:
+        :return:
+        """
+        wait = self.rate_limiter.reserve(method, endpoint)
+        if wait:
+            await asyncio.sleep(wait)
+
+    async def _send(self, method, endpoint, body=None, timeout=None):
+        """
+        Sends a request once the rate limiter and concurrency limit allow it. Calls fail fast while the circuit breaker
+        is open, and idempotent calls are retried with jittered backoff as long as the call's deadline allows
+        :param method:
+        :param endpoint:
+        :param body:
+        :param timeout: seconds the whole call may take, retries included, defaults to self.deadline
+        :return: the response body, or an ErrorResult if the bridge couldn't be reached
+        """
+        call = self.transport.call(method, endpoint, timeout)
+        while True:
+            rejected = call.admit()
+            if rejected is not None:
+                return rejected
+            content = None
+            try:
+                await self._throttle(method, endpoint)
+                remaining = call.time_left()
+                if remaining is None:
+                    return call.timed_out()
+                status, content = await self._request(method, endpoint, body, min(self.timeout, remaining))
+                if call.answered(status, self.transport.RETRY_STATUSES):
+                    return content
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                call.fail(ErrorResult.TIMEOUT if isinstance(e, asyncio.TimeoutError) else ErrorResult.CONNECTION, e,
+                          sent=not isinstance(e, aiohttp.ClientConnectorError))
+            except BaseException:
+                # Cancelled while waiting its turn or for the answer
+                call.abandon()
+                raise
+
+            delay = call.retry_delay()
+            if delay is None:
+                return call.failure if call.failed else content
+            await asyncio.sleep(delay)
+
+    async def _request(self, method, endpoint, body, timeout):
+        """
+        Makes a single request within the concurrency limit, recording its round trip if metrics are enabled
+        :param method:
+        :param endpoint:
+        :param body:
+        :param timeout: total seconds for the request
+        :return: status code and response body
+        """
+        session = self._get_session()
+        client_timeout = aiohttp.ClientTimeout(total=timeout)
+        async with self._semaphore:
+            if not self.metrics.enabled:
+                async with session.request(method, self._get_endpoint_url(endpoint), data=body,
+                                           timeout=client_timeout) as response:
+                    return response.status, await response.read()
+
+            label = endpoint_label(endpoint)
+            start = perf_counter()
+            try:
+                async with session.request(method, self._get_endpoint_url(endpoint), data=body,
+                                           timeout=client_timeout) as response:
+                    content = await response.read()
+            except asyncio.TimeoutError:
+                self.metrics.inc('hue_request_timeouts_total', method=method, endpoint=label)
+                raise
+            except aiohttp.ClientError:
+                self.metrics.inc('hue_request_errors_total', method=method, endpoint=label, status='connection')
+                raise
+        self.metrics.observe('hue_request_duration_seconds', perf_counter() - start, method=method, endpoint=label)
+        self.metrics.inc('hue_response_bytes_total', len(content), method=method, endpoint=label)
+        if body:
+            self.metrics.inc('hue_request_bytes_total', len(body), method=method, endpoint=label)
+        if response.status >= 400:
+            self.metrics.inc('hue_request_errors_total', method=method, endpoint=label, status=str(response.status))
+        return response.status, content
+
+    def _decode(self, content):
+        """
+        Decodes a response body, returns False if it isn't valid JSON
+        :param content:
+        :return:
+        """
+        try:
+            return self.codec.decode(content)
+        except ValueError:
+            self.metrics.inc('hue_decode_errors_total')
+            return False
+
+    async def call_get(self, endpoint, timeout=None):
+        """
+        Makes a GET request to specified URL and returns JSON data
+        :param endpoint:
+        :param timeout: deadline of the call in seconds
+        :return:
+        """
+        content = await self._send('GET', endpoint, timeout=timeout)
+        if isinstance(content, ErrorResult):
+            return content
+        return self._decode(content)
+
+    async def call_put(self, endpoint, body, timeout=None):
+        """
+        Makes a PUT request to a specified URL and returns JSON data
+        :param endpoint:
+        :param body: object to encode as JSON, or an already encoded str/bytes
+        :param timeout: deadline of the call in seconds
+        :return:
+        """
+        if not isinstance(body, (str, bytes)):
+            body = self.codec.encode(body)
+        content = await self._send('PUT', endpoint, body, timeout)
+        if isinstance(content, ErrorResult):
+            return content
+        return self._decode(content)
+
+    async def list_lights(self):
+        """
+        List all available lights
+        :return:
+        """
+        data = await self.call_get('resource/light')
+        if data and type(data) != bool:
+            return {light['id']: light for light in data['data']}
+        if isinstance(data, ErrorResult):
+            return data
+        return False
+
+    async def list_rooms(self):
+        """
+        List all configured rooms
+        :return:
+        """
+        data = await self.call_get('resource/room')
+        if data and type(data) != bool:
+            return {room['id']: room for room in data['data']}
+        if isinstance(data, ErrorResult):
+            return data
+        return False
+
+    async def set_light_state(self, light_id, state):
+        """
+        Sets the light state
+        :param light_id:
+        :param state:
+        :return:
+        """
+        return await self.call_put('resource/light/'+light_id, state)
+
+    async def set_grouped_light_state(self, grouped_light_id, state):
+        """
+        Sets the state of all lights in a room or zone with a single request
+        :param grouped_light_id:
+        :param state:
+        :return:
+        """
+        return await self.call_put('resource/grouped_light/'+grouped_light_id, state)
+
+    async def get_light_state(self, light_id):
+        """
+        Gets current state of specified light
+        :param light_id:
+        :return:
+        """
+        data = await self.call_get('resource/light/'+light_id)
+        if data and type(data) != bool:
+            return data['data'][0]
+
+        return data
+
+    async def set_light_states(self, states):
+        """
+        Sets the state of several lights concurrently
+        :param states: dict of light_id => state
+        :return: dict of light_id => result
+        """
+        light_ids = list(states)
+        results = await asyncio.gather(*[self.set_light_state(light_id, states[light_id]) for light_id in light_ids])
+        return dict(zip(light_ids, results))
+
+    async def get_light_states(self, light_ids):
+        """
+        Gets the current state of several lights concurrently
+        :param light_ids:
+        :return: dict of light_id => state
+        """
+        light_ids = list(light_ids)
+        results = await asyncio.gather(*[self.get_light_state(light_id) for light_id in light_ids])
+        return dict(zip(light_ids, results))
+
+
+class SyncAsyncClipv2:
+    """
+    Blocking facade that runs an AsyncClipv2 on its own event loop thread so it can be used from worker threads
+    """
+    def __init__(self, client):
+        self.client = client
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def run(self, coroutine):
+        """
+        Runs a coroutine on the facade's event loop and waits for the result
+        :param coroutine:
+        :return:
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self):
+        """
+        Closes the client and stops the event loop
+        :return:
+        """
+        self.run(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if not asyncio.iscoroutinefunction(method):
+            return method
+
+        def wrapper(*args, **kwargs):
+            return self.run(method(*args, **kwargs))
+        return wrapper
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+
+class Backend:
+    """
+    Interface the worker, topology and UI use to talk to a bridge, whatever API generation it speaks. Everything is in
+    Clipv2 shapes: lights are listed as LightState and rooms and zones as RoomState objects, get_light_state returns a
+    Clipv2 light resource, writes take Clipv2 state payloads and return Clipv2 style results that result_errors()
+    understands, and failed calls return something falsy (False or an ErrorResult).
+    """
+    # Whether open_event_stream() is supported, light states have to be polled without it
+    EVENT_STREAM = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        pass
+
+    def get_bridge_id(self):
+        raise NotImplementedError
+
+    def list_light_states(self):
+        raise NotImplementedError
+
+    def list_room_states(self):
+        raise NotImplementedError
+
+    def list_zone_states(self):
+        raise NotImplementedError
+
+    def get_light_state(self, light_id):
+        raise NotImplementedError
+
+    def set_light_state(self, light_id, state):
+        raise NotImplementedError
+
+    def set_grouped_light_state(self, grouped_light_id, state):
+        raise NotImplementedError
+
+    def set_light_states(self, states):
+        """
+        Sets the state of several lights, one after the other unless the backend can do better
+        :param states: dict of light_id => state
+        :return: dict of light_id => result
+        """
+        return {light_id: self.set_light_state(light_id, state) for light_id, state in states.items()}
+
+    def open_event_stream(self):
+        raise NotImplementedError("Bridge API doesn't have an event stream")
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+import json
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from queue import Queue
+from threading import Event, Thread
+from time import monotonic
+from .backend import Backend
+from .clipv1 import Clipv1
+from .clipv2 import Clipv2
+from .config import load_bridges
+from .eventstream import EventStreamParser
+from .metrics import default_metrics
+from .model import RoomState
+from .resilience import ErrorResult
+
+
+class BridgePool(Backend):
+    """
+    Presents several bridges as one house with the same interface as Clipv2. Every bridge has its own pooled client
+    and rate limits, lists are fetched from all bridges concurrently and merged, and ids are namespaced as
+    "<bridge name>/<id>" so writes can be routed to the owning bridge. The pool has an event stream if any of its
+    bridges has, bridges without one are polled into it.
+    """
+    SEPARATOR = '/'
+    # Seconds a fanned out call waits for each bridge, a bridge that takes longer counts as failed
+    TIMEOUT = 20
+
+    def __init__(self, clients, metrics=None, timeout=None):
+        """
+        :param clients: dict of bridge name => Clipv2 or Clipv1, names must not contain SEPARATOR
+        :param metrics:
+        :param timeout:
+        """
+        for name in clients:
+            if self.SEPARATOR in name:
+                raise ValueError("Bridge name "+name+" can't contain "+self.SEPARATOR)
+        self.clients = dict(clients)
+        self.namespaces = list(self.clients)
+        self.EVENT_STREAM = any(getattr(client, 'EVENT_STREAM', False) for client in self.clients.values())
+        self.bridge = '+'.join(client.bridge for client in self.clients.values())
+        self.metrics = metrics or default_metrics
+        self.timeout = timeout or self.TIMEOUT
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(self.clients)) * 4)
+
+    @classmethod
+    def from_config(cls, bridges, **kwargs):
+        """
+        Creates a pool from the bridges listed in the config file
+        :param bridges: list of dicts with bridge, username and an optional name, defaulting to the address
+        :param kwargs: passed on to every client
+        :return:
+        """
+        return cls({entry.get('name') or entry['bridge']: create_bridge_client(entry, **kwargs) for entry in bridges})
+
+    def close(self):
+        """
+        Closes every bridge's connections
+        :return:
+        """
+        self.executor.shutdown(wait=False)
+        for client in self.clients.values():
+            client.close()
+
+    def split_id(self, resource_id):
+        """
+        Splits a namespaced id into the client of its bridge and the id the bridge knows it by
+        :param resource_id:
+        :return: client and id, the client is None if the id doesn't belong to any bridge
+        """
+        name, separator, bridge_id = resource_id.partition(self.SEPARATOR)
+        return self.clients.get(name), bridge_id
+
+    def _fan_out(self, method, *args):
+        """
+        Calls a method on every bridge's client concurrently, every bridge gets self.timeout seconds to answer
+        :param method:
+        :param args:
+        :return: dict of bridge name => result, an ErrorResult for bridges that timed out or raised
+        """
+        futures = {name: self.executor.submit(getattr(client, method), *args) for name, client in self.clients.items()}
+        deadline = monotonic() + self.timeout
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result(max(0.0, deadline - monotonic()))
+            except TimeoutError:
+                results[name] = ErrorResult(ErrorResult.TIMEOUT, 'Bridge '+name+' took longer than '
+                                            + str(self.timeout)+'s to answer '+method)
+            except Exception as e:
+                results[name] = ErrorResult(ErrorResult.CONNECTION, 'Bridge '+name+' failed to answer '+method+': '
+                                            + str(e))
+        return results
+
+    def _merge(self, method, namespace):
+        """
+        Fans out a listing and merges the results of the bridges that answered with namespaced ids. The bridges that
+        didn't are reported in the listing's failed attribute, so a missing bridge isn't mistaken for lights that were
+        removed. If no bridge answered, the first bridge's ErrorResult is passed on.
+        :param method:
+        :param namespace: function namespacing a single listed item
+        :return: MergedListing
+        """
+        output = MergedListing()
+        for name, result in self._fan_out(method).items():
+            if not isinstance(result, dict):
+                output.failed[name] = result
+                continue
+            for item in result.values():
+                item = namespace(name, item)
+                output[item.id] = item
+        return self._result(output)
+
+    def _merge_resources(self, method, *args):
+        """
+        Fans out a listing of raw Clipv2 resources and merges the results with namespaced ids, like _merge
+        :param method:
+        :param args:
+        :return: MergedListing
+        """
+        output = MergedListing()
+        for name, result in self._fan_out(method, *args).items():
+            if not isinstance(result, dict):
+                output.failed[name] = result
+                continue
+            for resource in result.values():
+                resource = namespace_resource(name, resource)
+                output[resource['id']] = resource
+        return self._result(output)
+
+    def _result(self, listing):
+        """
+        Reports the bridges a listing failed for and returns it, or what went wrong if every bridge failed
+        :param listing:
+        :return:
+        """
+        for name, result in listing.failed.items():
+            self.metrics.inc('hue_bridge_listing_failures_total', bridge=name)
+        if len(listing.failed) < len(self.clients):
+            return listing
+        result = listing.failed[self.namespaces[0]]
+        return result if isinstance(result, ErrorResult) else False
+
+    def list_resources(self, resource_type):
+        return self._merge_resources('list_resources', resource_type)
+
+    def list_lights(self):
+        return self._merge_resources('list_lights')
+
+    def list_rooms(self):
+        return self._merge_resources('list_rooms')
+
+    def list_zones(self):
+        return self._merge_resources('list_zones')
+
+    def list_devices(self):
+        return self._merge_resources('list_devices')
+
+    def list_light_states(self):
+        return self._merge('list_light_states', namespace_light)
+
+    def list_room_states(self):
+        return self._merge('list_room_states', namespace_room)
+
+    def list_zone_states(self):
+        return self._merge('list_zone_states', namespace_room)
+
+    def get_bridge_id(self):
+        """
+        Combines the unique ids of all bridges, so the snapshot is discarded if any of them is replaced
+        :return:
+        """
+        bridge_ids = self._fan_out('get_bridge_id')
+        if not all(bridge_ids.values()):
+            return False
+        return '+'.join(bridge_ids[name] for name in self.namespaces)
+
+    def set_light_state(self, light_id, state):
+        client, bridge_light_id = self.split_id(light_id)
+        if client is None:
+            return False
+        return namespace_result(self.split_name(light_id), client.set_light_state(bridge_light_id, state))
+
+    def set_grouped_light_state(self, grouped_light_id, state):
+        client, bridge_group_id = self.split_id(grouped_light_id)
+        if client is None:
+            return False
+        return namespace_result(self.split_name(grouped_light_id),
+                                client.set_grouped_light_state(bridge_group_id, state))
+
+    def get_light_state(self, light_id):
+        client, bridge_light_id = self.split_id(light_id)
+        if client is None:
+            return False
+        data = client.get_light_state(bridge_light_id)
+        if data and type(data) != bool:
+            return namespace_resource(self.split_name(light_id), data)
+        return data
+
+    def split_name(self, resource_id):
+        return resource_id.partition(self.SEPARATOR)[0]
+
+    def open_event_stream(self):
+        """
+        Opens the event streams of all bridges, merged into one stream with namespaced ids. Bridges without an event
+        stream are polled for changed lights instead.
+        :return:
+        """
+        streams = {}
+        try:
+            for name, client in self.clients.items():
+                if getattr(client, 'EVENT_STREAM', False):
+                    streams[name] = client.open_event_stream()
+                else:
+                    streams[name] = PolledEventStream(client)
+        except Exception:
+            for stream in streams.values():
+                stream.close()
+            raise
+        return MergedEventStream(streams, self.metrics)
+
+
+class MergedListing(dict):
+    """
+    Listing merged from several bridges, failed maps the name of every bridge that couldn't be listed to its result,
+    False or an ErrorResult
+    """
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.failed = {}
+
+
+class PolledEventStream:
+    """
+    Stands in for the event stream of a bridge that doesn't have one by polling its lights and reporting the ones that
+    changed as update events. It ends when a poll fails, like a dropped event stream.
+    """
+    INTERVAL = 2.0
+
+    def __init__(self, client, interval=None):
+        """
+        :param client: Clipv1 or anything else with list_lights() returning Clipv2 light resources
+        :param interval: seconds between polls
+        """
+        self.client = client
+        self.interval = interval or self.INTERVAL
+        self._stopped = Event()
+
+    def iter_lines(self, decode_unicode=True):
+        """
+        Yields the lines of an update event whenever lights changed between polls
+        :param decode_unicode:
+        :return:
+        """
+        known = None
+        while not self._stopped.wait(0 if known is None else self.interval):
+            lights = self.client.list_lights()
+            if not isinstance(lights, dict):
+                raise ConnectionError(lights.description if isinstance(lights, ErrorResult) else
+                                      'Polling '+self.client.bridge+' failed')
+            # The first poll only sets the baseline, whoever opened the stream lists the lights on connecting
+            changed = []
+            if known is not None:
+                changed = [light for light_id, light in lights.items() if known.get(light_id) != light]
+            known = lights
+            if changed:
+                yield 'data: '+json.dumps([{'type': 'update', 'data': changed}])
+                yield ''
+
+    def close(self):
+        self._stopped.set()
+
+
+class MergedEventStream:
+    """
+    Reads the event streams of several bridges from one thread each and interleaves their events, stopping as soon as
+    any of them ends so the listener reconnects all of them
+    """
+    def __init__(self, streams, metrics=None):
+        """
+        :param streams: dict of bridge name => streaming response
+        :param metrics: counts the streams that fail in hue_event_stream_disconnects_total
+        """
+        self.streams = streams
+        self.metrics = metrics or default_metrics
+        self.events = Queue()
+        self._closed = Event()
+        for name, stream in streams.items():
+            Thread(target=self._read, args=(name, stream), daemon=True).start()
+
+    def _read(self, name, stream):
+        parser = EventStreamParser()
+        try:
+            for messages in parser.parse(stream.iter_lines(decode_unicode=True)):
+                data = json.dumps([namespace_event(name, message) for message in messages])
+                self.events.put(['data: '+data, ''])
+        except Exception as e:
+            # Closing the merged stream makes the other bridges' reads fail too, those aren't disconnects
+            if not self._closed.is_set():
+                print("Event stream of bridge "+name+" disconnected: "+str(e))
+                self.metrics.inc('hue_event_stream_disconnects_total', bridge=name)
+        finally:
+            self.events.put(None)
+
+    def iter_lines(self, decode_unicode=True):
+        """
+        Yields the lines of the merged events
+        :param decode_unicode:
+        :return:
+        """
+        while True:
+            lines = self.events.get()
+            if lines is None:
+                return
+            for line in lines:
+                yield line
+
+    def close(self):
+        self._closed.set()
+        for stream in self.streams.values():
+            stream.close()
+        self.events.put(None)
+
+
+def namespaced(name, resource_id):
+    return name+BridgePool.SEPARATOR+resource_id
+
+
+def namespace_reference(name, reference):
+    return dict(reference, rid=namespaced(name, reference['rid']))
+
+
+def namespace_resource(name, resource):
+    """
+    Returns a copy of a Clipv2 resource with its id and the ids it refers to namespaced
+    :param name:
+    :param resource:
+    :return:
+    """
+    output = dict(resource)
+    if 'id' in output:
+        output['id'] = namespaced(name, output['id'])
+    if isinstance(output.get('owner'), dict):
+        output['owner'] = namespace_reference(name, output['owner'])
+    for key in ('children', 'services'):
+        if key in output:
+            output[key] = [namespace_reference(name, reference) for reference in output[key]]
+    return output
+
+
+def namespace_event(name, message):
+    output = dict(message)
+    if 'data' in output:
+        output['data'] = [namespace_resource(name, resource) for resource in output['data']]
+    return output
+
+
+def namespace_result(name, result):
+    """
+    Namespaces the resources listed as changed in a PUT result
+    :param name:
+    :param result:
+    :return:
+    """
+    if not result or type(result) == bool:
+        return result
+    return dict(result, data=[namespace_reference(name, item) if 'rid' in item else item
+                              for item in result.get('data', [])])
+
+
+def namespace_light(name, light):
+    light = light.copy()
+    light.id = namespaced(name, light.id)
+    if light.owner:
+        light.owner = namespaced(name, light.owner)
+    return light
+
+
+def namespace_room(name, room):
+    return RoomState(namespaced(name, room.id), room.name,
+                     [(namespaced(name, rid), rtype) for rid, rtype in room.children],
+                     namespaced(name, room.grouped_light) if room.grouped_light else None)
+
+
+def create_client(config_file=None, **kwargs):
+    """
+    Creates a client for the bridges in the config file: a plain Clipv2 or Clipv1 for a single bridge, otherwise a
+    BridgePool
+    :param config_file: defaults to Clipv2.CONFIG_FILE
+    :param kwargs: passed on to every client
+    :return:
+    """
+    bridges = load_bridges(config_file or Clipv2.CONFIG_FILE)
+    if len(bridges) == 1:
+        return create_bridge_client(bridges[0], **kwargs)
+    return BridgePool.from_config(bridges, **kwargs)
+
+
+def create_bridge_client(entry, **kwargs):
+    """
+    Creates the client for one configured bridge, Clipv1 if its api is "v1" and Clipv2 otherwise
+    :param entry: dict with bridge, username and optionally api and clientkey
+    :param kwargs:
+    :return:
+    """
+    if entry.get('api') == 'v1':
+        return Clipv1(bridge=entry['bridge'], application_key=entry['username'], **kwargs)
+    return Clipv2(bridge=entry['bridge'], application_key=entry['username'], client_key=entry.get('clientkey'),
+                  **kwargs)
+
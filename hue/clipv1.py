@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+import json
+from .backend import Backend
+from .codec import default_codec
+from .config import load_bridges
+from .model import parse_lights, parse_rooms
+from .resilience import ErrorResult
+from .transport import Transport
+
+
+class Clipv1(Backend):
+    """
+    Adapter that puts the v1 API of older bridges behind the same interface as Clipv2. Lights and groups are translated
+    to Clipv2 resources and Clipv2 state payloads to v1 states, so the worker and UI run unchanged against either
+    bridge generation, over the same pooled Transport.
+    """
+    CONFIG_FILE = "config.json"
+    # v1 groups of these types are listed as rooms and zones, group 0 is every light
+    ROOM_TYPES = ('Room',)
+    ZONE_TYPES = ('Zone',)
+    ALL_LIGHTS = '0'
+    # A group of a single light is written as that light, group actions are rate limited far more strictly
+    MIN_GROUP_SIZE = 2
+
+    def __init__(self, pool_size=None, timeout=None, bridge=None, application_key=None, protocol='http://',
+                 rate_limiter=None, codec=None, metrics=None, deadline=None, retry_policy=None, circuit_breaker=None,
+                 transport=None, **kwargs):
+        """
+        :param application_key: the v1 username
+        :param transport: Transport to send requests through, created from the other arguments if not given
+        :param kwargs: Clipv2 only options such as client_key are ignored
+        """
+        self.application_key = application_key or ''
+        self.bridge = bridge or ''
+        self.protocol = protocol
+        self.codec = codec or default_codec
+        if not self.bridge:
+            self._load_config()
+        self.transport = transport or Transport(self.bridge, protocol, None, pool_size, timeout, deadline,
+                                                rate_limiter, retry_policy, circuit_breaker, metrics)
+        self.rate_limiter = self.transport.rate_limiter
+        self.metrics = self.transport.metrics
+        # grouped light id => light ids of the groups seen in the last listing, for batching writes into group actions
+        self.groups = {}
+
+    def _load_config(self):
+        """
+        Loads configuration from self.CONFIG_FILE, the first bridge is used if several are configured
+        :return:
+        """
+        entry = load_bridges(self.CONFIG_FILE)[0]
+        self.application_key = entry['username']
+        self.bridge = entry['bridge']
+
+    def close(self):
+        """
+        Closes all pooled connections to the bridge
+        :return:
+        """
+        self.transport.close()
+
+    def _send(self, method, endpoint, body=None, timeout=None):
+        """
+        Sends a request to a v1 endpoint and decodes the answer
+        :param method:
+        :param endpoint: e.g. lights/3/state
+        :param body: object to encode as JSON
+        :param timeout: seconds the whole call may take, retries included
+        :return: JSON data, False if the answer wasn't valid JSON or an ErrorResult if the bridge couldn't be reached
+        """
+        if body is not None:
+            body = self.codec.encode(body)
+        response = self.transport.send(method, 'api/'+self.application_key+'/'+endpoint, endpoint, body, timeout)
+        if isinstance(response, ErrorResult):
+            return response
+        try:
+            return self.codec.decode(response.content)
+        except ValueError:
+            self.metrics.inc('hue_decode_errors_total')
+            return False
+
+    def call_get(self, endpoint, timeout=None):
+        """
+        Makes a GET request, v1 reports errors such as an unknown username as a list instead of the object asked for
+        :param endpoint:
+        :param timeout:
+        :return: the object, or something falsy if it couldn't be fetched
+        """
+        data = self._send('GET', endpoint, timeout=timeout)
+        if isinstance(data, dict):
+            return data
+        return data if isinstance(data, ErrorResult) else False
+
+    def list_lights(self):
+        """
+        List all lights as Clipv2 light resources
+        :return:
+        """
+        data = self.call_get('lights')
+        if not data:
+            return data
+        self.groups = dict(self.groups, **{self.ALL_LIGHTS: list(data)})
+        return {light_id: light_resource(light_id, light) for light_id, light in data.items()}
+
+    def list_groups(self, types):
+        """
+        List the groups of the given v1 types as Clipv2 room resources
+        :param types:
+        :return:
+        """
+        data = self.call_get('groups')
+        if not data:
+            return data
+        groups = {group_id: group for group_id, group in data.items() if group.get('type') in types}
+        listed = {group_id: list(group.get('lights', [])) for group_id, group in groups.items()}
+        self.groups = dict(self.groups, **listed)
+        return {group_id: group_resource(group_id, group) for group_id, group in groups.items()}
+
+    def list_rooms(self):
+        return self.list_groups(self.ROOM_TYPES)
+
+    def list_zones(self):
+        return self.list_groups(self.ZONE_TYPES)
+
+    def list_light_states(self):
+        return parse_lights(self.list_lights())
+
+    def list_room_states(self):
+        return parse_rooms(self.list_rooms())
+
+    def list_zone_states(self):
+        return parse_rooms(self.list_zones())
+
+    def get_bridge_id(self):
+        """
+        Gets the unique id of the bridge
+        :return:
+        """
+        data = self.call_get('config')
+        if data:
+            return data.get('bridgeid', '').lower() or False
+        return data
+
+    def get_light_state(self, light_id):
+        """
+        Gets the current state of a light as a Clipv2 light resource
+        :param light_id:
+        :return:
+        """
+        data = self.call_get('lights/'+light_id)
+        if data:
+            return light_resource(light_id, data)
+        return data
+
+    def set_light_state(self, light_id, state):
+        """
+        Sets the light state
+        :param light_id:
+        :param state: Clipv2 state
+        :return: Clipv2 style result
+        """
+        return self._put('lights/'+light_id+'/state', state, light_id, 'light')
+
+    def set_grouped_light_state(self, grouped_light_id, state):
+        """
+        Sets the state of all lights in a group with a single group action
+        :param grouped_light_id: v1 group id
+        :param state: Clipv2 state
+        :return: Clipv2 style result
+        """
+        return self._put('groups/'+grouped_light_id+'/action', state, grouped_light_id, 'grouped_light')
+
+    def set_light_states(self, states):
+        """
+        Sets the state of several lights, lights that make up a whole room, zone or the house and get the same state
+        are set with one group action
+        :param states: dict of light_id => Clipv2 state
+        :return: dict of light_id => result
+        """
+        results = {}
+        remaining = dict(states)
+        for group_id, light_ids in sorted(self.groups.items(), key=lambda group: len(group[1]), reverse=True):
+            if len(light_ids) < self.MIN_GROUP_SIZE or any(light_id not in remaining for light_id in light_ids):
+                continue
+            state = remaining[light_ids[0]]
+            if any(remaining[light_id] != state for light_id in light_ids):
+                continue
+            result = self.set_grouped_light_state(group_id, state)
+            for light_id in light_ids:
+                del remaining[light_id]
+                results[light_id] = retarget_result(result, group_id, light_id)
+        results.update(Backend.set_light_states(self, remaining))
+        return results
+
+    def _put(self, endpoint, state, resource_id, resource_type):
+        """
+        Translates a Clipv2 state to v1, sends it and translates the answer back
+        :param endpoint:
+        :param state:
+        :param resource_id:
+        :param resource_type:
+        :return:
+        """
+        body = v1_state(state)
+        if not body:
+            return {'errors': [{'description': 'Nothing in '+json.dumps(state)+' the v1 API can set'}], 'data': []}
+        return clip_result(self._send('PUT', endpoint, body), resource_id, resource_type)
+
+
+def v1_state(state):
+    """
+    Translates a Clipv2 state payload to a v1 light state or group action
+    :param state:
+    :return:
+    """
+    output = {}
+    if 'on' in state:
+        output['on'] = state['on']['on']
+    if 'brightness' in state.get('dimming', {}):
+        output['bri'] = max(1, min(254, int(round(state['dimming']['brightness'] * 254 / 100))))
+    if state.get('color_temperature', {}).get('mirek') is not None:
+        output['ct'] = state['color_temperature']['mirek']
+    if 'xy' in state.get('color', {}):
+        output['xy'] = [state['color']['xy']['x'], state['color']['xy']['y']]
+    if 'duration' in state.get('dynamics', {}):
+        # v1 transitions are in steps of 100 ms
+        output['transitiontime'] = int(round(state['dynamics']['duration'] / 100))
+    return output
+
+
+def light_resource(light_id, light):
+    """
+    Translates a v1 light to a Clipv2 light resource
+    :param light_id:
+    :param light:
+    :return:
+    """
+    state = light.get('state', {})
+    resource = {'id': light_id, 'type': 'light', 'metadata': {'name': light.get('name', '')},
+                'on': {'on': state.get('on', False)}}
+    if 'bri' in state:
+        resource['dimming'] = {'brightness': round(state['bri'] * 100 / 254, 2)}
+    if 'ct' in state:
+        in_ct_mode = state.get('colormode', 'ct') == 'ct'
+        resource['color_temperature'] = {'mirek': state['ct'] if in_ct_mode else None, 'mirek_valid': in_ct_mode}
+        schema = light.get('capabilities', {}).get('control', {}).get('ct')
+        if schema:
+            resource['color_temperature']['mirek_schema'] = {'mirek_minimum': schema['min'],
+                                                             'mirek_maximum': schema['max']}
+    if 'xy' in state:
+        resource['color'] = {'xy': {'x': state['xy'][0], 'y': state['xy'][1]}}
+    return resource
+
+
+def group_resource(group_id, group):
+    """
+    Translates a v1 group to a Clipv2 room or zone resource, the group is its own grouped light
+    :param group_id:
+    :param group:
+    :return:
+    """
+    return {
+        'id': group_id, 'type': 'room' if group.get('type') in Clipv1.ROOM_TYPES else 'zone',
+        'metadata': {'name': group.get('name', '')},
+        'children': [{'rid': light_id, 'rtype': 'light'} for light_id in group.get('lights', [])],
+        'services': [{'rid': group_id, 'rtype': 'grouped_light'}],
+    }
+
+
+def clip_result(result, resource_id, resource_type):
+    """
+    Translates a v1 write result, a list of success and error entries, to a Clipv2 style result. The resource is
+    listed as changed if anything was set.
+    :param result:
+    :param resource_id:
+    :param resource_type:
+    :return:
+    """
+    if not isinstance(result, list):
+        return result if isinstance(result, ErrorResult) else False
+    errors = [{'description': entry['error'].get('description', '')} for entry in result if 'error' in entry]
+    changed = any('success' in entry for entry in result)
+    return {'errors': errors, 'data': [{'rid': resource_id, 'rtype': resource_type}] if changed else []}
+
+
+def retarget_result(result, group_id, light_id):
+    """
+    Turns the result of a group action into the result for one of its lights
+    :param result:
+    :param group_id:
+    :param light_id:
+    :return:
+    """
+    if not result or type(result) == bool:
+        return result
+    return dict(result, data=[{'rid': light_id, 'rtype': 'light'} for item in result['data']
+                              if item.get('rid') == group_id])
@@ -1,33 +1,60 @@
 # -*- coding: utf-8 -*-
-import json
-import requests
-import urllib3
-from json import JSONDecodeError
+from .backend import Backend
+from .codec import default_codec
+from .config import load_bridges
+from .resilience import ErrorResult
+from .transport import Transport
 
 
-class Clipv2:
+class Clipv2(Backend):
     """
     Simple adapter class for communicating with the Philips Hue Clipv2 API
     """
     CONFIG_FILE = "config.json"
-    VERIFY_SSL = False
+    STREAM_TIMEOUT = (3.05, 300)
+    EVENT_STREAM = True
 
-    def __init__(self):
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        self.application_key = ''
-        self.bridge = ''
-        self.protocol = 'https://'
-        self._load_config()
+    def __init__(self, pool_size=None, timeout=None, bridge=None, application_key=None, protocol='https://',
+                 rate_limiter=None, codec=None, metrics=None, client_key=None, deadline=None, retry_policy=None,
+                 circuit_breaker=None, transport=None):
+        """
+        :param transport: Transport to send requests through, created from the other arguments if not given
+        """
+        self.application_key = application_key or ''
+        self.client_key = client_key
+        self.bridge = bridge or ''
+        self.protocol = protocol
+        self.codec = codec or default_codec
+        if not self.bridge:
+            self._load_config()
+        self.transport = transport or Transport(self.bridge, protocol, {"hue-application-key": self.application_key},
+                                                pool_size, timeout, deadline, rate_limiter, retry_policy,
+                                                circuit_breaker, metrics)
+        self.session = self.transport.session
+        self.pool_size = self.transport.pool_size
+        self.timeout = self.transport.timeout
+        self.deadline = self.transport.deadline
+        self.rate_limiter = self.transport.rate_limiter
+        self.retry_policy = self.transport.retry_policy
+        self.circuit_breaker = self.transport.circuit_breaker
+        self.metrics = self.transport.metrics
 
     def _load_config(self):
         """
-        Loads configuration from self.CONFIG_FILE
+        Loads configuration from self.CONFIG_FILE, the first bridge is used if several are configured
         :return:
         """
-        with open(self.CONFIG_FILE, 'r') as file:
-            data = json.load(file)
-            self.application_key = data['username']
-            self.bridge = data['bridge']
+        entry = load_bridges(self.CONFIG_FILE)[0]
+        self.application_key = entry['username']
+        self.bridge = entry['bridge']
+        self.client_key = self.client_key or entry.get('clientkey')
+
+    def close(self):
+        """
+        Closes all pooled connections to the bridge
+        :return:
+        """
+        self.transport.close()
 
     def _get_endpoint_url(self, endpoint):
         """
@@ -35,60 +62,190 @@ class Clipv2:
         :param endpoint:
         :return:
         """
-        return self.protocol+self.bridge+'/clip/v2/'+endpoint
+        return self.transport.url('clip/v2/'+endpoint)
 
-    def call_get(self, endpoint):
+    def open_event_stream(self):
         """
-        Makes a GET request to specified URL and returns JSON data
+        Opens a streaming connection to the bridge's event stream, the caller is responsible for closing it
+        :return:
+        """
+        return self.transport.stream('eventstream/clip/v2', {"Accept": "text/event-stream"}, self.STREAM_TIMEOUT)
+
+    def _send(self, method, endpoint, body=None, timeout=None):
+        """
+        Sends a request to a Clipv2 endpoint through the transport
+        :param method:
         :param endpoint:
+        :param body:
+        :param timeout: seconds the whole call may take, retries included
+        :return: the response, or an ErrorResult if the bridge couldn't be reached
+        """
+        return self.transport.send(method, 'clip/v2/'+endpoint, endpoint, body, timeout)
+
+    def _decode(self, content):
+        """
+        Decodes a response body, returns False if it isn't valid JSON
+        :param content:
         :return:
         """
-        url = self._get_endpoint_url(endpoint)
         try:
-            return json.loads(requests.get(url, verify=self.VERIFY_SSL,
-                                           headers={"hue-application-key": self.application_key}).text)
-        except JSONDecodeError:
+            return self.codec.decode(content)
+        except ValueError:
+            self.metrics.inc('hue_decode_errors_total')
             return False
 
-    def call_put(self, endpoint, body):
+    def call_get_raw(self, endpoint, timeout=None):
+        """
+        Makes a GET request to specified URL and returns the undecoded response body
+        :param endpoint:
+        :param timeout: deadline of the call in seconds
+        :return: the body, or an ErrorResult if the bridge couldn't be reached
+        """
+        response = self._send('GET', endpoint, timeout=timeout)
+        if isinstance(response, ErrorResult):
+            return response
+        return response.content
+
+    def call_get(self, endpoint, timeout=None):
+        """
+        Makes a GET request to specified URL and returns JSON data
+        :param endpoint:
+        :param timeout: deadline of the call in seconds
+        :return:
+        """
+        content = self.call_get_raw(endpoint, timeout)
+        if isinstance(content, ErrorResult):
+            return content
+        return self._decode(content)
+
+    def call_put(self, endpoint, body, timeout=None):
         """
         Makes a PUT request to a specified URL and returns JSON data
         :param endpoint:
-        :param body:
+        :param body: object to encode as JSON, or an already encoded str/bytes
+        :param timeout: deadline of the call in seconds
         :return:
         """
-        url = self._get_endpoint_url(endpoint)
-        try:
-            return json.loads(requests.put(url, body, verify=self.VERIFY_SSL,
-                                           headers={"hue-application-key": self.application_key}).text)
-        except JSONDecodeError:
-            return False
+        if not isinstance(body, (str, bytes)):
+            body = self.codec.encode(body)
+        response = self._send('PUT', endpoint, body, timeout)
+        if isinstance(response, ErrorResult):
+            return response
+        return self._decode(response.content)
 
-    def list_lights(self):
+    @staticmethod
+    def result_errors(result, resource_id=None):
         """
-        List all available lights
+        Returns a list of error descriptions for a PUT result, empty if the bridge confirmed the change
+        :param result:
+        :param resource_id: if set, the resource that should be listed as changed
+        :return:
+        """
+        if isinstance(result, ErrorResult):
+            return [result.description]
+        if not result or type(result) == bool:
+            return ['No valid response from bridge']
+
+        errors = [error['description'] for error in result.get('errors', [])]
+        if not errors and resource_id and not any(item.get('rid') == resource_id for item in result.get('data', [])):
+            errors.append('Change to '+resource_id+' was not confirmed')
+        return errors
+
+    def list_resources(self, resource_type):
+        """
+        List all resources of the specified type, keyed by id
+        :param resource_type:
         :return:
         """
-        data = self.call_get('resource/light')
+        data = self.call_get('resource/'+resource_type)
         if data and type(data) != bool:
             output = {}
-            for light in data['data']:
-                output[light['id']] = light
+            for resource in data['data']:
+                output[resource['id']] = resource
             return output
+        if isinstance(data, ErrorResult):
+            return data
         return False
 
+    def list_lights(self):
+        """
+        List all available lights
+        :return:
+        """
+        return self.list_resources('light')
+
     def list_rooms(self):
         """
         List all configured rooms
         :return:
         """
-        data = self.call_get('resource/room')
-        if data and type(data) != bool:
-            output = {}
-            for room in data['data']:
-                output[room['id']] = room
-            return output
-        return False
+        return self.list_resources('room')
+
+    def list_light_states(self):
+        """
+        List all available lights decoded straight to LightState objects
+        :return:
+        """
+        try:
+            content = self.call_get_raw('resource/light')
+            if isinstance(content, ErrorResult):
+                return content
+            return self.codec.decode_lights(content)
+        except ValueError:
+            self.metrics.inc('hue_decode_errors_total')
+            return False
+
+    def list_room_states(self):
+        """
+        List all configured rooms decoded straight to RoomState objects
+        :return:
+        """
+        try:
+            content = self.call_get_raw('resource/room')
+            if isinstance(content, ErrorResult):
+                return content
+            return self.codec.decode_rooms(content)
+        except ValueError:
+            self.metrics.inc('hue_decode_errors_total')
+            return False
+
+    def list_zone_states(self):
+        """
+        List all configured zones decoded straight to RoomState objects
+        :return:
+        """
+        try:
+            content = self.call_get_raw('resource/zone')
+            if isinstance(content, ErrorResult):
+                return content
+            return self.codec.decode_rooms(content)
+        except ValueError:
+            self.metrics.inc('hue_decode_errors_total')
+            return False
+
+    def list_zones(self):
+        """
+        List all configured zones
+        :return:
+        """
+        return self.list_resources('zone')
+
+    def list_devices(self):
+        """
+        List all devices
+        :return:
+        """
+        return self.list_resources('device')
+
+    def get_bridge_id(self):
+        """
+        Gets the unique id of the bridge
+        :return:
+        """
+        data = self.list_resources('bridge')
+        if data:
+            return next(iter(data.values()))['bridge_id']
+        return data
 
     def set_light_state(self, light_id, state):
         """
@@ -97,7 +254,16 @@ class Clipv2:
         :param state:
         :return:
         """
-        return self.call_put('resource/light/'+light_id, json.dumps(state))
+        return self.call_put('resource/light/'+light_id, state)
+
+    def set_grouped_light_state(self, grouped_light_id, state):
+        """
+        Sets the state of all lights in a room or zone with a single request
+        :param grouped_light_id:
+        :param state:
+        :return:
+        """
+        return self.call_put('resource/grouped_light/'+grouped_light_id, state)
 
     def get_light_state(self, light_id):
         """
@@ -110,3 +276,37 @@ class Clipv2:
             return data['data'][0]
 
         return data
+
+    def list_entertainment_configurations(self):
+        """
+        List all entertainment configurations
+        :return:
+        """
+        return self.list_resources('entertainment_configuration')
+
+    def start_entertainment(self, config_id):
+        """
+        Puts an entertainment configuration in streaming mode, the bridge then accepts frames for it
+        :param config_id:
+        :return:
+        """
+        return self.call_put('resource/entertainment_configuration/'+config_id, {'action': 'start'})
+
+    def stop_entertainment(self, config_id):
+        """
+        Ends streaming mode of an entertainment configuration, the lights return to normal control
+        :param config_id:
+        :return:
+        """
+        return self.call_put('resource/entertainment_configuration/'+config_id, {'action': 'stop'})
+
+    def get_application_id(self):
+        """
+        Gets the hue-application-id belonging to the application key, the identity used when streaming
+        :return: the id, an ErrorResult if the bridge couldn't be reached or False if it sent no id
+        """
+        response = self.transport.send('GET', 'auth/v1', 'auth/v1')
+        if isinstance(response, ErrorResult):
+            return response
+        return response.headers.get('hue-application-id', False)
+
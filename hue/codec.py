@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import json
+from typing import List, Optional
+from .model import LightState, RoomState
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if msgspec is not None:
+    # Only the fields used by LightState and RoomState are declared, msgspec skips everything else while decoding
+
+    class _Resource(msgspec.Struct):
+        rid: str
+        rtype: str = ''
+
+    class _Metadata(msgspec.Struct):
+        name: str = ''
+
+    class _On(msgspec.Struct):
+        on: bool
+
+    class _Dimming(msgspec.Struct):
+        brightness: float = 0.0
+        min_dim_level: float = 0.0
+
+    class _MirekSchema(msgspec.Struct):
+        mirek_minimum: int
+        mirek_maximum: int
+
+    class _ColorTemperature(msgspec.Struct):
+        mirek: Optional[int] = None
+        mirek_schema: Optional[_MirekSchema] = None
+
+    class _Light(msgspec.Struct):
+        id: str
+        owner: _Resource
+        metadata: _Metadata
+        on: _On
+        dimming: Optional[_Dimming] = None
+        color_temperature: Optional[_ColorTemperature] = None
+
+    class _Room(msgspec.Struct):
+        id: str
+        metadata: _Metadata
+        children: List[_Resource] = []
+        services: List[_Resource] = []
+
+    class _LightCollection(msgspec.Struct):
+        data: List[_Light]
+
+    class _RoomCollection(msgspec.Struct):
+        data: List[_Room]
+
+
+class Codec:
+    """
+    JSON codec working directly on bytes, using the fastest installed backend: msgspec, orjson or the standard library
+    """
+    BACKENDS = ('msgspec', 'orjson', 'json')
+
+    def __init__(self, backend=None):
+        self.backend = backend or self.default_backend()
+        if self.backend == 'msgspec' and msgspec is not None:
+            self._decoder = msgspec.json.Decoder()
+            self._encoder = msgspec.json.Encoder()
+            self._light_decoder = msgspec.json.Decoder(_LightCollection)
+            self._room_decoder = msgspec.json.Decoder(_RoomCollection)
+        elif self.backend == 'orjson' and orjson is not None:
+            pass
+        elif self.backend == 'json':
+            pass
+        else:
+            raise ValueError("JSON backend "+str(self.backend)+" isn't available")
+
+    @staticmethod
+    def default_backend():
+        """
+        Picks the fastest installed backend
+        :return:
+        """
+        if msgspec is not None:
+            return 'msgspec'
+        if orjson is not None:
+            return 'orjson'
+        return 'json'
+
+    def decode(self, data):
+        """
+        Decodes JSON from bytes, raises ValueError if the data isn't valid JSON
+        :param data:
+        :return:
+        """
+        if self.backend == 'msgspec':
+            try:
+                return self._decoder.decode(data)
+            except msgspec.DecodeError as e:
+                raise ValueError(str(e))
+        if self.backend == 'orjson':
+            return orjson.loads(data)
+        return json.loads(data)
+
+    def encode(self, obj):
+        """
+        Encodes an object to JSON bytes
+        :param obj:
+        :return:
+        """
+        if self.backend == 'msgspec':
+            return self._encoder.encode(obj)
+        if self.backend == 'orjson':
+            return orjson.dumps(obj)
+        return json.dumps(obj).encode()
+
+    def decode_lights(self, data):
+        """
+        Decodes a Clipv2 light collection straight to light states, raises ValueError on invalid data
+        :param data:
+        :return: dict of light_id => LightState
+        """
+        if self.backend != 'msgspec':
+            return {light['id']: LightState.from_clip(light) for light in self._collection(data)}
+
+        output = {}
+        for light in self._decode_typed(self._light_decoder, data).data:
+            state = LightState(light.id, light.owner.rid, light.metadata.name, light.on.on)
+            if light.dimming:
+                state.brightness = light.dimming.brightness
+                state.min_dim_level = light.dimming.min_dim_level
+            color_temperature = light.color_temperature
+            if color_temperature:
+                state.mirek = color_temperature.mirek
+                if color_temperature.mirek_schema:
+                    state.mirek_minimum = color_temperature.mirek_schema.mirek_minimum
+                    state.mirek_maximum = color_temperature.mirek_schema.mirek_maximum
+            output[light.id] = state
+        return output
+
+    def decode_rooms(self, data):
+        """
+        Decodes a Clipv2 room or zone collection straight to room states, raises ValueError on invalid data
+        :param data:
+        :return: dict of room_id => RoomState
+        """
+        if self.backend != 'msgspec':
+            return {room['id']: RoomState.from_clip(room) for room in self._collection(data)}
+
+        output = {}
+        for room in self._decode_typed(self._room_decoder, data).data:
+            grouped_light = None
+            for service in room.services:
+                if service.rtype == 'grouped_light':
+                    grouped_light = service.rid
+            output[room.id] = RoomState(room.id, room.metadata.name,
+                                        [(child.rid, child.rtype) for child in room.children], grouped_light)
+        return output
+
+    def _collection(self, data):
+        try:
+            return self.decode(data)['data']
+        except (KeyError, TypeError) as e:
+            raise ValueError("Not a resource collection: "+str(e))
+
+    @staticmethod
+    def _decode_typed(decoder, data):
+        try:
+            return decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e))
+
+
+default_codec = Codec()
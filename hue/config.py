@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+import json
+
+
+def load_bridges(config_file):
+    """
+    Reads the bridges from the config file, which either has a single bridge and username or a list of them under
+    bridges
+    :param config_file:
+    :return: list of dicts with bridge, username and optionally name, api and clientkey
+    """
+    with open(config_file, 'r') as file:
+        data = json.load(file)
+    if 'bridges' in data:
+        return data['bridges']
+    return [{'bridge': data['bridge'], 'username': data['username'], 'api': data.get('api'),
+             'clientkey': data.get('clientkey')}]
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import wx
+from .metrics import default_metrics
+
+
+class DebugFrame(wx.Frame):
+    """
+    Window showing the live metrics, opening it turns metrics collection on
+    """
+    REFRESH_INTERVAL = 1000
+
+    def __init__(self, parent, metrics=None):
+        """
+        :param parent:
+        :param metrics: defaults to the shared metrics
+        """
+        wx.Frame.__init__(self, parent, wx.ID_ANY, "PyHue metrics", size=(700, 600))
+        self.metrics = metrics or default_metrics
+        self.metrics.enabled = True
+
+        panel = wx.Panel(self)
+        self.text = wx.TextCtrl(panel, wx.ID_ANY, style=wx.TE_MULTILINE | wx.TE_READONLY | wx.TE_DONTWRAP)
+        self.text.SetFont(wx.Font(9, wx.FONTFAMILY_TELETYPE, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL))
+        reset_button = wx.Button(panel, wx.ID_ANY, "Reset")
+        reset_button.Bind(wx.EVT_BUTTON, self.on_reset)
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.text, 1, wx.ALL | wx.EXPAND, 5)
+        sizer.Add(reset_button, 0, wx.ALL, 5)
+        panel.SetSizer(sizer)
+
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.refresh)
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+        self.timer.Start(self.REFRESH_INTERVAL)
+        self.refresh()
+
+    def on_reset(self, event):
+        self.metrics.reset()
+        self.refresh()
+
+    def on_close(self, event):
+        self.timer.Stop()
+        self.Destroy()
+
+    def refresh(self, event=None):
+        """
+        Redraws the metrics, keeping the scroll position
+        :param event:
+        :return:
+        """
+        position = self.text.GetScrollPos(wx.VERTICAL)
+        self.text.ChangeValue(format_snapshot(self.metrics.snapshot()))
+        self.text.ShowPosition(self.text.XYToPosition(0, position))
+
+
+def format_snapshot(snapshot):
+    """
+    Formats a metrics snapshot as aligned plain text, durations in milliseconds
+    :param snapshot:
+    :return:
+    """
+    def milliseconds(value):
+        if value is None:
+            return '-'
+        return '%.1f' % (value * 1000) if value != float('inf') else 'inf'
+
+    lines = ['Gauges']
+    for name, values in sorted(snapshot['gauges'].items()):
+        for labels, value in sorted(values.items()):
+            lines.append('  %-80s %s' % (name+('{'+labels+'}' if labels else ''), value))
+    lines += ['', 'Counters']
+    for name, values in sorted(snapshot['counters'].items()):
+        for labels, value in sorted(values.items()):
+            lines.append('  %-80s %s' % (name+('{'+labels+'}' if labels else ''), value))
+    lines += ['', 'Histograms (ms)', '  %-80s %8s %8s %8s %8s %8s' % ('', 'count', 'mean', 'p50', 'p90', 'p99')]
+    for name, values in sorted(snapshot['histograms'].items()):
+        for labels, summary in sorted(values.items()):
+            lines.append('  %-80s %8d %8s %8s %8s %8s' % (
+                name+('{'+labels+'}' if labels else ''), summary['count'], milliseconds(summary['mean']),
+                milliseconds(summary['p50']), milliseconds(summary['p90']), milliseconds(summary['p99'])))
+    return '\n'.join(lines)
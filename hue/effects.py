@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Event, Lock, Thread
+from time import monotonic
+from .clipv2 import Clipv2
+from .ratelimit import RateLimiter
+
+
+class Keyframe:
+    """
+    A state reached offset seconds after the effect starts, states use the backend independent keys on (bool),
+    brightness (0-100), mirek and xy (x, y tuple)
+    """
+    __slots__ = ('offset', 'state', 'transition')
+
+    def __init__(self, offset, state, transition=0.0):
+        self.offset = offset
+        self.state = state
+        self.transition = transition
+
+
+class Effect:
+    """
+    Named sequence of keyframes, the captured state of every light is restored once the effect's duration has passed
+    """
+    def __init__(self, name, keyframes, restore=True, duration=None):
+        """
+        :param name:
+        :param keyframes:
+        :param restore:
+        :param duration: seconds until the state is restored, defaults to the end of the last keyframe's transition
+        """
+        self.name = name
+        self.keyframes = sorted(keyframes, key=lambda keyframe: keyframe.offset)
+        self.restore = restore
+        if duration is None:
+            duration = self.keyframes[-1].offset + self.keyframes[-1].transition if self.keyframes else 0.0
+        self.duration = duration
+
+
+def flash(flashes=3, interval=0.2, brightness=100.0):
+    """
+    Turns lights on at full brightness and off again the specified number of times, the last off is followed by the
+    restored state
+    :param flashes:
+    :param interval: seconds between each on and off
+    :param brightness:
+    :return:
+    """
+    keyframes = []
+    for i in range(flashes):
+        keyframes.append(Keyframe(2 * i * interval, {'on': True, 'brightness': brightness}))
+        keyframes.append(Keyframe((2 * i + 1) * interval, {'on': False}))
+    return Effect('flash', keyframes, duration=2 * flashes * interval)
+
+
+def pulse(cycles=3, period=2.0, low=10.0, high=100.0):
+    """
+    Breathes the brightness between low and high, using the bridge's transitions for smooth steps
+    :param cycles:
+    :param period: seconds per cycle
+    :param low:
+    :param high:
+    :return:
+    """
+    half = period / 2
+    keyframes = [Keyframe(0.0, {'on': True, 'brightness': low})]
+    for i in range(cycles):
+        keyframes.append(Keyframe(i * period + half, {'brightness': high}, half))
+        keyframes.append(Keyframe((i + 1) * period, {'brightness': low}, half))
+    return Effect('pulse', keyframes)
+
+
+def fade(brightness, duration=5.0, restore=False):
+    """
+    Fades to a brightness using the bridge's transition
+    :param brightness: target brightness, 0 turns the lights off at the end
+    :param duration: seconds
+    :param restore: whether to go back to the original state afterwards, normally a fade is meant to stay
+    :return:
+    """
+    keyframes = [Keyframe(0.0, {'on': True, 'brightness': max(brightness, 0.0)}, duration)]
+    if brightness <= 0:
+        keyframes.append(Keyframe(duration, {'on': False}))
+    return Effect('fade', keyframes, restore, duration)
+
+
+def color_loop(colors, cycles=1, period=6.0):
+    """
+    Cycles through a list of xy colours, transitioning between them
+    :param colors: list of (x, y) tuples
+    :param cycles:
+    :param period: seconds per loop through all colours
+    :return:
+    """
+    step = period / len(colors)
+    keyframes = [Keyframe(0.0, {'on': True, 'xy': tuple(colors[0])})]
+    for i in range(1, cycles * len(colors) + 1):
+        keyframes.append(Keyframe(i * step, {'xy': tuple(colors[i % len(colors)])}, step))
+    return Effect('color_loop', keyframes)
+
+
+class ClipTarget:
+    """
+    Effect backend for Clipv2 and BridgePool clients, rate limits are applied by the client
+    """
+    def __init__(self, client):
+        self.client = client
+
+    def capture(self, light_id):
+        """
+        Reads the light's current state
+        :param light_id:
+        :return: state in effect keys or None if it couldn't be read
+        """
+        data = self.client.get_light_state(light_id)
+        if not data or type(data) == bool:
+            return None
+        state = {'on': data['on']['on']}
+        if 'dimming' in data:
+            state['brightness'] = data['dimming']['brightness']
+        mirek = data.get('color_temperature', {}).get('mirek')
+        if mirek is not None:
+            state['mirek'] = mirek
+        elif 'color' in data:
+            state['xy'] = (data['color']['xy']['x'], data['color']['xy']['y'])
+        return state
+
+    def write(self, light_id, state, transition):
+        """
+        Sends a state
+        :param light_id:
+        :param state:
+        :param transition: seconds
+        :return: list of errors
+        """
+        body = {}
+        if 'on' in state:
+            body['on'] = {'on': state['on']}
+        if 'brightness' in state:
+            body['dimming'] = {'brightness': state['brightness']}
+        if 'mirek' in state:
+            body['color_temperature'] = {'mirek': state['mirek']}
+        if 'xy' in state:
+            body['color'] = {'xy': {'x': state['xy'][0], 'y': state['xy'][1]}}
+        body['dynamics'] = {'duration': int(transition * 1000)}
+        return Clipv2.result_errors(self.client.set_light_state(light_id, body))
+
+
+class HueTarget:
+    """
+    Effect backend for the v1 Hue class, which has no rate limiting of its own
+    """
+    def __init__(self, hue, rate_limiter=None):
+        self.hue = hue
+        self.rate_limiter = rate_limiter or RateLimiter()
+
+    def capture(self, light_id):
+        data = self.hue.get_light_state(light_id)
+        if not isinstance(data, dict) or 'state' not in data:
+            return None
+        light = data['state']
+        state = {'on': light.get('on', False)}
+        if 'bri' in light:
+            state['brightness'] = light['bri'] / 254 * 100
+        if light.get('colormode') == 'ct' and 'ct' in light:
+            state['mirek'] = light['ct']
+        elif 'xy' in light:
+            state['xy'] = tuple(light['xy'])
+        return state
+
+    def write(self, light_id, state, transition):
+        body = {'transitiontime': int(round(transition * 10))}
+        if 'on' in state:
+            body['on'] = state['on']
+        if 'brightness' in state:
+            body['bri'] = max(1, min(254, int(round(state['brightness'] * 2.54))))
+        if 'mirek' in state:
+            body['ct'] = state['mirek']
+        if 'xy' in state:
+            body['xy'] = list(state['xy'])
+        self.rate_limiter.acquire('PUT', 'lights/'+str(light_id))
+        result = self.hue.set_light_state(light_id, body)
+        if not isinstance(result, list):
+            return ['No valid response from bridge']
+        return [item['error']['description'] for item in result if 'error' in item]
+
+
+class EffectRun:
+    """
+    An effect running on a set of lights, with its timing statistics
+    """
+    def __init__(self, effect, light_ids, started):
+        self.effect = effect
+        self.light_ids = list(light_ids)
+        self.started = started
+        self.captured = {}
+        self.next_keyframe = 0
+        self.cancelled = False
+        self.done = Event()
+        self.lateness = []
+        self.merged = 0
+        self.errors = 0
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def stats(self):
+        """
+        Timing accuracy of the run: how late keyframes were handed to the sender compared to their deadlines, how
+        many writes were merged into a newer write before they could be sent and how many failed
+        :return:
+        """
+        lateness = sorted(self.lateness)
+        return {
+            'effect': self.effect.name,
+            'lights': len(self.light_ids),
+            'keyframes': len(lateness),
+            'late_mean': sum(lateness) / len(lateness) if lateness else 0.0,
+            'late_p99': lateness[min(len(lateness) - 1, int(0.99 * len(lateness)))] if lateness else 0.0,
+            'late_max': lateness[-1] if lateness else 0.0,
+            'merged': self.merged,
+            'errors': self.errors,
+            'done': self.done.is_set(),
+        }
+
+
+class EffectEngine:
+    """
+    Runs effects for any number of lights from one scheduler thread. Keyframes are due at fixed deadlines from the
+    start of their effect so timing doesn't drift, writes for the same light that become due together are merged, and
+    a light only ever has one write in flight, newer writes replacing ones that haven't been sent yet.
+    """
+    SENDERS = 4
+
+    def __init__(self, target, senders=None):
+        """
+        :param target: ClipTarget, HueTarget or anything with capture(light_id) and write(light_id, state, transition)
+        :param senders: number of threads sending writes
+        """
+        self.target = target
+        self.schedule = []
+        self.runs = {}
+        self.pending = {}
+        self.in_flight = set()
+        self.executor = ThreadPoolExecutor(max_workers=senders or self.SENDERS)
+        self._condition = Condition()
+        self._send_lock = Lock()
+        self._sequence = 0
+        self._stopped = False
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def for_client(cls, client, **kwargs):
+        """
+        Creates an engine for a v1 Hue, Clipv2 or BridgePool client
+        :param client:
+        :param kwargs:
+        :return:
+        """
+        from .hue import Hue
+        return cls(HueTarget(client) if isinstance(client, Hue) else ClipTarget(client), **kwargs)
+
+    def start(self, effect, light_ids):
+        """
+        Captures the lights' current state and starts an effect on them. Lights taken over from a running effect keep
+        the state captured by that effect, so they are still restored to how they were before any effect. They aren't
+        captured again if that effect couldn't capture them, their current state is the effect's and not theirs.
+        :param effect:
+        :param light_ids:
+        :return: EffectRun
+        """
+        light_ids = list(light_ids)
+        taken_over = set()
+        inherited = {}
+        with self._condition:
+            for light_id in light_ids:
+                previous = self.runs.get(light_id)
+                if previous and light_id in previous.light_ids:
+                    taken_over.add(light_id)
+                    previous.light_ids.remove(light_id)
+                    if light_id in previous.captured:
+                        inherited[light_id] = previous.captured.pop(light_id)
+                    if not previous.light_ids:
+                        previous.cancelled = True
+                        previous.done.set()
+
+        missing = [light_id for light_id in light_ids if light_id not in taken_over]
+        captured = dict(zip(missing, self.executor.map(self.target.capture, missing)))
+        captured.update(inherited)
+
+        run = EffectRun(effect, light_ids, monotonic())
+        run.captured = {light_id: state for light_id, state in captured.items() if state is not None}
+        with self._condition:
+            for light_id in light_ids:
+                self.runs[light_id] = run
+            self._push(run)
+            self._condition.notify()
+        return run
+
+    def cancel(self, run, restore=True):
+        """
+        Stops an effect, optionally restoring the captured state right away
+        :param run:
+        :param restore:
+        :return:
+        """
+        with self._condition:
+            if run.done.is_set():
+                return
+            run.cancelled = True
+            self._finish(run, restore)
+
+    def stop(self):
+        """
+        Stops the scheduler, running effects are left where they are
+        :return:
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+        self.executor.shutdown(wait=True)
+
+    def _push(self, run):
+        """
+        Schedules the next keyframe of a run, must be called with the condition held
+        :param run:
+        :return:
+        """
+        if run.next_keyframe < len(run.effect.keyframes):
+            deadline = run.started + run.effect.keyframes[run.next_keyframe].offset
+        elif run.effect.restore:
+            deadline = run.started + run.effect.duration
+        else:
+            return self._finish(run, restore=False)
+        self._sequence += 1
+        heapq.heappush(self.schedule, (deadline, self._sequence, run))
+
+    def _finish(self, run, restore):
+        """
+        Ends a run and queues the restore writes, must be called with the condition held
+        :param run:
+        :param restore:
+        :return:
+        """
+        for light_id in run.light_ids:
+            if self.runs.get(light_id) is run:
+                del self.runs[light_id]
+            if restore and light_id in run.captured:
+                self._send(run, light_id, dict(run.captured[light_id]), 0.0)
+        run.done.set()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (not self.schedule or self.schedule[0][0] > monotonic()):
+                    self._condition.wait(self.schedule[0][0] - monotonic() if self.schedule else None)
+                if self._stopped:
+                    return
+
+                # Everything due now is handled as one tick, so writes for the same light are merged
+                now = monotonic()
+                writes = {}
+                while self.schedule and self.schedule[0][0] <= now:
+                    deadline, sequence, run = heapq.heappop(self.schedule)
+                    if run.cancelled or run.done.is_set():
+                        continue
+                    if run.next_keyframe >= len(run.effect.keyframes):
+                        self._finish(run, restore=True)
+                        continue
+                    keyframe = run.effect.keyframes[run.next_keyframe]
+                    run.next_keyframe += 1
+                    run.lateness.append(now - deadline)
+                    for light_id in run.light_ids:
+                        if light_id in writes:
+                            run.merged += 1
+                            writes[light_id][1].update(keyframe.state)
+                        else:
+                            writes[light_id] = (run, dict(keyframe.state), keyframe.transition)
+                    self._push(run)
+
+                for light_id, (run, state, transition) in writes.items():
+                    self._send(run, light_id, state, transition)
+
+    def _send(self, run, light_id, state, transition):
+        """
+        Sends a write unless the light already has one in flight, in which case it replaces the pending write
+        :param run:
+        :param light_id:
+        :param state:
+        :param transition:
+        :return:
+        """
+        with self._send_lock:
+            if light_id in self.in_flight:
+                previous = self.pending.get(light_id)
+                if previous:
+                    previous[0].merged += 1
+                    state = dict(previous[1], **state)
+                self.pending[light_id] = (run, state, transition)
+                return
+            self.in_flight.add(light_id)
+        self.executor.submit(self._write, run, light_id, state, transition)
+
+    def _write(self, run, light_id, state, transition):
+        while True:
+            try:
+                errors = self.target.write(light_id, state, transition)
+            except Exception as e:
+                errors = [str(e)]
+            if errors:
+                run.errors += 1
+            with self._send_lock:
+                pending = self.pending.pop(light_id, None)
+                if pending is None:
+                    self.in_flight.discard(light_id)
+                    return
+            run, state, transition = pending
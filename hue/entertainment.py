@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+import socket
+import struct
+from collections import deque
+from threading import Event, Lock, Thread
+from time import monotonic, sleep
+
+try:
+    from mbedtls import tls
+except ImportError:
+    tls = None
+
+HEADER = b'HueStream'
+VERSION = (2, 0)
+COLOR_SPACES = {'rgb': 0, 'xy': 1}
+MAX_CHANNELS = 20
+PORT = 2100
+_PREFIX = struct.Struct('>9sBBBHBB')
+_CHANNEL = struct.Struct('>BHHH')
+
+
+def encode_frame(config_id, sequence, channels, color_space='rgb'):
+    """
+    Encodes a HueStream v2 frame
+    :param config_id: id of the entertainment configuration, 36 characters
+    :param sequence: sequence number, wraps at 256
+    :param channels: dict of channel id => three values between 0 and 1, either r, g, b or x, y, brightness
+    :param color_space: 'rgb' or 'xy'
+    :return: bytes
+    """
+    if len(channels) > MAX_CHANNELS:
+        raise ValueError("A frame can hold at most "+str(MAX_CHANNELS)+" channels")
+    config_id = config_id.encode('ascii')
+    if len(config_id) != 36:
+        raise ValueError("Entertainment configuration id must be 36 characters")
+    parts = [_PREFIX.pack(HEADER, VERSION[0], VERSION[1], sequence & 0xff, 0, COLOR_SPACES[color_space], 0), config_id]
+    for channel_id, values in channels.items():
+        parts.append(_CHANNEL.pack(channel_id, *(int(round(min(max(value, 0.0), 1.0) * 0xffff)) for value in values)))
+    return b''.join(parts)
+
+
+def decode_frame(data):
+    """
+    Decodes a HueStream v2 frame
+    :param data:
+    :return: dict with sequence, color_space, config_id and channels
+    :raises ValueError: if data isn't a HueStream v2 frame
+    """
+    header_size = _PREFIX.size + 36
+    if len(data) < header_size or (len(data) - header_size) % _CHANNEL.size:
+        raise ValueError("Invalid frame size "+str(len(data)))
+    header, major, minor, sequence, reserved, color_space, reserved = _PREFIX.unpack_from(data)
+    if header != HEADER or (major, minor) != VERSION:
+        raise ValueError("Not a HueStream v2 frame")
+    channels = {}
+    for offset in range(header_size, len(data), _CHANNEL.size):
+        channel_id, a, b, c = _CHANNEL.unpack_from(data, offset)
+        channels[channel_id] = (a / 0xffff, b / 0xffff, c / 0xffff)
+    return {
+        'sequence': sequence,
+        'color_space': 'xy' if color_space == COLOR_SPACES['xy'] else 'rgb',
+        'config_id': data[_PREFIX.size:header_size].decode('ascii'),
+        'channels': channels,
+    }
+
+
+class UdpTransport:
+    """
+    Sends frames as plain UDP datagrams, for local receivers that stand in for a bridge
+    """
+    def __init__(self, host, port=PORT):
+        self.address = (host, port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.connect(self.address)
+
+    def send(self, data):
+        self.socket.send(data)
+
+    def close(self):
+        self.socket.close()
+
+
+class DtlsTransport:
+    """
+    Sends frames over DTLS with a pre-shared key, as the bridge requires. Needs the optional python-mbedtls package.
+    """
+    CIPHERS = ('TLS-PSK-WITH-AES-128-GCM-SHA256',)
+    HANDSHAKE_TIMEOUT = 5
+
+    def __init__(self, host, application_id, client_key, port=PORT):
+        """
+        :param host: bridge address
+        :param application_id: hue-application-id of the application key, used as PSK identity
+        :param client_key: client key received when the application key was created, hex encoded
+        :param port:
+        """
+        if tls is None:
+            raise RuntimeError("DtlsTransport requires the python-mbedtls package")
+        configuration = tls.DTLSConfiguration(pre_shared_key=(application_id, bytes.fromhex(client_key)),
+                                              ciphers=self.CIPHERS, validate_certificates=False)
+        raw = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        raw.settimeout(self.HANDSHAKE_TIMEOUT)
+        self.socket = tls.ClientContext(configuration).wrap_socket(raw, server_hostname=None)
+        self.socket.connect((host, port))
+        self.socket.do_handshake()
+
+    @staticmethod
+    def available():
+        """
+        Whether the optional python-mbedtls dependency is installed
+        :return:
+        """
+        return tls is not None
+
+    def send(self, data):
+        self.socket.send(data)
+
+    def close(self):
+        self.socket.close()
+
+
+class EntertainmentStream:
+    """
+    Streams the latest channel colours of an entertainment configuration at a fixed frame rate. Frames are due at fixed
+    deadlines from the start of the stream, frames whose slot has passed by more than a frame are dropped rather
+    than sent late, and every frame is sent even if nothing changed since the bridge ends streams that go quiet.
+    """
+    RATE = 25
+    MIN_RATE = 1
+    MAX_RATE = 50
+    # Frames the jitter stats are computed over, two minutes at the default rate
+    LATENESS_SAMPLES = 3000
+
+    def __init__(self, transport, config_id, rate=None, color_space='rgb', on_stop=None):
+        """
+        :param transport: UdpTransport, DtlsTransport or anything with send(data) and close()
+        :param config_id: entertainment configuration id
+        :param rate: frames per second
+        :param color_space: 'rgb' or 'xy'
+        :param on_stop: called after the stream has stopped, e.g. to end the configuration's streaming mode
+        """
+        self.transport = transport
+        self.config_id = config_id
+        self.rate = min(max(rate or self.RATE, self.MIN_RATE), self.MAX_RATE)
+        self.color_space = color_space
+        self.on_stop = on_stop
+        self.channels = {}
+        self.sequence = 0
+        self.frames = 0
+        self.dropped = 0
+        self.errors = 0
+        self.lateness = deque(maxlen=self.LATENESS_SAMPLES)
+        self.started = None
+        self.ended = None
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread = None
+
+    @classmethod
+    def open(cls, client, config_id, rate=None, color_space='rgb', transport=None):
+        """
+        Puts an entertainment configuration in streaming mode and starts streaming to it, over DTLS unless another
+        transport is given
+        :param client: Clipv2
+        :param config_id:
+        :param rate:
+        :param color_space:
+        :param transport:
+        :return: started stream, stopping it ends the streaming mode again
+        """
+        errors = client.result_errors(client.start_entertainment(config_id), config_id)
+        if errors:
+            raise RuntimeError("Couldn't start streaming: "+", ".join(errors))
+        try:
+            if transport is None:
+                application_id = client.get_application_id()
+                if not application_id:
+                    raise RuntimeError("Couldn't get the application id: "
+                                       + getattr(application_id, 'description', 'the bridge sent none'))
+                transport = DtlsTransport(client.bridge, application_id, client.client_key)
+        except Exception:
+            client.stop_entertainment(config_id)
+            raise
+        stream = cls(transport, config_id, rate, color_space, on_stop=lambda: client.stop_entertainment(config_id))
+        return stream.start()
+
+    def set_channel(self, channel_id, values):
+        """
+        Sets the colour sent for a channel from the next frame on
+        :param channel_id:
+        :param values: r, g, b or x, y, brightness between 0 and 1
+        :return:
+        """
+        with self._lock:
+            self.channels[channel_id] = tuple(values)
+
+    def set_channels(self, channels):
+        with self._lock:
+            self.channels.update((channel_id, tuple(values)) for channel_id, values in channels.items())
+
+    def start(self):
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops streaming and closes the transport
+        :return:
+        """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self.transport.close()
+        if self.on_stop:
+            self.on_stop()
+
+    def _run(self):
+        interval = 1 / self.rate
+        self.started = monotonic()
+        slot = 0
+        while not self._stopped.is_set():
+            deadline = self.started + slot * interval
+            wait = deadline - monotonic()
+            if wait > 0:
+                sleep(wait)
+            now = monotonic()
+
+            # Slots that have passed completely are skipped instead of sending a burst of stale frames
+            behind = int((now - deadline) / interval)
+            if behind:
+                self.dropped += behind
+                slot += behind
+                deadline += behind * interval
+
+            with self._lock:
+                channels = dict(self.channels)
+            if channels:
+                try:
+                    self.transport.send(encode_frame(self.config_id, self.sequence, channels, self.color_space))
+                    self.frames += 1
+                    self.sequence = (self.sequence + 1) & 0xff
+                    self.lateness.append(now - deadline)
+                except OSError:
+                    self.errors += 1
+            slot += 1
+        self.ended = monotonic()
+
+    def stats(self):
+        """
+        Frames sent and dropped, send errors, achieved frame rate and jitter as how late the last LATENESS_SAMPLES
+        frames were sent compared to their slot, in seconds
+        :return:
+        """
+        lateness = sorted(self.lateness)
+        elapsed = (self.ended or monotonic()) - self.started if self.started else 0.0
+        return {
+            'rate': self.rate,
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'fps': self.frames / elapsed if elapsed else 0.0,
+            'jitter_mean': sum(lateness) / len(lateness) if lateness else 0.0,
+            'jitter_p99': lateness[min(len(lateness) - 1, int(0.99 * len(lateness)))] if lateness else 0.0,
+            'jitter_max': lateness[-1] if lateness else 0.0,
+        }
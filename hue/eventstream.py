@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import json
+from json import JSONDecodeError
+
+
+class EventStreamParser:
+    """
+    Incremental parser for the server-sent events emitted by the Clipv2 event stream
+    """
+    IGNORED_FIELDS = ('id', 'id_v1', 'type', 'owner')
+
+    def __init__(self):
+        self.data = []
+
+    def feed(self, line):
+        """
+        Feeds a single decoded line from the stream, returns the list of messages once an event is complete
+        :param line:
+        :return:
+        """
+        if line:
+            if line.startswith('data:'):
+                self.data.append(line[5:].lstrip())
+            return None
+
+        # Blank line terminates the event
+        if not self.data:
+            return None
+        data = '\n'.join(self.data)
+        self.data = []
+        try:
+            messages = json.loads(data)
+        except JSONDecodeError:
+            return None
+        return messages if isinstance(messages, list) else [messages]
+
+    def parse(self, lines):
+        """
+        Generator yielding the messages of every complete event found in lines
+        :param lines:
+        :return:
+        """
+        for line in lines:
+            messages = self.feed(line)
+            if messages:
+                yield messages
+
+    @classmethod
+    def light_changes(cls, messages):
+        """
+        Collects the changed fields per light id from a list of event messages
+        :param messages:
+        :return:
+        """
+        output = {}
+        for message in messages:
+            if message.get('type') != 'update':
+                continue
+            for resource in message.get('data', []):
+                if resource.get('type') != 'light':
+                    continue
+                changes = {k: v for k, v in resource.items() if k not in cls.IGNORED_FIELDS}
+                if changes:
+                    merge_state(output.setdefault(resource['id'], {}), changes)
+        return output
+
+
+def merge_state(state, changes):
+    """
+    Recursively merges a partial Clipv2 state into a full one, in place
+    :param state:
+    :param changes:
+    :return:
+    """
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(state.get(key), dict):
+            merge_state(state[key], value)
+        else:
+            state[key] = value
+    return state
@@ -2,8 +2,8 @@
 import json
 import pprint
 import requests
-from time import sleep
 from threading import Thread
+from .effects import EffectEngine, flash
 
 
 class Hue:
@@ -13,6 +13,7 @@ class Hue:
         self.username = ''
         self.bridge = ''
         self.protocol = "http://"
+        self._effects = None
         self.load_config()
 
     def load_config(self):
@@ -134,44 +135,26 @@ class Hue:
         result = self.call_put(url, body)
         return self.parse_result(result[0])
 
-    def flash_light(self, light_id, flashes):
+    def effects(self):
         """
-        Turns light on and flashes it the specified number of times
+        Returns the effect engine for this bridge, created on first use
+        :return:
+        """
+        if self._effects is None:
+            self._effects = EffectEngine.for_client(self)
+        return self._effects
+
+    def flash_light(self, light_id, flashes, wait=True):
+        """
+        Flashes the light the specified number of times and restores its previous state
         :param light_id:
         :param flashes:
+        :param wait: block until the effect has finished, otherwise it runs in the background and the EffectRun is
+                     returned
         :return:
         """
-        valid_attributes = ["on", "bri", "colormode", "hue", "sat", "xy", "ct"]
-        original_state = {k: v for k, v in self.get_light_state(light_id).items() if k in valid_attributes}
-
-        # This doesn't work, brightness still ends up being set to 0
-        if original_state['on'] is not True:
-            valid_attributes = ["on", "colormode", "hue", "sat", "xy", "ct"]
-            original_state = {k: v for k, v in original_state.items() if k in valid_attributes}
-
-        original_state['transitiontime'] = 0
-
-        on_state = {
-            "on": True,
-            "bri": 254,
-            "hue": 0,
-            "transitiontime": 0
-        }
-        off_state = {
-            "on": False,
-            "transitiontime": 0
-        }
-
-        # Turn light on, max brightness
-        self.turn_on_light(light_id)
-
-        # turn off and on flashes - 1 times
-        for i in range(flashes):
-            self.set_light_state(light_id, off_state)
-            sleep(0.2)
-            self.set_light_state(light_id, on_state)
-            sleep(0.2)
-
-        # return to previous state
-        self.set_light_state(light_id, original_state)
+        run = self.effects().start(flash(flashes), [light_id])
+        if not wait:
+            return run
+        run.wait()
         return "Flashing done"
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import wx
+from copy import deepcopy
 from wx.lib.expando import ExpandoTextCtrl
 
 
@@ -23,10 +24,13 @@ class Light(wx.Panel):
 
         # Set up our data
         self.light_id = light_id
+        self.base = None
         self.state = None
-        self.expected_updates = 0
+        self.pending = {}
         self.new_state = {}
         self.name = ''
+        self.view = None
+        self.changes = {}
         self.set_state(light_state)
 
         # Layout
@@ -94,25 +98,79 @@ class Light(wx.Panel):
         slider.Bind(wx.EVT_SLIDER, self.set_color_temperature)
         return slider
 
-    def set_state(self, state):
+    def set_state(self, state, render=True):
         """
-        Update the panel's state using supplied state from the Clipv2 API
+        Update the panel's state using the supplied LightState, writes that haven't been confirmed yet take precedence
         :param state:
-        :return:
+        :param render: if False the controls are only updated by the next call to render()
+        :return: whether the controls need to be updated
         """
+        self.base = state
+        if self.pending:
+            state = state.copy().apply_clip(self.pending)
         self.state = state
-        self.brightness_slider.SetValue(int(state['dimming']['brightness']))
-        self.brightness_slider.SetMin(int(state['dimming']['min_dim_level']))
-        self.brightness_slider.Enable(self.is_on())
+        self.name = state.name
+        self.changes = state.to_dict() if self.view is None else self.view.diff(state)
+        if render:
+            self.render()
+        return bool(self.changes)
+
+    def render(self):
+        """
+        Pushes the values that changed since the last render to the panel's controls
+        :return:
+        """
+        changes = self.changes
+        if 'min_dim_level' in changes:
+            self.brightness_slider.SetMin(int(changes['min_dim_level']))
+        if 'brightness' in changes:
+            self.brightness_slider.SetValue(int(changes['brightness']))
 
-        self.color_slider.SetMin(int(state['color_temperature']['mirek_schema']['mirek_minimum']))
-        self.color_slider.SetMax(int(state['color_temperature']['mirek_schema']['mirek_maximum']))
-        self.color_slider.SetValue(int(state['color_temperature']['mirek']))
-        self.color_slider.Enable(self.is_on())
+        if changes.get('mirek_minimum') is not None:
+            self.color_slider.SetMin(changes['mirek_minimum'])
+        if changes.get('mirek_maximum') is not None:
+            self.color_slider.SetMax(changes['mirek_maximum'])
+        if changes.get('mirek') is not None:
+            self.color_slider.SetValue(changes['mirek'])
 
-        self.name = state['metadata']['name']
-        self.name_ctrl.SetLabel(self.name)
-        self.toggle_button.SetLabelText("Turn off" if self.is_on() else "Turn on")
+        if 'on' in changes:
+            self.brightness_slider.Enable(changes['on'])
+            self.color_slider.Enable(changes['on'] and self.state.mirek is not None)
+            self.toggle_button.SetLabelText(self.get_button_label())
+        if 'name' in changes:
+            self.name_ctrl.SetLabel(changes['name'])
+
+        self.view = self.state.copy()
+        self.changes = {}
+
+    def apply_local(self, changes):
+        """
+        Optimistically applies changes that are being sent to the bridge
+        :param changes:
+        :return:
+        """
+        self.pending.update(deepcopy(changes))
+        self.set_state(self.base)
+
+    def confirm(self, changes):
+        """
+        Marks sent changes as confirmed by the bridge, changes that have been superseded by a newer write stay pending
+        :param changes:
+        :return:
+        """
+        for key, value in changes.items():
+            if self.pending.get(key) == value:
+                del self.pending[key]
+
+    def reconcile(self, state):
+        """
+        Drops all unconfirmed changes after a failed write and shows the light's actual state
+        :param state:
+        :return:
+        """
+        self.pending = {}
+        if state:
+            self.set_state(state)
 
     def __set_properties(self):
         """
@@ -141,6 +199,7 @@ class Light(wx.Panel):
             self.new_state['on'] = {
                 'on': True
             }
+        event.Skip()
 
     def set_brightness(self, event):
         """
@@ -148,8 +207,9 @@ class Light(wx.Panel):
         :param event:
         :return:
         """
+        event.Skip()
         slider_value = self.brightness_slider.GetValue()
-        if slider_value < self.state['dimming']['min_dim_level'] or slider_value > 100:
+        if slider_value < self.state.min_dim_level or slider_value > 100:
             return
 
         self.new_state['dimming'] = {
@@ -162,9 +222,10 @@ class Light(wx.Panel):
         :param event:
         :return:
         """
+        event.Skip()
         slider_value = self.color_slider.GetValue()
-        if slider_value < self.state['color_temperature']['mirek_schema']['mirek_minimum']\
-                or slider_value > self.state['color_temperature']['mirek_schema']['mirek_maximum']:
+        if self.state.mirek is None or slider_value < self.state.mirek_minimum\
+                or slider_value > self.state.mirek_maximum:
             return
 
         self.new_state['color_temperature'] = {
@@ -176,7 +237,7 @@ class Light(wx.Panel):
         Gets the light's on status
         :return:
         """
-        return self.state['on']['on']
+        return self.state.on
 
     def set_id(self, light_id):
         """
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+
+class Histogram:
+    """
+    Fixed bucket histogram of durations in seconds
+    """
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets or self.BUCKETS
+        # The last count holds the values above the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, share):
+        """
+        Estimates a quantile as the upper bound of the bucket it falls in
+        :param share: between 0 and 1
+        :return: None if nothing was observed, infinity if it's above the largest bucket
+        """
+        if not self.count:
+            return None
+        rank = share * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    Thread safe registry of counters, histograms and gauges, each identified by a name and a set of labels. Recording
+    is a no-op while disabled, callers that have to do work to produce a value should check enabled first.
+    """
+    def __init__(self, enabled=False, buckets=None):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """
+        Adds to a counter
+        :param name:
+        :param value:
+        :param labels:
+        :return:
+        """
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Records a duration in seconds in a histogram
+        :param name:
+        :param value:
+        :param labels:
+        :return:
+        """
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def gauge(self, name, function, **labels):
+        """
+        Registers a function that returns the current value of a gauge, it's only called when metrics are read
+        :param name:
+        :param function:
+        :param labels:
+        :return:
+        """
+        with self._lock:
+            self.gauges[self._key(name, labels)] = function
+
+    def unregister(self, name, function=None, **labels):
+        """
+        Removes a gauge, if function is given only while it's still the one registered under the name and labels
+        :param name:
+        :param function:
+        :param labels:
+        :return:
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            if key in self.gauges and (function is None or self.gauges[key] is function):
+                del self.gauges[key]
+
+    def reset(self):
+        """
+        Clears all recorded counters and histograms, registered gauges are kept
+        :return:
+        """
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def _read_gauges(self):
+        with self._lock:
+            gauges = list(self.gauges.items())
+        output = []
+        for key, function in gauges:
+            try:
+                output.append((key, function()))
+            except Exception:
+                continue
+        return output
+
+    def snapshot(self):
+        """
+        Returns the current values, keyed by metric name and then by labels
+        :return:
+        """
+        output = {'counters': {}, 'histograms': {}, 'gauges': {}}
+        with self._lock:
+            counters = list(self.counters.items())
+            histograms = [(key, histogram.summary()) for key, histogram in self.histograms.items()]
+        for (name, labels), value in counters:
+            output['counters'].setdefault(name, {})[format_labels(labels)] = value
+        for (name, labels), summary in histograms:
+            output['histograms'].setdefault(name, {})[format_labels(labels)] = summary
+        for (name, labels), value in self._read_gauges():
+            output['gauges'].setdefault(name, {})[format_labels(labels)] = value
+        return output
+
+    def prometheus(self):
+        """
+        Renders all metrics in the Prometheus text exposition format
+        :return:
+        """
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(histogram.buckets), list(histogram.counts), histogram.count, histogram.sum)
+                                for key, histogram in self.histograms.items())
+        lines = []
+        typed = set()
+
+        def declare(name, metric_type):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE '+name+' '+metric_type)
+
+        for (name, labels), value in counters:
+            declare(name, 'counter')
+            lines.append(name+prometheus_labels(labels)+' '+repr(value))
+        for (name, labels), value in sorted(self._read_gauges(), key=lambda item: item[0]):
+            declare(name, 'gauge')
+            lines.append(name+prometheus_labels(labels)+' '+repr(value))
+        for (name, labels), buckets, counts, count, total in histograms:
+            declare(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(name+'_bucket'+prometheus_labels(labels + (('le', repr(bound)),))+' '+str(cumulative))
+            lines.append(name+'_bucket'+prometheus_labels(labels + (('le', '+Inf'),))+' '+str(count))
+            lines.append(name+'_sum'+prometheus_labels(labels)+' '+repr(total))
+            lines.append(name+'_count'+prometheus_labels(labels)+' '+str(count))
+        return '\n'.join(lines)+'\n'
+
+
+def format_labels(labels):
+    return ','.join(key+'='+str(value) for key, value in labels)
+
+
+def prometheus_labels(labels):
+    if not labels:
+        return ''
+    escaped = (key+'="'+str(value).replace('\\', '\\\\').replace('"', '\\"')+'"' for key, value in labels)
+    return '{'+','.join(escaped)+'}'
+
+
+def endpoint_label(endpoint):
+    """
+    Replaces the resource id in a Clipv2 or v1 endpoint so requests to different resources share a label
+    :param endpoint:
+    :return:
+    """
+    parts = endpoint.split('/')
+    if parts[0] != 'resource':
+        # v1 endpoints have the id right after the collection, e.g. lights/3/state
+        return '/'.join(parts[:1]+['{id}']+parts[2:]) if len(parts) > 1 else endpoint
+    if len(parts) > 2:
+        return '/'.join(parts[:2])+'/{id}'
+    return endpoint
+
+
+class MetricsServer:
+    """
+    Serves metrics in the Prometheus text format from a background thread, on localhost only by default
+    """
+    HOST = '127.0.0.1'
+    PORT = 9464
+
+    def __init__(self, metrics=None, port=None, host=None):
+        self.metrics = metrics or default_metrics
+        self.server = ThreadingHTTPServer((host or self.HOST, self.PORT if port is None else port),
+                                          MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.server.metrics = self.metrics
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self._thread = Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+default_metrics = Metrics()
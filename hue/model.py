@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+
+class LightState:
+    """
+    Compact state of a light, holding only the fields used by the application
+    """
+    __slots__ = ('id', 'owner', 'name', 'on', 'brightness', 'min_dim_level', 'mirek', 'mirek_minimum',
+                 'mirek_maximum')
+
+    def __init__(self, id, owner=None, name='', on=False, brightness=0.0, min_dim_level=0.0, mirek=None,
+                 mirek_minimum=None, mirek_maximum=None):
+        self.id = id
+        self.owner = owner
+        self.name = name
+        self.on = on
+        self.brightness = brightness
+        self.min_dim_level = min_dim_level
+        self.mirek = mirek
+        self.mirek_minimum = mirek_minimum
+        self.mirek_maximum = mirek_maximum
+
+    @classmethod
+    def from_clip(cls, data):
+        """
+        Creates a light state from a Clipv2 light resource
+        :param data:
+        :return:
+        """
+        return cls(data['id']).apply_clip(data)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def apply_clip(self, data):
+        """
+        Updates the state in place from a full or partial Clipv2 light resource, e.g. an event or a write payload
+        :param data:
+        :return:
+        """
+        if 'on' in data:
+            self.on = data['on']['on']
+        if 'owner' in data:
+            self.owner = data['owner']['rid']
+        if 'metadata' in data and 'name' in data['metadata']:
+            self.name = data['metadata']['name']
+
+        dimming = data.get('dimming')
+        if dimming:
+            self.brightness = dimming.get('brightness', self.brightness)
+            self.min_dim_level = dimming.get('min_dim_level', self.min_dim_level)
+
+        color_temperature = data.get('color_temperature')
+        if color_temperature:
+            self.mirek = color_temperature.get('mirek', self.mirek)
+            schema = color_temperature.get('mirek_schema')
+            if schema:
+                self.mirek_minimum = schema['mirek_minimum']
+                self.mirek_maximum = schema['mirek_maximum']
+        return self
+
+    def copy(self):
+        state = LightState.__new__(LightState)
+        for field in self.__slots__:
+            setattr(state, field, getattr(self, field))
+        return state
+
+    def diff(self, other):
+        """
+        Returns the fields where other differs from this state, with other's values
+        :param other:
+        :return:
+        """
+        return {field: getattr(other, field) for field in self.__slots__
+                if getattr(self, field) != getattr(other, field)}
+
+    def __eq__(self, other):
+        if not isinstance(other, LightState):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'LightState('+', '.join(field+'='+repr(getattr(self, field)) for field in self.__slots__)+')'
+
+
+class RoomState:
+    """
+    Compact state of a room or zone, children are (rid, rtype) tuples
+    """
+    __slots__ = ('id', 'name', 'children', 'grouped_light')
+
+    def __init__(self, id, name='', children=(), grouped_light=None):
+        self.id = id
+        self.name = name
+        self.children = tuple(tuple(child) for child in children)
+        self.grouped_light = grouped_light
+
+    @classmethod
+    def from_clip(cls, data):
+        """
+        Creates a room state from a Clipv2 room or zone resource
+        :param data:
+        :return:
+        """
+        grouped_light = None
+        for service in data.get('services', []):
+            if service['rtype'] == 'grouped_light':
+                grouped_light = service['rid']
+        return cls(data['id'], data['metadata']['name'],
+                   [(child['rid'], child['rtype']) for child in data['children']], grouped_light)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __eq__(self, other):
+        if not isinstance(other, RoomState):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'RoomState('+', '.join(field+'='+repr(getattr(self, field)) for field in self.__slots__)+')'
+
+
+def parse_lights(data):
+    """
+    Converts a dict of Clipv2 light resources to light states, passing failed results through
+    :param data:
+    :return:
+    """
+    if not data:
+        return data
+    return {light_id: LightState.from_clip(light) for light_id, light in data.items()}
+
+
+def parse_rooms(data):
+    """
+    Converts a dict of Clipv2 room or zone resources to room states, passing failed results through
+    :param data:
+    :return:
+    """
+    if not data:
+        return data
+    return {room_id: RoomState.from_clip(room) for room_id, room in data.items()}
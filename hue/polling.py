@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+from time import monotonic
+
+
+class PollPolicy:
+    """
+    Decides how often the UI polls for updates: fast while the user is interacting or lights are changing, backing off
+    exponentially while idle or unfocused and slowest while hidden, without letting the state get older than
+    MAX_STALENESS. While the event stream is up polls only check that it still is. Every decision is kept in history
+    for tuning.
+    """
+    ACTIVE_INTERVAL = 0.2
+    STREAMING_INTERVAL = 5.0
+    IDLE_INTERVAL = 1.0
+    MAX_IDLE_INTERVAL = 5.0
+    HIDDEN_INTERVAL = 30.0
+    BACKOFF = 2.0
+    # How long after an interaction or change we keep polling fast
+    ACTIVE_PERIOD = 3.0
+    REFRESH_INTERVAL = 1.0
+    MAX_STALENESS = 60.0
+    HISTORY = 200
+
+    def __init__(self):
+        now = monotonic()
+        self.last_activity = now
+        self.last_refresh = now
+        self.idle_interval = self.IDLE_INTERVAL
+        self.interval = self.ACTIVE_INTERVAL
+        self.hidden = False
+        self.focused = True
+        self.streaming = False
+        self.history = deque(maxlen=self.HISTORY)
+
+    def note_interaction(self, now=None):
+        """
+        Records user interaction or commands being sent, this switches back to fast polling
+        :param now:
+        :return:
+        """
+        self.last_activity = now or monotonic()
+        self.idle_interval = self.IDLE_INTERVAL
+
+    def note_change(self, changed, now=None):
+        """
+        Records whether the last poll changed anything, changes keep polling fast
+        :param changed:
+        :param now:
+        :return:
+        """
+        if changed:
+            self.note_interaction(now)
+
+    def note_refresh(self, now=None):
+        """
+        Records that the light states are known to be up to date
+        :param now:
+        :return:
+        """
+        self.last_refresh = now or monotonic()
+
+    def set_hidden(self, hidden):
+        self.hidden = hidden
+
+    def set_focused(self, focused):
+        self.focused = focused
+
+    def set_streaming(self, streaming):
+        self.streaming = streaming
+
+    def refresh_due(self, now=None):
+        """
+        Whether a full refresh should be made on this poll
+        :param now:
+        :return:
+        """
+        now = now or monotonic()
+        return now - self.last_refresh >= max(self.REFRESH_INTERVAL, self.interval)
+
+    def next_interval(self, now=None):
+        """
+        Decides how many seconds to wait until the next poll
+        :param now:
+        :return:
+        """
+        now = now or monotonic()
+        if self.hidden:
+            interval, reason = self.HIDDEN_INTERVAL, 'hidden'
+        elif self.streaming:
+            interval, reason = self.STREAMING_INTERVAL, 'streaming'
+        elif self.focused and now - self.last_activity < self.ACTIVE_PERIOD:
+            interval, reason = self.ACTIVE_INTERVAL, 'active'
+        else:
+            interval, reason = self.idle_interval, 'idle' if self.focused else 'unfocused'
+            self.idle_interval = min(self.idle_interval * self.BACKOFF, self.MAX_IDLE_INTERVAL)
+
+        remaining = self.MAX_STALENESS - (now - self.last_refresh)
+        if interval > remaining:
+            interval, reason = max(self.ACTIVE_INTERVAL, remaining), reason+', staleness bound'
+
+        self.interval = interval
+        self.history.append((now, interval, reason))
+        return interval
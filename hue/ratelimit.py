@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+from threading import Lock
+from time import monotonic, sleep
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket, requests that find the bucket empty reserve a future token and wait for it
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self.throttled = 0
+        self.waited = 0.0
+        self._lock = Lock()
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, tokens=1):
+        """
+        Takes tokens from the bucket and returns how many seconds the caller has to wait before using them
+        :param tokens:
+        :return:
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            wait = -self.tokens / self.rate
+            self.throttled += 1
+            self.waited += wait
+            return wait
+
+    def acquire(self, tokens=1):
+        """
+        Blocks until the tokens are available
+        :param tokens:
+        :return:
+        """
+        wait = self.reserve(tokens)
+        if wait:
+            sleep(wait)
+
+    def queue_wait(self):
+        """
+        Returns how long a request made right now would have to wait
+        :return:
+        """
+        with self._lock:
+            self._refill()
+            return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """
+    Keeps separate token buckets for light writes, grouped_light writes and reads so that commands are sent at a rate
+    the bridge can keep up with
+    """
+    # Requests per second and burst size, the bridge handles roughly 10 light and 1 group command per second
+    DEFAULT_LIMITS = {
+        'light': (10, 5),
+        'grouped_light': (1, 1),
+        'read': (20, 10),
+    }
+
+    def __init__(self, limits=None):
+        limits = dict(self.DEFAULT_LIMITS, **(limits or {}))
+        self.buckets = {name: TokenBucket(rate, burst) for name, (rate, burst) in limits.items()}
+
+    @staticmethod
+    def bucket_name(method, endpoint):
+        """
+        Picks the bucket a request is counted against
+        :param method:
+        :param endpoint:
+        :return:
+        """
+        if method == 'GET':
+            return 'read'
+        if endpoint.startswith('resource/grouped_light') or endpoint.startswith('groups/'):
+            return 'grouped_light'
+        return 'light'
+
+    def reserve(self, method, endpoint):
+        """
+        Reserves a token for a request and returns how many seconds to wait before sending it
+        :param method:
+        :param endpoint:
+        :return:
+        """
+        return self.buckets[self.bucket_name(method, endpoint)].reserve()
+
+    def acquire(self, method, endpoint):
+        """
+        Blocks until a request may be sent
+        :param method:
+        :param endpoint:
+        :return:
+        """
+        wait = self.reserve(method, endpoint)
+        if wait:
+            sleep(wait)
+
+    def stats(self):
+        """
+        Current queue wait time and throttle counters per bucket
+        :return:
+        """
+        return {name: {
+            'queue_wait': bucket.queue_wait(),
+            'throttled': bucket.throttled,
+            'waited': bucket.waited,
+        } for name, bucket in self.buckets.items()}
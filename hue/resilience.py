@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+import random
+from threading import Lock
+from time import monotonic
+
+
+class ErrorResult:
+    """
+    Result of a call that got no usable answer from the bridge. It is falsy like the False returned for invalid
+    responses, so existing checks keep working, but tells why the call failed.
+    """
+    TIMEOUT = 'timeout'
+    CONNECTION = 'connection'
+    CIRCUIT_OPEN = 'circuit_open'
+
+    __slots__ = ('kind', 'description')
+
+    def __init__(self, kind, description):
+        self.kind = kind
+        self.description = description
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return 'ErrorResult('+repr(self.kind)+', '+repr(self.description)+')'
+
+
+class RetryPolicy:
+    """
+    Bounded retries with exponential backoff and full jitter, so clients that failed together don't retry together
+    """
+    ATTEMPTS = 3
+    BASE_DELAY = 0.2
+    MAX_DELAY = 2.0
+
+    def __init__(self, attempts=None, base_delay=None, max_delay=None, seed=None):
+        """
+        :param attempts: attempts in total, 1 disables retrying
+        :param base_delay: upper bound of the first delay in seconds, doubled for every further attempt
+        :param max_delay:
+        :param seed:
+        """
+        self.attempts = attempts or self.ATTEMPTS
+        self.base_delay = self.BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = self.MAX_DELAY if max_delay is None else max_delay
+        self.random = random.Random(seed)
+
+    def delay(self, attempt):
+        """
+        Returns how long to wait before retrying after the given failed attempt, counted from 1
+        :param attempt:
+        :return:
+        """
+        return self.random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while a bridge is unreachable. After FAILURE_THRESHOLD consecutive failures the circuit opens and
+    calls are rejected for RESET_TIMEOUT seconds, then a single probe call is let through: if it succeeds the circuit
+    closes again, otherwise it stays open for another RESET_TIMEOUT.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    FAILURE_THRESHOLD = 5
+    RESET_TIMEOUT = 5.0
+    # Reported by the hue_circuit_state gauge
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, failure_threshold=None, reset_timeout=None):
+        self.failure_threshold = failure_threshold or self.FAILURE_THRESHOLD
+        self.reset_timeout = self.RESET_TIMEOUT if reset_timeout is None else reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._lock = Lock()
+
+    def allow(self):
+        """
+        Whether a call may be made now, moves an open circuit to half open once the reset timeout has passed and lets
+        that one probe through
+        :return:
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_in(self):
+        """
+        Seconds until an open circuit lets a probe through
+        :return:
+        """
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - monotonic())
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def release(self):
+        """
+        Gives back the probe of a half open circuit when the call it was let through for wasn't made after all, so the
+        next call makes it instead of the circuit staying half open
+        :return:
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = monotonic()
+
+    def value(self):
+        return self.STATE_VALUES[self.state]
+
+
+class Call:
+    """
+    Deadline, retry and circuit breaker bookkeeping of one call to a bridge. The blocking Transport and AsyncClipv2
+    only differ in how they wait and send, every decision about whether to send, retry or give up is made here.
+    """
+    def __init__(self, bridge, method, endpoint, timeout, retry_policy, circuit_breaker, metrics, idempotent):
+        """
+        :param bridge: bridge address, for error descriptions and metrics labels
+        :param method:
+        :param endpoint: metrics label of the endpoint
+        :param timeout: seconds the whole call may take, retries included
+        :param retry_policy:
+        :param circuit_breaker:
+        :param metrics:
+        :param idempotent: whether the call may be retried after it may have reached the bridge
+        """
+        self.bridge = bridge
+        self.method = method
+        self.endpoint = endpoint
+        self.deadline = monotonic() + timeout
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.metrics = metrics
+        self.idempotent = idempotent
+        self.attempt = 0
+        self.failure = None
+        self.failed = False
+        self.sent = False
+
+    def admit(self):
+        """
+        Starts the next attempt if the circuit breaker lets it through
+        :return: None if the attempt may go ahead, otherwise the ErrorResult the call ends with
+        """
+        self.attempt += 1
+        if self.circuit_breaker.allow():
+            return None
+        # If this call's own failures opened the circuit, what went wrong is more useful than the circuit
+        if self.failure is not None:
+            return self.failure
+        self.metrics.inc('hue_circuit_rejected_total', bridge=self.bridge)
+        return circuit_open(self.bridge, self.circuit_breaker)
+
+    def time_left(self):
+        """
+        Seconds left for an admitted attempt once it's its turn. If the deadline passed while it waited, the circuit
+        breaker's probe is given back, since no request will be made.
+        :return: seconds, or None if the call has to end with timed_out()
+        """
+        remaining = self.deadline - monotonic()
+        if remaining <= 0:
+            self.circuit_breaker.release()
+            return None
+        return remaining
+
+    def timed_out(self):
+        return ErrorResult(ErrorResult.TIMEOUT, 'No answer from bridge '+self.bridge+' before the deadline')
+
+    def answered(self, status, retry_statuses):
+        """
+        Records that the bridge answered an attempt
+        :param status: HTTP status
+        :param retry_statuses: statuses that are worth retrying
+        :return: whether the answer is final
+        """
+        self.circuit_breaker.record_success()
+        self.failed = False
+        return status not in retry_statuses
+
+    def fail(self, kind, error, sent=True):
+        """
+        Records an attempt that got no answer
+        :param kind: ErrorResult.TIMEOUT or ErrorResult.CONNECTION
+        :param error: the exception
+        :param sent: False if the request can't have reached the bridge, which makes it safe to retry
+        :return:
+        """
+        self.circuit_breaker.record_failure()
+        self.failed = True
+        self.sent = sent
+        self.failure = ErrorResult(kind, 'Bridge '+self.bridge+' failed to answer: '+(str(error) or repr(error)))
+
+    def abandon(self):
+        """
+        Gives back the circuit breaker's probe when an attempt ended without an answer or a failure, e.g. cancelled
+        :return:
+        """
+        self.circuit_breaker.release()
+
+    def retry_delay(self):
+        """
+        Decides whether the call is retried after an attempt that failed or got a retry status
+        :return: seconds to wait before the next attempt, or None to give up
+        """
+        retryable = self.idempotent or (self.failed and not self.sent)
+        delay = self.retry_policy.delay(self.attempt)
+        if not retryable or self.attempt >= self.retry_policy.attempts or monotonic() + delay >= self.deadline:
+            return None
+        self.metrics.inc('hue_request_retries_total', method=self.method, endpoint=self.endpoint)
+        return delay
+
+
+def circuit_open(bridge, circuit_breaker):
+    """
+    The result of a call the circuit breaker rejected
+    :param bridge:
+    :param circuit_breaker:
+    :return:
+    """
+    return ErrorResult(ErrorResult.CIRCUIT_OPEN, 'Bridge '+bridge+' is unreachable, trying again in '
+                       + '%.1f' % circuit_breaker.retry_in()+'s')
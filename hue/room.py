@@ -4,20 +4,36 @@ from .light import Light
 
 
 class Room(wx.Panel):
-    def __init__(self, parent, room_state, lights={}):
+    def __init__(self, parent, room_state, lights={}, lazy=False):
+        """
+        :param parent:
+        :param room_state: RoomState
+        :param lights: the room's lights as resolved by Topology, dict of light_id => LightState
+        :param lazy: if set, the light panels aren't created until build() is called
+        """
         wx.Panel.__init__(self, parent=parent)
         colors = ["red", "blue", "gray", "yellow", "green"]
-        self.room_id = room_state['id']
-        self.name = room_state['metadata']['name']
+        self.room_id = room_state.id
+        self.name = room_state.name
         print("Creating room "+self.room_id+" ("+self.name+")")
-        self.lights = {}
+        self.lights = dict(lights)
         self.panels = []
+        self.built = False
         self.state = room_state
-        for light_id, light in lights.items():
-            for child in self.state['children']:
-                if child['rid'] == light['owner']['rid']:
-                    self.lights[child['rid']] = light
-                    self.panels.append(Light(self, wx.ID_ANY, light_id=light_id, light_state=light))
+        self.grouped_light_id = room_state.grouped_light
+        if not lazy:
+            self.build()
+
+    def build(self, lights=None):
+        """
+        Creates the room's controls and light panels
+        :param lights: up to date lights to build the panels from, defaults to the lights the room was created with
+        :return:
+        """
+        if lights is not None:
+            self.lights = dict(lights)
+        for light_id, light in self.lights.items():
+            self.panels.append(Light(self, wx.ID_ANY, light_id=light_id, light_state=light))
 
         t = wx.BoxSizer(wx.VERTICAL)
         t = wx.FlexGridSizer(len(self.panels), 1, 0, 0)
@@ -26,3 +42,4 @@ class Room(wx.Panel):
 
         self.SetSizer(t)
         self.Layout()
+        self.built = True
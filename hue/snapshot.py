@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import re
+import tempfile
+from json import JSONDecodeError
+from .model import LightState, RoomState
+
+
+class Snapshot:
+    """
+    Local cache of a bridge's rooms, zones and last known light states so the UI can be shown before the bridge has
+    answered
+    """
+    VERSION = 2
+    DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'pyhue')
+    # Snapshots bigger than this aren't written, and only the most recently used files are kept
+    MAX_SIZE = 8 * 1024 * 1024
+    MAX_FILES = 8
+
+    def __init__(self, bridge, directory=None, max_size=None, max_files=None):
+        self.bridge = bridge
+        self.directory = directory or self.DIRECTORY
+        self.max_size = max_size or self.MAX_SIZE
+        self.max_files = max_files or self.MAX_FILES
+        self.path = os.path.join(self.directory, 'snapshot-'+re.sub(r'[^\w.-]', '_', bridge)+'.json')
+
+    def load(self):
+        """
+        Loads the snapshot for this bridge, returns None if there is no usable snapshot
+        :return: dict with rooms, zones, lights and bridge_id
+        """
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+            if data.get('version') != self.VERSION or data.get('bridge') != self.bridge:
+                return None
+            return {
+                'bridge_id': data['bridge_id'],
+                'rooms': {room['id']: RoomState.from_dict(room) for room in data['rooms']},
+                'zones': {zone['id']: RoomState.from_dict(zone) for zone in data['zones']},
+                'lights': {light['id']: LightState.from_dict(light) for light in data['lights']},
+            }
+        except (OSError, JSONDecodeError, KeyError, TypeError):
+            return None
+
+    def save(self, rooms, zones, lights, bridge_id=None):
+        """
+        Atomically writes the snapshot for this bridge
+        :param rooms: dict of room_id => RoomState
+        :param zones: dict of zone_id => RoomState
+        :param lights: dict of light_id => LightState
+        :param bridge_id:
+        :return: whether the snapshot was written
+        """
+        body = json.dumps({
+            'version': self.VERSION,
+            'bridge': self.bridge,
+            'bridge_id': bridge_id,
+            'rooms': [room.to_dict() for room in rooms.values()],
+            'zones': [zone.to_dict() for zone in zones.values()],
+            'lights': [light.to_dict() for light in lights.values()],
+        })
+        if len(body) > self.max_size:
+            self.invalidate()
+            return False
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            handle, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.snapshot-', suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'w') as file:
+                    file.write(body)
+                os.replace(temp_path, self.path)
+            except OSError:
+                os.unlink(temp_path)
+                raise
+            self._prune()
+        except OSError as e:
+            print("Couldn't write snapshot: "+str(e))
+            return False
+        return True
+
+    def invalidate(self):
+        """
+        Removes the snapshot for this bridge
+        :return:
+        """
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _prune(self):
+        """
+        Removes the least recently written snapshots beyond self.max_files
+        :return:
+        """
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                 if name.startswith('snapshot-') and name.endswith('.json')]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[self.max_files:]:
+            os.unlink(path)
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
+from .bridge_pool import BridgePool
+from .resilience import ErrorResult
+
+
+class Topology:
+    """
+    Central store of the rooms, zones, devices and light states known from the Clipv2 API, indexed so the lights of a
+    room can be looked up directly
+    """
+    def __init__(self):
+        self.lights = {}
+        self.rooms = {}
+        self.zones = {}
+        self.devices = {}
+        self.lights_by_owner = {}
+        self.groups_by_child = {}
+
+    @staticmethod
+    def fetch(hue):
+        """
+        Fetches rooms, zones, lights and the bridge id concurrently
+        :param hue: Clipv2 instance
+        :return: dict with rooms, zones, lights, bridge_id and the names of the bridges of a BridgePool that couldn't
+                 be listed as failed. If rooms or lights couldn't be fetched, the ErrorResult saying why or False. A
+                 bridge without rooms or lights isn't a failure.
+        """
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            rooms = executor.submit(hue.list_room_states)
+            zones = executor.submit(hue.list_zone_states)
+            lights = executor.submit(hue.list_light_states)
+            bridge_id = executor.submit(hue.get_bridge_id)
+            data = {
+                'rooms': rooms.result(),
+                'zones': zones.result() or {},
+                'lights': lights.result(),
+                'bridge_id': bridge_id.result() or None,
+            }
+        for key in ('rooms', 'lights'):
+            if isinstance(data[key], ErrorResult):
+                return data[key]
+        if not isinstance(data['rooms'], dict) or not isinstance(data['lights'], dict):
+            return False
+        failed = set()
+        for key in ('rooms', 'zones', 'lights'):
+            failed.update(getattr(data[key], 'failed', ()))
+        data['failed'] = sorted(failed)
+        return data
+
+    def update_lights(self, lights):
+        """
+        Replaces the known lights, returns the ids of the rooms and zones whose set of lights changed. Lights of bridges
+        a BridgePool listing failed for are kept as they were.
+        :param lights: dict of light_id => LightState
+        :return:
+        """
+        affected = set()
+        for light_id in set(self.lights) - set(lights) - set(kept(self.lights, lights)):
+            affected |= self._unindex_light(light_id)
+
+        for light in lights.values():
+            affected |= self.update_light(light)
+        return affected
+
+    def update_light(self, light):
+        """
+        Adds or replaces a single light, returns the ids of the rooms and zones whose set of lights changed
+        :param light: LightState
+        :return:
+        """
+        affected = set()
+        previous = self.lights.get(light.id)
+        if previous is None or previous.owner != light.owner:
+            if previous is not None:
+                affected |= self._unindex_light(light.id)
+            self.lights_by_owner.setdefault(light.owner, set()).add(light.id)
+            affected |= self.groups_for_light(light.id, light)
+        self.lights[light.id] = light
+        return affected
+
+    def _unindex_light(self, light_id):
+        """
+        Removes a light from the owner index, returns the ids of the rooms and zones it belonged to
+        :param light_id:
+        :return:
+        """
+        light = self.lights.pop(light_id)
+        owned = self.lights_by_owner.get(light.owner)
+        if owned:
+            owned.discard(light_id)
+            if not owned:
+                del self.lights_by_owner[light.owner]
+        return self.groups_for_light(light_id, light)
+
+    def update_rooms(self, rooms):
+        """
+        Replaces the known rooms, returns the ids of rooms that were added, removed or had their children changed
+        :param rooms: dict of room_id => RoomState
+        :return:
+        """
+        return self._update_groups(self.rooms, rooms)
+
+    def update_zones(self, zones):
+        """
+        Replaces the known zones, returns the ids of zones that were added, removed or had their children changed
+        :param zones: dict of zone_id => RoomState
+        :return:
+        """
+        return self._update_groups(self.zones, zones)
+
+    def update_devices(self, devices):
+        """
+        Replaces the known devices
+        :param devices: dict of device_id => device
+        :return:
+        """
+        self.devices = dict(devices)
+
+    def _update_groups(self, index, groups):
+        """
+        Updates an index of rooms or zones and the child index, only touching groups whose children changed
+        :param index:
+        :param groups:
+        :return:
+        """
+        affected = set()
+        for group_id in set(index) - set(groups) - set(kept(index, groups)):
+            self._unindex_children(index.pop(group_id))
+            affected.add(group_id)
+
+        for group_id, group in groups.items():
+            previous = index.get(group_id)
+            if previous is None or previous.children != group.children:
+                if previous is not None:
+                    self._unindex_children(previous)
+                for rid, rtype in group.children:
+                    self.groups_by_child.setdefault(rid, set()).add(group_id)
+                affected.add(group_id)
+            index[group_id] = group
+        return affected
+
+    def _unindex_children(self, group):
+        for rid, rtype in group.children:
+            groups = self.groups_by_child.get(rid)
+            if groups:
+                groups.discard(group.id)
+                if not groups:
+                    del self.groups_by_child[rid]
+
+    def groups_for_light(self, light_id, light=None):
+        """
+        Returns the ids of all rooms and zones containing a light, either directly or through its device
+        :param light_id:
+        :param light:
+        :return:
+        """
+        light = light or self.lights[light_id]
+        return self.groups_by_child.get(light_id, set()) | self.groups_by_child.get(light.owner, set())
+
+    def lights_for_group(self, group_id):
+        """
+        Looks up the lights in a room or zone
+        :param group_id:
+        :return: dict of light_id => light
+        """
+        group = self.rooms.get(group_id) or self.zones.get(group_id)
+        output = {}
+        if not group:
+            return output
+        for rid, rtype in group.children:
+            if rtype == 'light':
+                if rid in self.lights:
+                    output[rid] = self.lights[rid]
+            else:
+                for light_id in self.lights_by_owner.get(rid, ()):
+                    output[light_id] = self.lights[light_id]
+        return output
+
+    def grouped_lights(self):
+        """
+        Maps the grouped_light service of every room and zone to the ids of the lights it controls
+        :return:
+        """
+        output = {}
+        for group_id, group in list(self.rooms.items()) + list(self.zones.items()):
+            if group.grouped_light:
+                output[group.grouped_light] = list(self.lights_for_group(group_id))
+        return output
+
+
+def kept(known, listing):
+    """
+    Returns the known ids that belong to bridges a BridgePool listing failed for
+    :param known: ids known so far
+    :param listing: dict of id => item, with a failed attribute if it was merged from several bridges
+    :return:
+    """
+    failed = getattr(listing, 'failed', None)
+    if not failed:
+        return []
+    return [item_id for item_id in known if item_id.partition(BridgePool.SEPARATOR)[0] in failed]
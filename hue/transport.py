@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+import requests
+import urllib3
+from time import perf_counter, sleep
+from requests.adapters import HTTPAdapter
+from .metrics import default_metrics, endpoint_label
+from .ratelimit import RateLimiter
+from .resilience import Call, CircuitBreaker, ErrorResult, RetryPolicy, circuit_open
+
+
+class Transport:
+    """
+    Pooled keep-alive HTTP connection to one bridge, shared by the Clipv2 and v1 API adapters. Requests are rate
+    limited, get a deadline, are retried when that's safe and fail fast through a circuit breaker while the bridge is
+    unreachable. AsyncClipv2 sends over aiohttp but shares a transport's rate limits, deadline, retries and circuit
+    breaker through call().
+    """
+    VERIFY_SSL = False
+    POOL_SIZE = 4
+    TIMEOUT = (3.05, 10)
+    # Seconds a whole call may take, retries included
+    DEADLINE = 15
+    # Only these are retried after the request may have reached the bridge, others only if it never connected
+    IDEMPOTENT_METHODS = ('GET',)
+    RETRY_STATUSES = (503,)
+
+    def __init__(self, bridge, protocol='https://', headers=None, pool_size=None, timeout=None, deadline=None,
+                 rate_limiter=None, retry_policy=None, circuit_breaker=None, metrics=None):
+        """
+        :param bridge: bridge address
+        :param protocol:
+        :param headers: sent with every request, e.g. the Clipv2 application key
+        :param pool_size: connections kept open, should cover all threads sharing the transport
+        :param timeout: connect and read timeout of a single attempt, a single number is used for both
+        :param deadline:
+        :param rate_limiter:
+        :param retry_policy:
+        :param circuit_breaker:
+        :param metrics:
+        """
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        self.bridge = bridge
+        self.protocol = protocol
+        self.pool_size = pool_size or self.POOL_SIZE
+        self.timeout = timeout or self.TIMEOUT
+        if not isinstance(self.timeout, (tuple, list)):
+            self.timeout = (self.timeout, self.timeout)
+        self.deadline = deadline or self.DEADLINE
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.metrics = metrics or default_metrics
+        self.session = self._create_session(headers or {})
+        self.gauges = register_rate_limiter_metrics(self.metrics, self.rate_limiter, self.bridge)
+        circuit_state = self.circuit_breaker.value
+        self.gauges.append(('hue_circuit_state', circuit_state, {'bridge': self.bridge}))
+        self.metrics.gauge('hue_circuit_state', circuit_state, bridge=self.bridge)
+
+    def _create_session(self, headers):
+        """
+        Creates a keep-alive session with a connection pool sized for all threads sharing this transport
+        :param headers:
+        :return:
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+        session.mount(self.protocol, adapter)
+        session.verify = self.VERIFY_SSL
+        session.headers.update(headers)
+        return session
+
+    def close(self):
+        """
+        Closes all pooled connections to the bridge and removes its gauges
+        :return:
+        """
+        self.session.close()
+        for name, function, labels in self.gauges:
+            self.metrics.unregister(name, function, **labels)
+        self.gauges = []
+
+    def url(self, path):
+        return self.protocol+self.bridge+'/'+path
+
+    def call(self, method, endpoint, timeout=None, idempotent=None):
+        """
+        Starts the bookkeeping of a call to the bridge
+        :param method:
+        :param endpoint:
+        :param timeout: seconds the whole call may take, retries included, defaults to self.deadline
+        :param idempotent: defaults to whether method is one of IDEMPOTENT_METHODS
+        :return: Call
+        """
+        if idempotent is None:
+            idempotent = method in self.IDEMPOTENT_METHODS
+        return Call(self.bridge, method, endpoint_label(endpoint), timeout or self.deadline, self.retry_policy,
+                    self.circuit_breaker, self.metrics, idempotent)
+
+    def stream(self, path, headers, timeout):
+        """
+        Opens a streaming GET request, guarded by the circuit breaker but neither rate limited nor retried
+        :param path:
+        :param headers:
+        :param timeout:
+        :return: the response, the caller is responsible for closing it
+        """
+        if not self.circuit_breaker.allow():
+            self.metrics.inc('hue_circuit_rejected_total', bridge=self.bridge)
+            raise requests.ConnectionError(circuit_open(self.bridge, self.circuit_breaker).description)
+        try:
+            response = self.session.get(self.url(path), headers=headers, stream=True, timeout=timeout)
+        except requests.RequestException:
+            self.circuit_breaker.record_failure()
+            raise
+        self.circuit_breaker.record_success()
+        response.raise_for_status()
+        return response
+
+    def send(self, method, path, endpoint, body=None, timeout=None):
+        """
+        Sends a request once the rate limiter allows it. Calls fail fast while the circuit breaker is open, and
+        idempotent calls are retried with jittered backoff as long as the call's deadline allows
+        :param method:
+        :param path: path of the URL on the bridge
+        :param endpoint: the API's endpoint, which picks the rate limit bucket and metrics label
+        :param body:
+        :param timeout: seconds the whole call may take, retries included, defaults to self.deadline
+        :return: the response, or an ErrorResult if the bridge couldn't be reached
+        """
+        call = self.call(method, endpoint, timeout)
+        while True:
+            rejected = call.admit()
+            if rejected is not None:
+                return rejected
+            self.rate_limiter.acquire(method, endpoint)
+            remaining = call.time_left()
+            if remaining is None:
+                return call.timed_out()
+
+            response = None
+            try:
+                response = self._request(method, path, endpoint, body,
+                                         tuple(min(part, remaining) for part in self.timeout))
+                if call.answered(response.status_code, self.RETRY_STATUSES):
+                    return response
+            except requests.RequestException as e:
+                call.fail(ErrorResult.TIMEOUT if isinstance(e, requests.Timeout) else ErrorResult.CONNECTION, e,
+                          sent=not isinstance(e, requests.ConnectTimeout))
+            except BaseException:
+                call.abandon()
+                raise
+
+            delay = call.retry_delay()
+            if delay is None:
+                return response if response is not None else call.failure
+            sleep(delay)
+
+    def _request(self, method, path, endpoint, body, timeout):
+        """
+        Makes a single request, recording its round trip if metrics are enabled
+        :param method:
+        :param path:
+        :param endpoint:
+        :param body:
+        :param timeout: connect and read timeout
+        :return: the response
+        """
+        url = self.url(path)
+        if not self.metrics.enabled:
+            return self.session.request(method, url, data=body, timeout=timeout)
+
+        label = endpoint_label(endpoint)
+        start = perf_counter()
+        try:
+            response = self.session.request(method, url, data=body, timeout=timeout)
+        except requests.Timeout:
+            self.metrics.inc('hue_request_timeouts_total', method=method, endpoint=label)
+            raise
+        except requests.RequestException:
+            self.metrics.inc('hue_request_errors_total', method=method, endpoint=label, status='connection')
+            raise
+        self.metrics.observe('hue_request_duration_seconds', perf_counter() - start, method=method, endpoint=label)
+        self.metrics.inc('hue_response_bytes_total', len(response.content), method=method, endpoint=label)
+        if body:
+            self.metrics.inc('hue_request_bytes_total', len(body), method=method, endpoint=label)
+        if response.status_code >= 400:
+            self.metrics.inc('hue_request_errors_total', method=method, endpoint=label,
+                             status=str(response.status_code))
+        return response
+
+
+def register_rate_limiter_metrics(metrics, rate_limiter, bridge):
+    """
+    Exposes the wait time and throttle counters of a rate limiter's buckets as gauges
+    :param metrics:
+    :param rate_limiter:
+    :param bridge: bridge address the rate limiter is for, labels the gauges so several bridges don't collide
+    :return: list of the registered gauges as name, function and labels
+    """
+    gauges = []
+    for name, bucket in rate_limiter.buckets.items():
+        labels = {'bridge': bridge, 'bucket': name}
+        gauges.append(('hue_rate_limit_wait_seconds', bucket.queue_wait, labels))
+        gauges.append(('hue_rate_limit_throttled', lambda bucket=bucket: bucket.throttled, labels))
+    for name, function, labels in gauges:
+        metrics.gauge(name, function, **labels)
+    return gauges
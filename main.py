@@ -2,28 +2,67 @@
 # -*- coding: utf-8 -*-
 
 
+import os
 import wx
-from hue import Clipv2, Room, Light
-from worker import Response, Request, Worker
-from queue import Queue
-from time import time_ns
+from hue import Clipv2, AsyncClipv2, SyncAsyncClipv2, Room, Light, Topology, Snapshot, PollPolicy, DebugFrame, \
+    MetricsServer, ErrorResult, create_client
+from hue.metrics import default_metrics
+from worker import Response, Request, WorkerPool, EventListener, batch_changes
+from time import monotonic
 
 
 class MainFrame(wx.Frame):
+    WORKERS = 4
+    # Responses are applied at most once per frame
+    FRAME_INTERVAL = 1 / 60
+    # Build the remaining room tabs while the application is idle
+    PREBUILD_ROOMS = False
+    # Seconds until loading the topology is tried again while nothing could be loaded yet
+    TOPOLOGY_RETRY = 5
+
     def __init__(self):
         wx.Frame.__init__(self, None, wx.ID_ANY, "PyHue", size=(600, 1200))
         panel = wx.Panel(self)
         self._notebook = wx.Notebook(panel)
 
-        # Add tabs here
-        self.hue = Clipv2()
-        rooms = self.hue.list_rooms()
-        lights = self.hue.list_lights()
+        # Metrics are off unless asked for, opening the debug window with Ctrl+Shift+D turns them on as well
+        self.metrics_server = None
+        self.debug_frame = None
+        self.start_metrics()
+
+        # Add tabs here, the client's pool has room for every worker plus the event stream. With several bridges in the
+        # config they're shown as one house
+        self.hue = create_client(pool_size=self.WORKERS + 2)
 
-        # Load room tabs
-        for room_id, room in rooms.items():
-            room_panel = Room(self._notebook, room, lights)
+        # Start from the local snapshot if there is one, the bridge is then queried in the background
+        self.snapshot = Snapshot(self.hue.bridge)
+        cached = self.snapshot.load()
+        data = cached or Topology.fetch(self.hue)
+        # Whether rooms and lights were loaded from anywhere, a bridge without any counts as loaded
+        self.loaded = bool(data)
+        if not data:
+            # Start empty, the rooms are added once the bridge answers
+            print(self.topology_failure(data))
+            data = {'rooms': {}, 'zones': {}, 'lights': {}, 'bridge_id': None}
+        self.bridge_id = data['bridge_id']
+        self.topology = Topology()
+        self.topology.update_rooms(data['rooms'])
+        self.topology.update_zones(data['zones'])
+        self.topology.update_lights(data['lights'])
+
+        # Load room tabs as placeholders, a room's light panels are only built once it's shown
+        self.rooms = {}
+        self.light_panels = {}
+        for room_id, room in self.topology.rooms.items():
+            room_panel = self.create_room_panel(room_id)
             self._notebook.AddPage(room_panel, room_panel.name)
+            self.add_room_to_index(room_panel)
+        self.groups = self.topology.grouped_lights()
+        if self._notebook.GetPageCount():
+            self.build_room(self._notebook.GetPage(0))
+        self._notebook.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGED, self.on_page_changed)
+        if self.PREBUILD_ROOMS:
+            self.Bind(wx.EVT_IDLE, self.on_idle)
 
         sizer = wx.BoxSizer(wx.VERTICAL)
         sizer.Add(self._notebook, 1, wx.ALL | wx.EXPAND, 5)
@@ -32,72 +71,322 @@ class MainFrame(wx.Frame):
 
         self.Show()
 
-        # Worker thread setup
-        self.request_queue = Queue()
-        self.thread = Worker(self.request_queue)
+        # Worker thread setup, the workers wake the UI thread when responses arrive
+        self.delivery = None
+        self.last_delivery = 0
+        self.batch = None
+        if isinstance(self.hue, Clipv2) and AsyncClipv2.available():
+            self.batch = SyncAsyncClipv2(AsyncClipv2.from_client(self.hue))
+        self.thread = WorkerPool(self.hue, self.WORKERS, self.batch,
+                                 notify=lambda: wx.CallAfter(self.deliver_responses))
+        self.request_queue = self.thread.request_queue
         self.thread.start()
+        if cached or not self.loaded:
+            self.request_queue.put(Request('load_topology'))
+        else:
+            self.save_snapshot()
+
+        # Push updates from the bridge, polling is only used while the stream is down
+        self.listener = EventListener(self.hue, self.thread.response_queue)
+        self.listener.start()
 
         self.Bind(wx.EVT_CLOSE, self.on_close)
 
-        # Set up a timer to regularly poll the light states from the API
-        self.busy = False
+        # Set up a timer to poll the light states from the API, the poll policy adapts its interval to what's going on
+        self.poll_policy = PollPolicy()
         self.timer = wx.Timer(self)
-        self.last_full_update = time_ns()
-        self.timer.Start(200)
+        self.timer.StartOnce(int(self.poll_policy.next_interval() * 1000))
         self.Bind(wx.EVT_TIMER, self.update_light_states)
+        self.Bind(wx.EVT_SLIDER, self.on_interaction)
+        self.Bind(wx.EVT_BUTTON, self.on_interaction)
+        self.Bind(wx.EVT_ICONIZE, self.on_iconize)
+        self.Bind(wx.EVT_ACTIVATE, self.on_activate)
+
+        debug_id = wx.NewIdRef()
+        self.Bind(wx.EVT_MENU, self.on_toggle_debug, id=debug_id)
+        self.SetAcceleratorTable(wx.AcceleratorTable([(wx.ACCEL_CTRL | wx.ACCEL_SHIFT, ord('D'), debug_id)]))
+
+    def start_metrics(self):
+        """
+        Enables metrics if PYHUE_METRICS is set, and serves them for Prometheus on localhost if PYHUE_METRICS_PORT is
+        :return:
+        """
+        port = os.environ.get('PYHUE_METRICS_PORT')
+        default_metrics.enabled = bool(os.environ.get('PYHUE_METRICS') or port)
+        if port:
+            self.metrics_server = MetricsServer(port=int(port)).start()
 
     def on_close(self, event):
         """
         Executes every time the main frame closes
         :return:
         """
+        self.timer.Stop()
+        self.thread.response_queue.notify = None
+        if self.delivery:
+            self.delivery.Stop()
+        self.save_snapshot()
+        self.listener.stop()
+        self.thread.shutdown(cancel=True, timeout=1)
+        if self.batch:
+            self.batch.close()
+        self.hue.close()
+        if self.metrics_server:
+            self.metrics_server.stop()
         self.Destroy()
 
+    def on_toggle_debug(self, event):
+        """
+        Opens or closes the metrics window
+        :param event:
+        :return:
+        """
+        if self.debug_frame:
+            self.debug_frame.Close()
+            self.debug_frame = None
+        else:
+            self.debug_frame = DebugFrame(self)
+            self.debug_frame.Show()
+
+    def on_page_changed(self, event):
+        """
+        Builds a room's light panels the first time its tab is shown
+        :param event:
+        :return:
+        """
+        if event.GetSelection() != wx.NOT_FOUND:
+            self.build_room(self._notebook.GetPage(event.GetSelection()))
+        event.Skip()
+
+    def on_idle(self, event):
+        """
+        Builds one room that hasn't been shown yet per idle event
+        :param event:
+        :return:
+        """
+        for room_panel in self.rooms.values():
+            if not room_panel.built:
+                self.build_room(room_panel)
+                event.RequestMore()
+                return
+        self.Unbind(wx.EVT_IDLE)
+
+    def on_interaction(self, event):
+        """
+        Sends the user's changes as soon as a control is touched and switches to fast polling
+        :param event:
+        :return:
+        """
+        self.send_pending_changes()
+        self.poll_policy.note_interaction()
+        if self.poll_policy.interval > PollPolicy.ACTIVE_INTERVAL:
+            self.timer.StartOnce(int(PollPolicy.ACTIVE_INTERVAL * 1000))
+        event.Skip()
+
+    def on_iconize(self, event):
+        """
+        Polls slowly while the window is minimised
+        :param event:
+        :return:
+        """
+        self.poll_policy.set_hidden(event.IsIconized())
+        if not event.IsIconized():
+            self.timer.StartOnce(int(PollPolicy.ACTIVE_INTERVAL * 1000))
+        event.Skip()
+
+    def on_activate(self, event):
+        """
+        Backs off polling faster while the window doesn't have focus
+        :param event:
+        :return:
+        """
+        self.poll_policy.set_focused(event.GetActive())
+        event.Skip()
+
     def update_light_states(self, event):
         """
-        Update the light states
+        Polls the light states while the event stream is down and schedules the next poll
         :param event:
         :return:
         """
-        if self.busy:
-            return
-        self.busy = True
+        now = monotonic()
 
-        if time_ns() > self.last_full_update + 1000000000:
+        # While the event stream is up it keeps the states current, the timer then only checks that it still is
+        self.poll_policy.set_streaming(self.listener.connected)
+        if self.listener.connected:
+            self.poll_policy.note_refresh(now)
+        elif self.poll_policy.refresh_due(now):
             self.request_queue.put(Request('list_lights'))
-            self.last_full_update = time_ns()
-
-        for tab in self._notebook.GetChildren():
-            for light_panel in tab.panels:
-                if light_panel.new_state:
-                    self.thread.request_queue.put(Request('set_light_state', light_panel.new_state, light_panel.light_id))
-                    light_panel.new_state = {}
-                    light_panel.expected_updates += 1
-
-        while not self.thread.response_queue.empty():
-            response = self.thread.response_queue.get()
-            if response.light_id and response.payload:
+            self.poll_policy.note_refresh(now)
+
+        self.timer.StartOnce(int(self.poll_policy.next_interval(now) * 1000))
+
+    def send_pending_changes(self):
+        """
+        Queues the changes made in the light panels, showing them locally until the bridge confirms them
+        :return:
+        """
+        pending = {}
+        for light_panel in self.light_panels.values():
+            if light_panel.new_state:
+                pending[light_panel.light_id] = light_panel.new_state
+                light_panel.apply_local(light_panel.new_state)
+                light_panel.new_state = {}
+
+        for request in batch_changes(pending, self.groups):
+            self.request_queue.put(request)
+
+    def deliver_responses(self):
+        """
+        Applies every queued response in one pass, a pass that comes sooner than a frame after the previous one is
+        postponed so bursts of responses are coalesced
+        :return:
+        """
+        self.delivery = None
+        now = monotonic()
+        wait = self.last_delivery + self.FRAME_INTERVAL - now
+        if wait > 0:
+            self.delivery = wx.CallLater(max(1, int(wait * 1000)), self.deliver_responses)
+            return
+        self.last_delivery = now
+
+        changed = 0
+        for response in self.thread.response_queue.drain():
+            if response.light_id:
                 light_panel = self.get_light_panel_with_id(response.light_id)
-                if light_panel:
-                    if light_panel.expected_updates <= 1:
-                        light_panel.set_state(response.payload)
-                    if light_panel.expected_updates > 0:
-                        light_panel.expected_updates -= 1
-            elif not response.light_id:
-                self.set_light_states(response.payload)
+                if response.error:
+                    print("Updating light "+response.light_id+" failed: "+", ".join(response.error))
+                    if response.payload:
+                        self.topology.update_light(response.payload)
+                    if light_panel:
+                        light_panel.reconcile(response.payload)
+                elif light_panel:
+                    light_panel.confirm(response.payload)
+            elif response.request_type == 'load_topology':
+                self.apply_topology(response.payload, response.error)
+            elif response.partial:
+                changed += self.update_light_states_partial(response.payload)
+            elif response.payload:
+                changed += self.set_light_states(response.payload)
+        self.poll_policy.note_change(changed, now)
 
-        self.busy = False
+    def apply_topology(self, data, errors=None):
+        """
+        Applies freshly fetched rooms, zones and lights on top of what was loaded from the snapshot
+        :param data:
+        :param errors: errors of a load that raised
+        :return:
+        """
+        if not data:
+            print(self.topology_failure(data, errors))
+            if not self.loaded:
+                wx.CallLater(self.TOPOLOGY_RETRY * 1000, self.request_queue.put, Request('load_topology'))
+            return
+        self.loaded = True
+        if data['failed']:
+            # Their rooms and lights are kept as they were until they answer again
+            print("Couldn't reach bridges "+", ".join(data['failed'])+", showing what was known of them")
+        if self.bridge_id and data['bridge_id'] and data['bridge_id'] != self.bridge_id:
+            # Another bridge is answering on this address, nothing in the snapshot can be trusted
+            print("Bridge "+self.hue.bridge+" changed identity, discarding snapshot")
+            self.snapshot.invalidate()
+        self.bridge_id = data['bridge_id'] or self.bridge_id
+
+        affected = self.topology.update_rooms(data['rooms']) | self.topology.update_zones(data['zones'])
+        for room_id in affected:
+            self.rebuild_room(room_id)
+        # After starting empty the first tab only appears now
+        selection = self._notebook.GetSelection()
+        if selection != wx.NOT_FOUND:
+            self.build_room(self._notebook.GetPage(selection))
+        for room_id, room_panel in self.rooms.items():
+            name = self.topology.rooms[room_id].name
+            if name != room_panel.name:
+                room_panel.name = name
+                self._notebook.SetPageText(self._notebook.FindPage(room_panel), name)
+        self.groups = self.topology.grouped_lights()
+
+        self.set_light_states(data['lights'])
+        self.save_snapshot()
+
+    def topology_failure(self, data, errors=None):
+        """
+        Describes why the topology couldn't be loaded
+        :param data: what Topology.fetch returned
+        :param errors:
+        :return:
+        """
+        message = "Couldn't load lights and rooms from bridge "+self.hue.bridge
+        if isinstance(data, ErrorResult):
+            return message+": "+data.description
+        if errors:
+            return message+": "+", ".join(errors)
+        return message
+
+    def save_snapshot(self):
+        """
+        Stores the current topology and light states for the next start
+        :return:
+        """
+        self.snapshot.save(self.topology.rooms, self.topology.zones, self.topology.lights, self.bridge_id)
 
     def set_light_states(self, lights):
         """
-        Update all lights that are found in input as long as they aren't expecting state updates
+        Update all lights that are found in input, rooms whose lights were added, removed or moved are rebuilt
         :param lights:
-        :return:
+        :return: number of light panels that changed
         """
+        affected = self.topology.update_lights(lights)
+        for room_id in affected:
+            if room_id in self.rooms or room_id in self.topology.rooms:
+                self.rebuild_room(room_id)
+        if affected:
+            self.groups = self.topology.grouped_lights()
+
+        # Lights without a panel are kept up to date in the topology until their room is built
+        changed = []
         for light_id, light in lights.items():
             light_panel = self.get_light_panel_with_id(light_id)
-            if light_panel and light_panel.expected_updates == 0:
-                light_panel.set_state(light)
+            if light_panel and light_panel.set_state(light, render=False):
+                changed.append(light_panel)
+        return self.render_light_panels(changed)
+
+    def update_light_states_partial(self, changes):
+        """
+        Apply changed fields from the event stream to the stored light states and their panels
+        :param changes:
+        :return: number of light panels that changed
+        """
+        changed = []
+        for light_id, light_changes in changes.items():
+            light = self.topology.lights.get(light_id)
+            if not light:
+                continue
+            light.apply_clip(light_changes)
+            light_panel = self.get_light_panel_with_id(light_id)
+            if light_panel and light_panel.set_state(light, render=False):
+                changed.append(light_panel)
+        return self.render_light_panels(changed)
+
+    def render_light_panels(self, light_panels):
+        """
+        Pushes pending changes to the controls of the supplied light panels, freezing each affected room while its
+        panels are updated
+        :param light_panels:
+        :return: number of light panels rendered
+        """
+        rooms = {}
+        for light_panel in light_panels:
+            rooms.setdefault(light_panel.GetParent(), []).append(light_panel)
+
+        for room_panel, room_light_panels in rooms.items():
+            room_panel.Freeze()
+            try:
+                for light_panel in room_light_panels:
+                    light_panel.render()
+            finally:
+                room_panel.Thaw()
+        return len(light_panels)
 
     def get_light_panel_with_id(self, light_id):
         """
@@ -105,11 +394,67 @@ class MainFrame(wx.Frame):
         :param light_id:
         :return:
         """
-        for tab in self._notebook.GetChildren():
-            for light_panel in tab.panels:
-                if light_panel.light_id == light_id:
-                    return light_panel
-            return None
+        return self.light_panels.get(light_id)
+
+    def add_room_to_index(self, room_panel):
+        """
+        Adds a room and its light panels to the lookup indexes
+        :param room_panel:
+        :return:
+        """
+        self.rooms[room_panel.room_id] = room_panel
+        for light_panel in room_panel.panels:
+            self.light_panels[light_panel.light_id] = light_panel
+
+    def remove_room_from_index(self, room_panel):
+        """
+        Removes a room and its light panels from the lookup indexes
+        :param room_panel:
+        :return:
+        """
+        self.rooms.pop(room_panel.room_id, None)
+        for light_panel in room_panel.panels:
+            if self.light_panels.get(light_panel.light_id) is light_panel:
+                del self.light_panels[light_panel.light_id]
+
+    def create_room_panel(self, room_id):
+        """
+        Creates a placeholder tab for a room
+        :param room_id:
+        :return:
+        """
+        return Room(self._notebook, self.topology.rooms[room_id], lazy=True)
+
+    def build_room(self, room_panel):
+        """
+        Builds a room's light panels from the latest known light states, if that hasn't happened yet
+        :param room_panel:
+        :return:
+        """
+        if room_panel.built:
+            return
+        room_panel.build(self.topology.lights_for_group(room_panel.room_id))
+        self.add_room_to_index(room_panel)
+
+    def rebuild_room(self, room_id):
+        """
+        Replaces a room's tab after its lights changed, or removes it if the room no longer exists
+        :param room_id:
+        :return:
+        """
+        index = self._notebook.GetPageCount()
+        old_panel = self.rooms.get(room_id)
+        if old_panel:
+            index = self._notebook.FindPage(old_panel)
+            self.remove_room_from_index(old_panel)
+            self._notebook.DeletePage(index)
+
+        if room_id in self.topology.rooms:
+            room_panel = self.create_room_panel(room_id)
+            self._notebook.InsertPage(index, room_panel, room_panel.name)
+            self.add_room_to_index(room_panel)
+            if old_panel and old_panel.built:
+                self.build_room(room_panel)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import unittest
+from threading import Lock
+from time import monotonic, sleep
+from hue.metrics import Metrics
+from worker.coalescing_queue import CoalescingQueue
+from worker.pool import WorkerPool
+from worker.request import Request
+
+
+class FakeHue:
+    """
+    Records the writes it's sent, writes to the lights in slow take a while
+    """
+    def __init__(self, slow=(), delay=0.05):
+        self.slow = slow
+        self.delay = delay
+        self.metrics = Metrics()
+        self.log = []
+        self._lock = Lock()
+
+    def set_light_state(self, light_id, state):
+        sleep(self.delay if light_id in self.slow else 0.001)
+        with self._lock:
+            self.log.append(('light', light_id, state['brightness']))
+        return {'errors': [], 'data': [{'rid': light_id, 'rtype': 'light'}]}
+
+    def set_grouped_light_state(self, grouped_light_id, state):
+        with self._lock:
+            self.log.append(('group', grouped_light_id, state['brightness']))
+        return {'errors': [], 'data': [{'rid': grouped_light_id, 'rtype': 'grouped_light'}]}
+
+    def get_light_state(self, light_id):
+        return False
+
+
+class CoalescingQueueTest(unittest.TestCase):
+    def test_pending_light_writes_are_merged(self):
+        queue = CoalescingQueue()
+        queue.put(Request('set_light_state', {'on': True, 'brightness': 10}, 'a'))
+        queue.put(Request('set_light_state', {'brightness': 20}, 'a'))
+        queue.put(Request('set_light_state', {'brightness': 30}, 'b'))
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual(queue.dropped, 1)
+        self.assertEqual(queue.get_nowait().payload, {'on': True, 'brightness': 20})
+
+    def test_write_after_pickup_is_queued(self):
+        queue = CoalescingQueue()
+        queue.put(Request('set_light_state', {'brightness': 10}, 'a'))
+        queue.get_nowait()
+        queue.put(Request('set_light_state', {'brightness': 20}, 'a'))
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.dropped, 0)
+
+    def test_light_writes_merge_into_pending_batch(self):
+        queue = CoalescingQueue()
+        queue.put(Request('set_light_states', {'a': {'brightness': 10}, 'b': {'brightness': 10}}))
+        queue.put(Request('set_light_state', {'brightness': 20}, 'b'))
+        queue.put(Request('set_light_states', {'a': {'on': False}, 'c': {'brightness': 30}}))
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual(queue.dropped, 2)
+        self.assertEqual(queue.get_nowait().payload, {'a': {'brightness': 10, 'on': False}, 'b': {'brightness': 20}})
+        self.assertEqual(queue.get_nowait().payload, {'c': {'brightness': 30}})
+
+    def test_merging_does_not_change_callers_payload(self):
+        queue = CoalescingQueue()
+        state = {'brightness': 10}
+        queue.put(Request('set_light_state', state, 'a'))
+        queue.put(Request('set_light_state', {'brightness': 20}, 'a'))
+        self.assertEqual(state, {'brightness': 10})
+
+    def test_group_write_stops_merging_into_earlier_writes(self):
+        queue = CoalescingQueue()
+        queue.put(Request('set_light_state', {'brightness': 10}, 'a'))
+        queue.put(Request('set_grouped_light_state', {'brightness': 50}, group_id='g', light_ids=['a', 'b']))
+        queue.put(Request('set_light_state', {'brightness': 20}, 'a'))
+        self.assertEqual(queue.dropped, 0)
+        self.assertEqual([request.payload['brightness'] for request in queue.requests], [10, 50, 20])
+
+    def test_merge_group_until_picked_up(self):
+        queue = CoalescingQueue()
+        self.assertFalse(queue.merge_group('g', {'brightness': 60}))
+        queue.put(Request('set_grouped_light_state', {'on': True, 'brightness': 50}, group_id='g',
+                          light_ids=['a', 'b']))
+        self.assertTrue(queue.merge_group('g', {'brightness': 60}))
+        self.assertEqual(queue.dropped, 1)
+        self.assertEqual(queue.get_nowait().payload, {'on': True, 'brightness': 60})
+        self.assertFalse(queue.merge_group('g', {'brightness': 70}))
+
+
+class ShardedQueueTest(unittest.TestCase):
+    LIGHT_IDS = ['a', 'b', 'c', 'd', 'e']
+
+    def test_group_write_is_ordered_with_light_writes_on_every_shard(self):
+        hue = FakeHue(slow=('b',))
+        pool = WorkerPool(hue, size=4)
+        self.assertGreater(len({pool.request_queue.shard_for(light_id) for light_id in self.LIGHT_IDS}), 1)
+        pool.start()
+        for light_id in self.LIGHT_IDS:
+            pool.request_queue.put(Request('set_light_state', {'brightness': 1}, light_id))
+        pool.request_queue.put(Request('set_grouped_light_state', {'brightness': 2}, group_id='g',
+                                       light_ids=self.LIGHT_IDS))
+        for light_id in self.LIGHT_IDS:
+            pool.request_queue.put(Request('set_light_state', {'brightness': 3}, light_id))
+        pool.shutdown(timeout=5)
+
+        group = hue.log.index(('group', 'g', 2))
+        for light_id in self.LIGHT_IDS:
+            self.assertLess(hue.log.index(('light', light_id, 1)), group)
+            self.assertGreater(hue.log.index(('light', light_id, 3)), group)
+
+    def test_queued_group_writes_are_merged(self):
+        pool = WorkerPool(FakeHue(), size=4)
+        for brightness in (1, 2, 3):
+            pool.request_queue.put(Request('set_grouped_light_state', {'brightness': brightness}, group_id='g',
+                                           light_ids=self.LIGHT_IDS))
+        self.assertEqual(pool.dropped, 2)
+        pool.request_queue.put(Request('set_light_state', {'brightness': 4}, 'a'))
+        pool.request_queue.put(Request('set_grouped_light_state', {'brightness': 5}, group_id='g',
+                                       light_ids=self.LIGHT_IDS))
+        self.assertEqual(pool.dropped, 2)
+
+    def test_cancelled_shutdown_releases_fenced_group_write(self):
+        hue = FakeHue(delay=0.5)
+        pool = WorkerPool(hue, size=4)
+        shard_for = pool.request_queue.shard_for
+        busy = next(light_id for light_id in self.LIGHT_IDS[1:] if shard_for(light_id) != shard_for('a'))
+        pool.start()
+        # Keeps a shard busy, so the group write's fence on it is still queued when the pool shuts down
+        hue.slow = (busy,)
+        pool.request_queue.put(Request('set_light_state', {'brightness': 1}, busy))
+        sleep(0.05)
+        pool.request_queue.put(Request('set_grouped_light_state', {'brightness': 2}, group_id='g',
+                                       light_ids=self.LIGHT_IDS))
+        sleep(0.05)
+        started = monotonic()
+        pool.shutdown(cancel=True, timeout=5)
+
+        self.assertLess(monotonic() - started, 2)
+        self.assertFalse(any(worker.is_alive() for worker in pool.workers))
+        self.assertNotIn(('group', 'g', 2), hue.log)
+        failed = set()
+        while not pool.response_queue.empty():
+            response = pool.response_queue.get()
+            if response.error:
+                failed.add(response.light_id)
+        self.assertEqual(failed, set(self.LIGHT_IDS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import unittest
+from time import sleep
+from unittest import mock
+from hue.metrics import Metrics
+from hue.resilience import Call, CircuitBreaker, ErrorResult, RetryPolicy
+from hue.transport import Transport
+
+
+class SlowRateLimiter:
+    """
+    Rate limiter that holds every request until after its deadline
+    """
+    buckets = {}
+
+    def __init__(self, wait):
+        self.wait = wait
+
+    def acquire(self, method, endpoint):
+        sleep(self.wait)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def open_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        breaker.record_failure()
+        return breaker
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.rejected, 1)
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_lets_one_probe_through(self):
+        breaker = self.open_breaker()
+        sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_successful_probe_closes(self):
+        breaker = self.open_breaker()
+        sleep(0.06)
+        breaker.allow()
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        breaker = self.open_breaker()
+        sleep(0.06)
+        breaker.allow()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertGreater(breaker.retry_in(), 0)
+
+    def test_released_probe_goes_to_next_call(self):
+        breaker = self.open_breaker()
+        sleep(0.06)
+        breaker.allow()
+        breaker.release()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+
+    def test_release_keeps_closed_circuit_closed(self):
+        breaker = CircuitBreaker()
+        breaker.allow()
+        breaker.release()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class CallTest(unittest.TestCase):
+    def call(self, method='GET', idempotent=True, timeout=10):
+        return Call('bridge', method, 'light', timeout, RetryPolicy(attempts=3, base_delay=0, max_delay=0),
+                    CircuitBreaker(failure_threshold=5, reset_timeout=60), Metrics(), idempotent)
+
+    def test_idempotent_call_retries_until_attempts_run_out(self):
+        call = self.call()
+        for _ in range(2):
+            self.assertIsNone(call.admit())
+            call.fail(ErrorResult.CONNECTION, OSError('refused'))
+            self.assertEqual(call.retry_delay(), 0)
+        self.assertIsNone(call.admit())
+        call.fail(ErrorResult.CONNECTION, OSError('refused'))
+        self.assertIsNone(call.retry_delay())
+        self.assertEqual(call.failure.kind, ErrorResult.CONNECTION)
+
+    def test_write_is_only_retried_if_it_was_not_sent(self):
+        call = self.call('PUT', idempotent=False)
+        call.admit()
+        call.fail(ErrorResult.CONNECTION, OSError('refused'), sent=False)
+        self.assertEqual(call.retry_delay(), 0)
+        call.admit()
+        call.fail(ErrorResult.TIMEOUT, OSError('read timed out'))
+        self.assertIsNone(call.retry_delay())
+
+    def test_retry_status_is_retried_and_other_answers_are_not(self):
+        call = self.call()
+        call.admit()
+        self.assertFalse(call.answered(503, (503,)))
+        self.assertFalse(call.failed)
+        self.assertEqual(call.retry_delay(), 0)
+        call.admit()
+        self.assertTrue(call.answered(200, (503,)))
+
+    def test_open_circuit_ends_call_with_last_failure(self):
+        call = self.call()
+        call.circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        call.admit()
+        call.fail(ErrorResult.CONNECTION, OSError('refused'))
+        self.assertIs(call.admit(), call.failure)
+        fresh = self.call()
+        fresh.circuit_breaker = call.circuit_breaker
+        self.assertEqual(fresh.admit().kind, ErrorResult.CIRCUIT_OPEN)
+
+    def test_passed_deadline_releases_probe(self):
+        call = self.call(timeout=0)
+        call.circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        call.circuit_breaker.record_failure()
+        self.assertIsNone(call.admit())
+        self.assertIsNone(call.time_left())
+        self.assertEqual(call.timed_out().kind, ErrorResult.TIMEOUT)
+        self.assertTrue(call.circuit_breaker.allow())
+
+
+class TransportCircuitTest(unittest.TestCase):
+    def test_deadline_after_allow_releases_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure()
+        transport = Transport('127.0.0.1:1', 'http://', rate_limiter=SlowRateLimiter(0.05), circuit_breaker=breaker)
+        with mock.patch.object(transport, '_request') as request:
+            result = transport.send('GET', 'clip/v2/resource/light', 'resource/light', timeout=0.01)
+        request.assert_not_called()
+        self.assertIsInstance(result, ErrorResult)
+        self.assertEqual(result.kind, ErrorResult.TIMEOUT)
+        self.assertNotEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+
+    def test_unexpected_error_releases_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure()
+        transport = Transport('127.0.0.1:1', 'http://', rate_limiter=SlowRateLimiter(0), circuit_breaker=breaker)
+        with mock.patch.object(transport, '_request', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                transport.send('GET', 'clip/v2/resource/light', 'resource/light')
+        self.assertTrue(breaker.allow())
+
+
+class TransportTimeoutTest(unittest.TestCase):
+    def test_scalar_timeout_is_used_for_connect_and_read(self):
+        transport = Transport('127.0.0.1:1', 'http://', timeout=5, rate_limiter=SlowRateLimiter(0))
+        self.assertEqual(transport.timeout, (5, 5))
+        with mock.patch.object(transport, '_request') as request:
+            request.return_value.status_code = 200
+            transport.send('GET', 'clip/v2/resource/light', 'resource/light', timeout=2)
+        connect, read = request.call_args[0][4]
+        self.assertLessEqual(connect, 2)
+        self.assertLessEqual(read, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
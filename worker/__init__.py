@@ -1,5 +1,11 @@
-__all__ = ['Worker', 'Request', 'Response']
+__all__ = ['Worker', 'WorkerPool', 'CoalescingQueue', 'ResponseQueue', 'EventListener', 'Request', 'Response',
+           'batch_changes']
 
 from .worker import Worker
+from .pool import WorkerPool
+from .coalescing_queue import CoalescingQueue
+from .response_queue import ResponseQueue
+from .listener import EventListener
 from .request import Request
 from .response import Response
+from .batcher import batch_changes
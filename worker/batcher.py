@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from .request import Request
+
+# A group of a single light is written as that light, grouped_light writes are rate limited far more strictly
+MIN_GROUP_SIZE = 2
+
+
+def batch_changes(changes, groups):
+    """
+    Turns pending light changes into requests, changes that set every light of a group to the same state are collapsed
+    into a single grouped_light write and everything else falls back to per-light writes
+    :param changes: dict of light_id => state
+    :param groups: dict of grouped_light_id => list of light ids
+    :return: list of requests
+    """
+    requests = []
+    remaining = dict(changes)
+
+    # Larger groups first so a whole-house change isn't split up by the rooms in it
+    for group_id, light_ids in sorted(groups.items(), key=lambda group: len(group[1]), reverse=True):
+        if len(light_ids) < MIN_GROUP_SIZE or any(light_id not in remaining for light_id in light_ids):
+            continue
+        state = remaining[light_ids[0]]
+        if any(remaining[light_id] != state for light_id in light_ids):
+            continue
+        requests.append(Request('set_grouped_light_state', state, group_id=group_id, light_ids=list(light_ids)))
+        for light_id in light_ids:
+            del remaining[light_id]
+
+    # Changes to several lights are sent concurrently as one batch
+    if len(remaining) > 1:
+        requests.append(Request('set_light_states', remaining))
+    elif remaining:
+        light_id, state = remaining.popitem()
+        requests.append(Request('set_light_state', state, light_id))
+    return requests
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+from queue import Empty
+from threading import Condition
+
+
+class CoalescingQueue:
+    """
+    Request queue that merges light state writes which are still waiting to be sent. A write for a light whose previous
+    write hasn't been picked up yet is folded into that pending write property by property, last write wins, so the
+    worker only ever sends the latest merged state.
+    """
+    def __init__(self):
+        self.requests = deque()
+        self.pending = {}
+        # grouped_light_id => queued group write, see merge_group
+        self.pending_groups = {}
+        self.dropped = 0
+        self._condition = Condition()
+
+    def put(self, request):
+        """
+        Adds a request to the queue, merging light state writes into pending ones where possible
+        :param request:
+        :return:
+        """
+        with self._condition:
+            if request.request_type == 'set_light_state':
+                if self._merge(request.light_id, request.payload):
+                    return
+                request.payload = dict(request.payload)
+                self.pending[request.light_id] = request
+            elif request.request_type == 'set_light_states':
+                states = {}
+                for light_id, state in request.payload.items():
+                    if not self._merge(light_id, state):
+                        states[light_id] = dict(state)
+                if not states:
+                    return
+                request.payload = states
+                for light_id in states:
+                    self.pending[light_id] = request
+            elif request.request_type in ('set_grouped_light_state', 'fence'):
+                # Later writes to the group's lights must not be merged into writes queued before the group write
+                for light_id in request.light_ids:
+                    self.pending.pop(light_id, None)
+                if request.request_type == 'set_grouped_light_state':
+                    request.payload = dict(request.payload)
+                    self.pending_groups[request.group_id] = request
+
+            self.requests.append(request)
+            self._condition.notify()
+
+    def _merge(self, light_id, state):
+        """
+        Merges state into the pending write for light_id, returns False if there's no pending write
+        :param light_id:
+        :param state:
+        :return:
+        """
+        request = self.pending.get(light_id)
+        if request is None:
+            return False
+
+        pending_state = request.payload if request.request_type == 'set_light_state' else request.payload[light_id]
+        pending_state.update(state)
+        self.dropped += 1
+        return True
+
+    def merge_group(self, group_id, state):
+        """
+        Merges state into the queued write for a group, returns False if there's none or it has been picked up. It's up
+        to the caller to know that no write for the group's lights was queued after it, ShardedQueue does.
+        :param group_id:
+        :param state:
+        :return:
+        """
+        with self._condition:
+            request = self.pending_groups.get(group_id)
+            if request is None:
+                return False
+            request.payload.update(state)
+            self.dropped += 1
+            return True
+
+    def _pop(self):
+        """
+        Removes the oldest request and forgets its pending writes
+        :return:
+        """
+        request = self.requests.popleft()
+        if request.request_type == 'set_light_state':
+            self.pending.pop(request.light_id, None)
+        elif request.request_type == 'set_light_states':
+            for light_id in request.payload:
+                if self.pending.get(light_id) is request:
+                    del self.pending[light_id]
+        elif request.request_type == 'set_grouped_light_state':
+            if self.pending_groups.get(request.group_id) is request:
+                del self.pending_groups[request.group_id]
+        return request
+
+    def get(self, block=True, timeout=None):
+        """
+        Removes and returns the oldest request, waiting for one if necessary
+        :param block:
+        :param timeout:
+        :return:
+        """
+        with self._condition:
+            if block and not self._condition.wait_for(lambda: self.requests, timeout):
+                raise Empty
+            if not self.requests:
+                raise Empty
+            return self._pop()
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def empty(self):
+        with self._condition:
+            return not self.requests
+
+    def qsize(self):
+        with self._condition:
+            return len(self.requests)
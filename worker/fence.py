@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from threading import Barrier
+
+
+class Fence:
+    """
+    Lines up the workers whose shards own the lights of a group write. The worker that sends the group write waits
+    until every other shard has worked off the writes queued before it, and those shards hold back later writes until
+    the group write has been sent, so a room-wide write is ordered after and before the per-light writes around it.
+    """
+    # Seconds a worker waits for the others before giving up, so a stuck shard can't hold up the rest for good
+    TIMEOUT = 30
+
+    def __init__(self, parties, timeout=None):
+        """
+        :param parties: number of shards taking part, including the one sending the group write
+        :param timeout:
+        """
+        self._arrived = Barrier(parties, timeout=timeout or self.TIMEOUT)
+        self._done = Barrier(parties, timeout=timeout or self.TIMEOUT)
+
+    def run(self, action):
+        """
+        Waits for the other shards to arrive, runs action and lets them go on
+        :param action:
+        :return: what action returned
+        """
+        self._arrived.wait()
+        try:
+            return action()
+        finally:
+            self._done.wait()
+
+    def arrive(self):
+        """
+        Reports that this shard's earlier writes are done and waits until the group write has been sent
+        :return:
+        """
+        self._arrived.wait()
+        self._done.wait()
+
+    def abort(self):
+        """
+        Releases all waiting workers with a BrokenBarrierError, e.g. when a part of the fence was cancelled
+        :return:
+        """
+        self._arrived.abort()
+        self._done.abort()
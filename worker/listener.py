@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import threading
+from threading import Thread, Event
+from hue.eventstream import EventStreamParser
+from hue.metrics import default_metrics
+from .response import Response
+
+
+class EventListener(Thread):
+    """
+    Subscribes to the bridge's event stream and pushes changed light state to the response queue
+    """
+    MIN_BACKOFF = 1
+    MAX_BACKOFF = 30
+
+    def __init__(self, hue, response_queue, args=(), kwargs=None):
+        threading.Thread.__init__(self, args=args, kwargs=kwargs)
+        self.daemon = True
+        self.hue = hue
+        self.response_queue = response_queue
+        self.connected = False
+        self.metrics = getattr(hue, 'metrics', default_metrics)
+        self.metrics.gauge('hue_event_stream_connected', lambda: int(self.connected))
+        self.backoff = self.MIN_BACKOFF
+        self._stream = None
+        self._stopped = Event()
+
+    def stop(self):
+        """
+        Stops listening and closes the stream
+        :return:
+        """
+        self._stopped.set()
+        stream = self._stream
+        if stream is not None:
+            stream.close()
+
+    def run(self):
+        if not getattr(self.hue, 'EVENT_STREAM', True):
+            # Nothing to listen to, light states are polled instead
+            return
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                if not self._stopped.is_set():
+                    print("Event stream disconnected: "+str(e))
+                    self.metrics.inc('hue_event_stream_disconnects_total')
+            self.connected = False
+            if self._stopped.wait(self.backoff):
+                break
+            self.backoff = min(self.backoff * 2, self.MAX_BACKOFF)
+
+    def _listen(self):
+        """
+        Connects to the event stream and dispatches events until the stream ends
+        :return:
+        """
+        self._stream = self.hue.open_event_stream()
+        try:
+            self.connected = True
+            self.backoff = self.MIN_BACKOFF
+
+            # Anything that changed while we were disconnected has to be picked up with a full refresh
+            lights = self.hue.list_light_states()
+            if lights:
+                self.response_queue.put(Response(lights))
+
+            parser = EventStreamParser()
+            for messages in parser.parse(self._stream.iter_lines(decode_unicode=True)):
+                changes = parser.light_changes(messages)
+                if changes:
+                    self.metrics.inc('hue_event_light_changes_total', len(changes))
+                    self.response_queue.put(Response(changes, partial=True))
+        finally:
+            self._stream.close()
+            self._stream = None
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+import zlib
+from queue import Empty
+from threading import Lock
+from hue import Clipv2
+from hue.metrics import default_metrics
+from .coalescing_queue import CoalescingQueue
+from .fence import Fence
+from .request import Request
+from .response_queue import ResponseQueue
+from .worker import Worker
+
+
+class ShardedQueue:
+    """
+    Queue-like dispatcher that routes requests to per-shard queues by light id, so that requests for the same light
+    always end up on the same worker and are executed in order. A group write whose lights live on several shards is
+    fenced across those shards, so it's still ordered with the per-light writes queued before and after it. A group
+    write is merged into the queued write for the same group as long as no write for its lights came in between.
+    """
+    def __init__(self, queues, partitions=None):
+        """
+        :param queues:
+        :param partitions: optional dict of id namespace => indexes of the shards reserved for it, so that lights of
+                           different bridges never share a worker
+        """
+        self.queues = queues
+        self.partitions = partitions or {}
+        self._next = 0
+        # Requests spanning several shards have to be queued in the same order on all of them
+        self._lock = Lock()
+        # grouped_light_id => shard and lights of the last group write, while later group writes may be merged into it
+        self._groups = {}
+
+    def shard_for(self, light_id):
+        """
+        Returns the index of the shard that handles the specified light
+        :param light_id:
+        :return:
+        """
+        shard = zlib.crc32(light_id.encode())
+        if self.partitions:
+            shards = self.partitions.get(light_id.partition('/')[0])
+            if shards:
+                return shards[shard % len(shards)]
+        return shard % len(self.queues)
+
+    def put(self, request):
+        """
+        Routes a request to the shard(s) owning its light(s)
+        :param request:
+        :return:
+        """
+        with self._lock:
+            if request.request_type == 'set_light_states':
+                shards = {}
+                for light_id, state in request.payload.items():
+                    shards.setdefault(self.shard_for(light_id), {})[light_id] = state
+                for shard, states in shards.items():
+                    self.queues[shard].put(Request('set_light_states', states, queued_at=request.queued_at))
+                self._close_groups(request.payload)
+            elif request.light_id:
+                self.queues[self.shard_for(request.light_id)].put(request)
+                self._close_groups([request.light_id])
+            elif request.group_id:
+                self._put_group(request)
+            else:
+                # Requests that aren't tied to a light go round-robin
+                self.queues[self._next].put(request)
+                self._next = (self._next + 1) % len(self.queues)
+
+    def _put_group(self, request):
+        """
+        Queues a group write on the shard of its first light. Every other shard owning some of its lights gets a fence
+        request, so the group write is only sent once those shards have sent what was queued before it, and they
+        only go on once it has been sent.
+        :param request:
+        :return:
+        """
+        light_ids = request.light_ids or [request.group_id]
+        merge_into = self._groups.get(request.group_id)
+        if merge_into and merge_into[1] == set(light_ids) and \
+                self.queues[merge_into[0]].merge_group(request.group_id, request.payload):
+            return
+
+        shards = {}
+        for light_id in light_ids:
+            shards.setdefault(self.shard_for(light_id), []).append(light_id)
+        shards = list(shards.items())
+        if len(shards) > 1:
+            request.fence = Fence(len(shards))
+            for shard, shard_light_ids in shards[1:]:
+                self.queues[shard].put(Request('fence', light_ids=shard_light_ids, queued_at=request.queued_at,
+                                               fence=request.fence))
+        self.queues[shards[0][0]].put(request)
+        # Other groups sharing lights with this one, e.g. a zone spanning the room, can't be merged into any more
+        self._close_groups(light_ids)
+        self._groups[request.group_id] = (shards[0][0], set(light_ids))
+
+    def _close_groups(self, light_ids):
+        """
+        Stops merging group writes into queued ones for groups containing any of the lights just written
+        :param light_ids:
+        :return:
+        """
+        for group_id, (shard, group_light_ids) in list(self._groups.items()):
+            if not group_light_ids.isdisjoint(light_ids):
+                del self._groups[group_id]
+
+    def empty(self):
+        return all(queue.empty() for queue in self.queues)
+
+    def qsize(self):
+        return sum(queue.qsize() for queue in self.queues)
+
+
+class WorkerPool:
+    """
+    Pool of workers sharing one Hue client and one response queue, with requests sharded by light id. With a
+    BridgePool every bridge gets workers of its own, so a slow bridge doesn't hold up requests to the others.
+    """
+    DEFAULT_SIZE = 4
+
+    def __init__(self, hue=None, size=None, batch=None, notify=None, metrics=None):
+        """
+        :param hue:
+        :param size: number of workers
+        :param batch: optional SyncAsyncClipv2 for concurrent batch writes
+        :param notify: called from a worker thread when responses become available, see ResponseQueue
+        :param metrics: defaults to the client's metrics
+        """
+        self.hue = hue or Clipv2()
+        self.size = max(size or self.DEFAULT_SIZE, len(getattr(self.hue, 'namespaces', ())))
+        self.metrics = metrics or getattr(self.hue, 'metrics', default_metrics)
+        self.response_queue = ResponseQueue(notify)
+        self.workers = [Worker(CoalescingQueue(), self.hue, batch, response_queue=self.response_queue,
+                               metrics=self.metrics)
+                        for i in range(self.size)]
+        self.request_queue = ShardedQueue([worker.request_queue for worker in self.workers],
+                                          self.partition(getattr(self.hue, 'namespaces', None)))
+
+        self.metrics.gauge('hue_request_queue_depth', self.request_queue.qsize)
+        self.metrics.gauge('hue_response_queue_depth', self.response_queue.qsize)
+        self.metrics.gauge('hue_coalesced_writes', lambda: self.dropped)
+
+    def partition(self, namespaces):
+        """
+        Spreads the workers over the bridges of a BridgePool, every bridge gets at least one
+        :param namespaces:
+        :return: dict of namespace => worker indexes or None without namespaces
+        """
+        if not namespaces or len(namespaces) < 2:
+            return None
+        return {namespace: [index for index in range(self.size) if index % len(namespaces) == position]
+                for position, namespace in enumerate(namespaces)}
+
+    @property
+    def dropped(self):
+        """
+        Number of light state writes that were merged into a newer pending write instead of being sent
+        :return:
+        """
+        return sum(worker.request_queue.dropped for worker in self.workers)
+
+    def start(self):
+        """
+        Starts all workers
+        :return:
+        """
+        for worker in self.workers:
+            worker.start()
+
+    def shutdown(self, cancel=False, timeout=None):
+        """
+        Stops all workers once they've finished their pending requests, or drops pending requests if cancel is set
+        :param cancel:
+        :param timeout:
+        :return:
+        """
+        for worker in self.workers:
+            if cancel:
+                try:
+                    while True:
+                        request = worker.request_queue.get_nowait()
+                        # Workers waiting on the other parts of a cancelled group write mustn't wait for it
+                        if request.fence:
+                            request.fence.abort()
+                except Empty:
+                    pass
+            worker.request_queue.put(Request('stop'))
+
+        for worker in self.workers:
+            worker.join(timeout)
@@ -1,8 +1,18 @@
 # -*- coding: utf-8 -*-
+from time import monotonic
 
 
 class Request:
-    def __init__(self, request_type, payload=None, light_id=None):
+    __slots__ = ('request_type', 'payload', 'light_id', 'group_id', 'light_ids', 'queued_at', 'fence')
+
+    def __init__(self, request_type, payload=None, light_id=None, group_id=None, light_ids=None, queued_at=None,
+                 fence=None):
         self.request_type = request_type
         self.payload = payload
         self.light_id = light_id
+        self.group_id = group_id
+        self.light_ids = light_ids
+        # Kept when a request is split or merged so queue wait and confirmation latency count from the first command
+        self.queued_at = queued_at or monotonic()
+        # Fence shared with the other shards a group write spans, see ShardedQueue.put
+        self.fence = fence
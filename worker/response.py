@@ -2,6 +2,17 @@
 
 
 class Response:
-    def __init__(self, payload, light_id=None):
+    """
+    Result passed from the worker layer to the UI. Without a light_id the payload maps light ids to full states, or to
+    changed fields if partial is set. With a light_id and partial set it is the state confirmed by a write, with error
+    set the write failed and the payload is the light's actual state. Responses to requests that don't deal with light
+    states carry their request_type.
+    """
+    __slots__ = ('payload', 'light_id', 'partial', 'error', 'request_type')
+
+    def __init__(self, payload, light_id=None, partial=False, error=None, request_type=None):
         self.payload = payload
         self.light_id = light_id
+        self.partial = partial
+        self.error = error
+        self.request_type = request_type
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from queue import Queue, Empty
+from threading import Lock
+
+
+class ResponseQueue(Queue):
+    """
+    Response queue that notifies its consumer when responses arrive. A burst of responses only causes one notification
+    until the consumer drains the queue.
+    """
+    def __init__(self, notify=None):
+        Queue.__init__(self)
+        self.notify = notify
+        self._notified = False
+        self._notify_lock = Lock()
+
+    def put(self, item, block=True, timeout=None):
+        Queue.put(self, item, block, timeout)
+        with self._notify_lock:
+            if self.notify is None or self._notified:
+                return
+            self._notified = True
+        self.notify()
+
+    def drain(self):
+        """
+        Removes and returns all queued responses, responses put after this call cause a new notification
+        :return:
+        """
+        with self._notify_lock:
+            self._notified = False
+        responses = []
+        try:
+            while True:
+                responses.append(self.get_nowait())
+        except Empty:
+            return responses
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 import threading
-from hue import Clipv2
-from threading import Thread
+from hue import Clipv2, Topology
+from hue.metrics import default_metrics
+from hue.model import LightState
+from threading import BrokenBarrierError, Thread
+from time import monotonic
 from queue import Queue
 from .response import Response
 
@@ -10,19 +13,120 @@ class Worker(Thread):
     """
     Update worker that handles all communication with the Hue API
     """
-    def __init__(self, request_queue, args=(), kwargs=None):
+    def __init__(self, request_queue, hue=None, batch=None, response_queue=None, metrics=None, args=(), kwargs=None):
         threading.Thread.__init__(self, args=args, kwargs=kwargs)
         self.daemon = True
-        self.hue = Clipv2()
-        self.response_queue = Queue()
+        self.hue = hue or Clipv2()
+        self.batch = batch
+        self.response_queue = response_queue or Queue()
         self.request_queue = request_queue
+        self.metrics = metrics or default_metrics
 
     def run(self):
         while True:
             request = self.request_queue.get()
-            if request.request_type == "list_lights":
-                self.response_queue.put(Response(self.hue.list_lights()))
-            elif request.request_type == 'set_light_state':
-                self.hue.set_light_state(request.light_id, request.payload)
-                state = self.hue.get_light_state(request.light_id)
-                self.response_queue.put(Response(state, request.light_id))
+            if self.metrics.enabled:
+                self.metrics.observe('hue_queue_wait_seconds', monotonic() - request.queued_at,
+                                     request_type=request.request_type)
+
+            if request.request_type == 'stop':
+                break
+            try:
+                self.handle(request)
+            except Exception as e:
+                # Whatever went wrong, the thread has to survive and the lights waiting on this request have to hear
+                print("Request "+request.request_type+" failed: "+repr(e))
+                self.fail(request, ['Request failed: '+str(e)])
+
+    def handle(self, request):
+        """
+        Executes a single request
+        :param request:
+        :return:
+        """
+        if request.request_type == "list_lights":
+            self.response_queue.put(Response(self.hue.list_light_states()))
+        elif request.request_type == 'load_topology':
+            self.response_queue.put(Response(Topology.fetch(self.hue), request_type='load_topology'))
+        elif request.request_type == 'set_light_state':
+            result = self.hue.set_light_state(request.light_id, request.payload)
+            self.confirm(request.light_id, request.payload, Clipv2.result_errors(result, request.light_id),
+                         request.queued_at)
+        elif request.request_type == 'set_light_states':
+            for light_id, result in self.set_light_states(request.payload).items():
+                self.confirm(light_id, request.payload[light_id], Clipv2.result_errors(result, light_id),
+                             request.queued_at)
+        elif request.request_type == 'set_grouped_light_state':
+            if request.fence:
+                try:
+                    result = request.fence.run(lambda: self.hue.set_grouped_light_state(request.group_id,
+                                                                                      request.payload))
+                except BrokenBarrierError:
+                    self.fail(request, ['Group write was cancelled or timed out waiting for earlier writes'])
+                    return
+            else:
+                result = self.hue.set_grouped_light_state(request.group_id, request.payload)
+            errors = Clipv2.result_errors(result, request.group_id)
+            for light_id in request.light_ids:
+                self.confirm(light_id, request.payload, errors, request.queued_at)
+        elif request.request_type == 'fence':
+            try:
+                request.fence.arrive()
+            except BrokenBarrierError:
+                # The worker sending the group write reports it
+                pass
+
+    def fail(self, request, errors):
+        """
+        Reports a request that raised instead of returning a result, without asking the bridge again
+        :param request:
+        :param errors:
+        :return:
+        """
+        if request.request_type == 'set_light_state':
+            light_ids = [request.light_id]
+        elif request.request_type == 'set_light_states':
+            light_ids = list(request.payload)
+        elif request.request_type == 'set_grouped_light_state':
+            light_ids = request.light_ids
+        elif request.request_type == 'fence':
+            return
+        else:
+            self.response_queue.put(Response(False, request_type=request.request_type, error=errors))
+            return
+        for light_id in light_ids:
+            if self.metrics.enabled:
+                self.metrics.inc('hue_command_errors_total', light=light_id)
+            self.response_queue.put(Response(False, light_id, error=errors))
+
+    def set_light_states(self, states):
+        """
+        Sets the state of several lights, concurrently if a batch client is available, otherwise as the backend
+        batches them
+        :param states: dict of light_id => state
+        :return: dict of light_id => result
+        """
+        if self.batch:
+            return self.batch.set_light_states(states)
+
+        return self.hue.set_light_states(states)
+
+    def confirm(self, light_id, state, errors, queued_at=None):
+        """
+        Reports the result of a write, the light's actual state is only read back if the write failed
+        :param light_id:
+        :param state:
+        :param errors:
+        :param queued_at: when the command was queued, for the command-to-confirmation latency
+        :return:
+        """
+        if self.metrics.enabled and queued_at:
+            if errors:
+                self.metrics.inc('hue_command_errors_total', light=light_id)
+            else:
+                self.metrics.observe('hue_command_confirmation_seconds', monotonic() - queued_at, light=light_id)
+        if errors:
+            state = self.hue.get_light_state(light_id)
+            self.response_queue.put(Response(LightState.from_clip(state) if state else False, light_id, error=errors))
+        else:
+            self.response_queue.put(Response(state, light_id, partial=True))